@@ -14,6 +14,14 @@ class JobParams(BaseModel):
     difference_module: str = "SSIM"
     difference_threshold: float  = 0.7
     compression_proportion: float  = 0.5
+    frame_source: str = "opencv"  # 取幀後端："opencv" | "ffmpeg" | "adaptive"
+    analysis_width: int = 0  # 僅 ffmpeg：解碼時直接縮到此寬度（0 = 原尺寸）
+    adaptive_min_fps: float = 0.5  # 僅 adaptive：畫面靜止時的最低抽樣率（target_fps 為上限）
+    adaptive_motion_threshold: float = 4.0  # 僅 adaptive：縮圖平均絕對差超過此值就回到 target_fps
+    ssim_pregate_mse: float = 0.0  # 僅 SSIM：縮圖 MSE 低於此值的幀對跳過 SSIM（0 = 關閉）
+    caption_cache_radius: int | None = None  # caption 快取的 Hamming 半徑（None = 用 worker 預設，負數 = 關閉）
+    activity_detector: str | None = None  # caption 前的人物 / 活動預偵測："off" | "mog2" | "hog"（None = 用 worker 預設）
+    activity_min_foreground: float | None = None  # 僅 mog2：前景比例低於此值視為沒有活動（None = 用 worker 預設）
 
 class JobCreateDTO(BaseModel):
     type: str = Field(..., description="例如 video_description_extraction")
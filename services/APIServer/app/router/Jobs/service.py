@@ -51,6 +51,23 @@ def _parse_iso_dt(s: str | None):
         return None
 
 
+def _event_embedding(event: dict):
+    """
+    取出事件的 embedding：ComputeServer 以 embedding_b64（float32 little-endian 的 base64）回傳，
+    舊版 worker 仍可能送 embedding（float list）；都沒有回 None。
+    """
+    b64 = event.get("embedding_b64")
+    if b64:
+        import base64
+        import numpy as np
+        try:
+            return np.frombuffer(base64.b64decode(b64), dtype="<f4")
+        except Exception as e:
+            print(f"[Jobs] embedding_b64 解碼失敗: {e}")
+            return None
+    return event.get("embedding")
+
+
 @jobs_router.post(JOBS_POST_CREATE_JOB, response_model=JobCreatedRespDTO, status_code=status.HTTP_201_CREATED)
 async def create_job(body: JobCreateDTO, db: AsyncSession = Depends(get_session), api_key = Depends(get_uploader_api_client)):
     """建立新的推論任務。
@@ -433,7 +450,13 @@ async def complete_job(job_id: str, body: JobCompleteDTO, db: AsyncSession = Dep
                     usage=usage,
                     assistant_replies=0,
                     trace_id=body.trace_id,
-                    meta={"job_id": str(jid_body), "job_type": job_type},
+                    meta={
+                        "job_id": str(jid_body),
+                        "job_type": job_type,
+                        # 命中 ComputeServer 的 LLM 快取：token 記 0，另記當初呼叫的用量
+                        "cached": bool(metrics.get("llm_cached")),
+                        "cached_total_tokens": int(metrics.get("llm_cached_total_tokens") or 0),
+                    },
                 )
         except Exception as e:
             print(f"[Jobs] 記錄 compute token 使用量失敗: {e}")
@@ -473,15 +496,22 @@ async def complete_job(job_id: str, body: JobCompleteDTO, db: AsyncSession = Dep
                 )
                 return OKRespDTO()
 
+            # 縮圖與影片 metadata 由 videosprocessing 在同一次解碼中產生，隨結果一起回傳
+            metrics = body.metrics or {}
+            rec_values = {
+                "is_processed": True,
+                "duration": metrics.get("video_duration_sec"),
+                "start_time": vstart,
+                "end_time": vend,
+            }
+            if metrics.get("thumbnail_s3_key"):
+                rec_values["thumbnail_s3_key"] = metrics["thumbnail_s3_key"]
+            if isinstance(metrics.get("video_metadata"), dict):
+                rec_values["video_metadata"] = metrics["video_metadata"]
             await db.execute(
                 update(recordings.Table)
                 .where(recordings.Table.id == vid)
-                .values(
-                    is_processed=True,
-                    duration=body.metrics.get("video_duration_sec") if body.metrics else None,
-                    start_time=vstart,
-                    end_time=vend
-                )
+                .values(**rec_values)
             )
             # events 新增
             """
@@ -553,7 +583,11 @@ async def complete_job(job_id: str, body: JobCompleteDTO, db: AsyncSession = Dep
                     )
                     return OKRespDTO()
                 
+                has_embedding = False
                 for event in body.events:
+                    embedding = _event_embedding(event)
+                    if embedding is not None and len(embedding) > 0:
+                        has_embedding = True
                     ev = events.Table(
                         user_id=recording_user_id,  # 🔧 修復：添加 user_id
                         recording_id=vid,
@@ -561,7 +595,7 @@ async def complete_job(job_id: str, body: JobCompleteDTO, db: AsyncSession = Dep
                         scene=event.get("scene"),
                         summary=event.get("summary"),
                         objects=event.get("objects"),
-                        embedding=event.get("embedding"), # 10/20/2025 Add embedding
+                        embedding=embedding, # 10/20/2025 Add embedding
                         start_time=vstart + timedelta(seconds=event.get("start_time")) if vstart and event.get("start_time") is not None else None,
                         duration=event.get("end_time") - event.get("start_time") if event.get("end_time") is not None and event.get("start_time") is not None else None
                     )
@@ -571,7 +605,6 @@ async def complete_job(job_id: str, body: JobCompleteDTO, db: AsyncSession = Dep
                 await db.commit()
                 
                 # 如果事件中沒有 embedding,則觸發 embedding 生成任務
-                has_embedding = any(event.get("embedding") for event in body.events)
                 if not has_embedding:
                     try:
                         from ...DataAccess.task_producer import enqueue
@@ -603,7 +636,21 @@ async def complete_job(job_id: str, body: JobCompleteDTO, db: AsyncSession = Dep
                     except Exception as e:
                         print(f"[Job] 觸發 embedding 生成任務失敗: {e}")
                 
-            # 縮圖生成已併入 ComputeServer 的 videosprocessing（同一支任務使用記憶體幀直接產生縮圖並回寫）
-            # 因此這裡不再 enqueue tasks.generate_video_thumbnail，避免重複工作與競態。
+            # 縮圖通常已由 videosprocessing 產生（metrics.thumbnail_s3_key）；
+            # 只有沒帶縮圖、且錄影本身也還沒有縮圖時，才退回獨立的 tasks.generate_video_thumbnail（需重新下載解碼）
+            if not metrics.get("thumbnail_s3_key"):
+                try:
+                    res_thumb = await db.execute(
+                        select(recordings.Table.thumbnail_s3_key).where(recordings.Table.id == vid)
+                    )
+                    if not res_thumb.scalar_one_or_none() and recording_s3_key:
+                        enqueue("tasks.generate_video_thumbnail", {
+                            "recording_id": str(vid),
+                            "video_url": recording_s3_key,
+                            "user_id": int(recording_user_id) if recording_user_id is not None else None,
+                        })
+                        print(f"[Job] 結果未含縮圖，改由 thumbnail 任務產生: recording_id={vid}")
+                except Exception as e:
+                    print(f"[Job] 觸發縮圖任務失敗: {e}")
     
     return OKRespDTO()
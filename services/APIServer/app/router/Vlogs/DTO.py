@@ -147,6 +147,7 @@ class VlogStatusUpdate(BaseModel):
     progress: float | None = Field(default=None, ge=0.0, le=100.0)
     status_message: str | None = None
     job_id: str | None = None  # 用於同步更新 inference_jobs
+    metrics: dict | None = None  # 合併進 inference_jobs.metrics（剪輯片段快取命中率、傳輸量等）
 
 class VlogStatusUpdateResponse(BaseModel):
     vlog_id: str
@@ -1036,6 +1036,11 @@ async def internal_update_vlog_status(
                         metrics["duration"] = float(body.duration)
                         job.metrics = metrics
                     
+                    # 同步 Compute Server 回報的統計（重新指定新的 dict，JSONB 才會被標記為已變更）
+                    if body.metrics:
+                        metrics = job.metrics if isinstance(job.metrics, dict) else {}
+                        job.metrics = {**metrics, **body.metrics}
+                    
                     job.updated_at = datetime.now(timezone.utc)
                     db.add(job)
                     print(f"[Vlog API] 同步更新 inference_jobs: job_id={jid}, status={mapped.value}, progress={job.progress}, error={job.error_message}")
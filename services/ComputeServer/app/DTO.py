@@ -33,7 +33,16 @@ class JobCreate(JobBase):
     blur_threshold: float, # 模糊閾值，預設為20.0
     difference_module: "SSIM",
     difference_threshold: 0.7,
-    compression_proportion: 0.5
+    compression_proportion: 0.5,
+    frame_source: "opencv" | "ffmpeg" | "adaptive", # 取幀後端，預設 opencv；ffmpeg 走 rawvideo pipe；adaptive 依動態調整抽樣率
+    analysis_width: int, # 僅 ffmpeg：解碼時直接縮到此寬度（0 = 原尺寸）
+    adaptive_min_fps: float, # 僅 adaptive：畫面靜止時的最低抽樣率（target_fps 為上限）
+    adaptive_motion_threshold: float, # 僅 adaptive：縮圖平均絕對差超過此值就回到 target_fps
+    ssim_pregate_mse: float, # 僅 SSIM：縮圖 MSE 低於此值的幀對跳過 SSIM（0 = 關閉）
+    camera_id: str, # 攝影機ID；有的話 caption 會先查同攝影機的感知雜湊快取
+    caption_cache_radius: int | None, # caption 快取的 Hamming 半徑（None = 用 worker 預設，負數 = 關閉）
+    activity_detector: "off" | "mog2" | "hog" | None, # caption 前的人物 / 活動預偵測，沒有活動的幀不送 VLM（None = 用 worker 預設）
+    activity_min_foreground: float | None, # 僅 mog2：前景比例低於此值視為沒有活動
     }
     """
 
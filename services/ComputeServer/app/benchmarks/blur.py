@@ -0,0 +1,111 @@
+"""
+模糊度評分 micro-benchmark：原本逐幀的 Laplacian 迴圈 vs. libs.frame_analysis 的批次版本。
+
+用法（在 ComputeServer 目錄下）：
+    python -m app.benchmarks.blur [--seconds 30] [--fps 3] [--threshold 20] [--video path.mp4]
+
+輸出 JSON：各方法的耗時、每秒處理幀數，以及與原本判斷（is_not_blurry）的一致率。
+這裡刻意不 import app.tasks.videosprocessing（會連帶載入模型與 Celery 設定）。
+"""
+import argparse
+import gc
+import json
+import os
+import tempfile
+import time
+from typing import Any, Dict, List
+
+import cv2
+import numpy as np
+
+from ..libs.frame_analysis import ANALYSIS_THREADS, laplacian_variance_batch, stack_gray
+from .synthetic import write_synthetic_clip
+
+
+def _sample_frames(video_path: str, target_fps: int) -> List[np.ndarray]:
+    cap = cv2.VideoCapture(video_path)
+    try:
+        original_fps = cap.get(cv2.CAP_PROP_FPS) or 30
+        step = max(1, int(round(original_fps / target_fps)))
+        frames, idx = [], 0
+        while True:
+            ok, frame = cap.read()
+            if not ok:
+                break
+            if idx % step == 0:
+                frames.append(frame)
+            idx += 1
+        return frames
+    finally:
+        cap.release()
+
+
+def legacy_blur(frames: List[np.ndarray], threshold: float) -> List[bool]:
+    """原本 analyze_blur 的逐幀寫法（CV_64F Laplacian、每 10 幀 gc.collect）。"""
+    decisions = []
+    for i, frame in enumerate(frames):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        variance = float(cv2.Laplacian(gray, cv2.CV_64F).var())
+        decisions.append(not (variance <= threshold))
+        del gray
+        if (i + 1) % 10 == 0:
+            gc.collect()
+    return decisions
+
+
+def batch_blur(frames: List[np.ndarray], threshold: float, scale: float = 1.0, batch_size: int = 16) -> List[bool]:
+    decisions = []
+    for start in range(0, len(frames), batch_size):
+        variances = laplacian_variance_batch(stack_gray(frames[start:start + batch_size], scale))
+        decisions.extend(not (float(v) <= threshold) for v in variances)
+    return decisions
+
+
+def _timed(fn, *args, **kwargs) -> Dict[str, Any]:
+    t0 = time.perf_counter()
+    decisions = fn(*args, **kwargs)
+    return {"seconds": time.perf_counter() - t0, "decisions": decisions}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--video", default=None, help="使用既有影片；未指定則產生合成 1080p 影片")
+    parser.add_argument("--seconds", type=float, default=30.0)
+    parser.add_argument("--fps", type=int, default=3, help="抽樣 fps（同 job 的 target_fps）")
+    parser.add_argument("--threshold", type=float, default=20.0)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--scale", type=float, default=0.5, help="縮小版批次評分的比例")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        video_path = args.video or write_synthetic_clip(os.path.join(tmp, "synthetic.mp4"), seconds=args.seconds)
+        frames = _sample_frames(video_path, args.fps)
+
+    legacy = _timed(legacy_blur, frames, args.threshold)
+    runs = {
+        "legacy": legacy,
+        "batch": _timed(batch_blur, frames, args.threshold, 1.0, args.batch_size),
+        # 縮小後 Laplacian 變異數會變大，沿用同一門檻的一致率僅供參考
+        f"batch_scale_{args.scale}": _timed(batch_blur, frames, args.threshold, args.scale, args.batch_size),
+    }
+
+    report: Dict[str, Any] = {
+        "frames": len(frames),
+        "resolution": list(frames[0].shape[:2]) if frames else None,
+        "threshold": args.threshold,
+        "analysis_threads": ANALYSIS_THREADS,
+        "results": {},
+    }
+    for name, run in runs.items():
+        agree = sum(a == b for a, b in zip(run["decisions"], legacy["decisions"]))
+        report["results"][name] = {
+            "seconds": round(run["seconds"], 4),
+            "frames_per_second": round(len(frames) / run["seconds"], 2) if run["seconds"] > 0 else None,
+            "speedup_vs_legacy": round(legacy["seconds"] / run["seconds"], 2) if run["seconds"] > 0 else None,
+            "decision_agreement": round(agree / len(frames), 4) if frames else None,
+        }
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
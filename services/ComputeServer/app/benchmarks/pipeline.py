@@ -0,0 +1,207 @@
+"""
+影片描述流程的離線 benchmark（CPU-only、不需網路）。
+
+用合成影片（多種解析度 / 長度 / 動態程度）跑：
+    get_video_frames_fast → analyze_blur → filter_by_frame_difference → img_captioning → llm_processing
+以及正式流程用的 select_frames_streaming。
+Moondream2 與 Gemini 以 stub 取代（可用 --caption-latency / --llm-latency 模擬延遲），
+輸出每個情境的 frames/s、峰值記憶體與各階段耗時（JSON）。
+
+用法（在 ComputeServer 目錄下）：
+    python -m app.benchmarks.pipeline [--quick] [--output result.json]
+
+每個情境在獨立的子行程執行，峰值記憶體（ru_maxrss）才不會互相污染。
+"""
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+from types import SimpleNamespace
+from typing import Any, Dict, Iterator, List
+
+from .synthetic import write_synthetic_clip
+
+RESOLUTIONS = {"360p": (640, 360), "720p": (1280, 720), "1080p": (1920, 1080)}
+LENGTHS = (10.0, 30.0)
+MOTIONS = {"static": 0.0, "low": 0.3, "high": 1.5}
+
+
+class StubCaptioner:
+    """取代 Moondream2ImageCaptioner：回傳依畫面亮度產生的固定句子。"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+
+    def describe_many(self, images, length: str = "normal", max_tokens: int = 128) -> Iterator[str]:
+        for img in images:
+            if self.latency:
+                time.sleep(self.latency)
+            gray = img.convert("L").resize((8, 8))
+            level = sum(gray.getdata()) // 64
+            yield f"A room with brightness level {level // 32}."
+
+
+class _StubModels:
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def generate_content(self, model: str, contents: List[str], config: Any = None):
+        if self.latency:
+            time.sleep(self.latency)
+        prompt = contents[0] if contents else ""
+        frames = max(1, prompt.count('"index"'))
+        payload = {
+            "rounds": [],
+            "final_answer": {"events": [{
+                "start_index": 0,
+                "end_index": frames - 1,
+                "summary": "stub event",
+                "objects": [],
+                "scene": None,
+                "action": None,
+            }]},
+        }
+        return SimpleNamespace(
+            text=json.dumps(payload),
+            usage_metadata=SimpleNamespace(
+                prompt_token_count=len(prompt) // 4,
+                candidates_token_count=32,
+                total_token_count=len(prompt) // 4 + 32,
+            ),
+        )
+
+
+class StubGenaiClient:
+    """取代 google.genai.Client：只實作 models.generate_content。"""
+
+    def __init__(self, latency: float = 0.0):
+        self.models = _StubModels(latency)
+
+
+def _run_scenario(scenario: Dict[str, Any]) -> Dict[str, Any]:
+    """在子行程內跑單一情境（這裡才 import videosprocessing，避免父行程載入 torch）。"""
+    from ..libs.metrics import StageRecorder, recording
+    from ..libs.model_registry import get_registry
+    from ..tasks import videosprocessing as vp
+
+    get_registry().register(
+        vp.CAPTIONER_MODEL_NAME,
+        loader=lambda: StubCaptioner(scenario["caption_latency"]),
+        replace=True,
+    )
+    vp._get_genai_client = lambda api_key: StubGenaiClient(scenario["llm_latency"])
+
+    width, height = RESOLUTIONS[scenario["resolution"]]
+    with tempfile.TemporaryDirectory() as tmp:
+        video_path = write_synthetic_clip(
+            os.path.join(tmp, "clip.mp4"),
+            seconds=scenario["seconds"], width=width, height=height,
+            motion=MOTIONS[scenario["motion"]],
+        )
+        params = scenario["params"]
+        recorder = StageRecorder()
+        with recording(recorder):
+            # 批次流程（逐階段，方便看各自的吞吐）
+            reply = vp.get_video_frames_fast(video_path, target_fps=params["target_fps"])
+            frames = reply["frames"]
+            extracted = len(frames)
+            frames = vp.analyze_blur(frames, threshold=params["blur_threshold"])
+            frames = vp.filter_by_frame_difference(
+                frames,
+                threshold=params["difference_threshold"],
+                compression_proportion=params["compression_proportion"],
+                module=params["difference_module"],
+            )
+            frames = vp.img_captioning(frames)
+            candidates = frames.captioned_count()
+            vp.llm_processing(frames, api_key="offline-benchmark")
+            del frames, reply
+
+            # 正式流程用的串流取幀 + 過濾
+            streaming = vp.select_frames_streaming(
+                video_path,
+                target_fps=params["target_fps"],
+                blur_threshold=params["blur_threshold"],
+                difference_threshold=params["difference_threshold"],
+                compression_proportion=params["compression_proportion"],
+                module=params["difference_module"],
+            )
+            del streaming
+
+    stages = recorder.as_metrics()
+    per_stage = {}
+    for name, values in stages.items():
+        wall = values["wall_seconds"]
+        per_stage[name] = {
+            "wall_seconds": round(wall, 4),
+            "cpu_seconds": round(values["cpu_seconds"], 4),
+            "rss_peak_delta_mb": round(values["rss_peak_delta_bytes"] / 1024 / 1024, 2),
+            "frames_per_second": round(extracted / wall, 2) if wall > 0 else None,
+        }
+    return {
+        "scenario": {k: v for k, v in scenario.items() if k != "params"},
+        "extracted_frames": extracted,
+        "caption_candidates": candidates,
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "stages": per_stage,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--resolutions", default=",".join(RESOLUTIONS), help="逗號分隔，如 360p,1080p")
+    parser.add_argument("--lengths", default=",".join(str(int(x)) for x in LENGTHS), help="秒數，逗號分隔")
+    parser.add_argument("--motions", default=",".join(MOTIONS), help="static,low,high")
+    parser.add_argument("--quick", action="store_true", help="只跑 720p / 10 秒 / low")
+    parser.add_argument("--target-fps", type=int, default=3)
+    parser.add_argument("--blur-threshold", type=float, default=60.0)
+    parser.add_argument("--difference-module", default="SSIM", choices=["SSIM", "MSE_L2"])
+    parser.add_argument("--difference-threshold", type=float, default=0.7)
+    parser.add_argument("--caption-latency", type=float, default=0.0, help="stub captioner 每張圖的延遲（秒）")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="stub LLM 每次呼叫的延遲（秒）")
+    parser.add_argument("--output", default=None, help="JSON 輸出路徑（預設印到 stdout）")
+    args = parser.parse_args()
+
+    if args.quick:
+        resolutions, lengths, motions = ["720p"], [10.0], ["low"]
+    else:
+        resolutions = [r for r in args.resolutions.split(",") if r]
+        lengths = [float(x) for x in args.lengths.split(",") if x]
+        motions = [m for m in args.motions.split(",") if m]
+
+    params = {
+        "target_fps": args.target_fps,
+        "blur_threshold": args.blur_threshold,
+        "difference_module": args.difference_module,
+        "difference_threshold": args.difference_threshold,
+        "compression_proportion": 0.5,
+    }
+    scenarios = [
+        {
+            "resolution": r, "seconds": l, "motion": m,
+            "caption_latency": args.caption_latency, "llm_latency": args.llm_latency,
+            "params": params,
+        }
+        for r, l, m in itertools.product(resolutions, lengths, motions)
+    ]
+
+    ctx = multiprocessing.get_context("spawn")
+    results = []
+    for scenario in scenarios:
+        with ctx.Pool(1) as pool:
+            results.append(pool.apply(_run_scenario, (scenario,)))
+
+    report = {"cpu_count": os.cpu_count(), "params": params, "results": results}
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,7 @@ from sentence_transformers import SentenceTransformer
 from rank_bm25 import BM25Okapi
 import torch
 import os
+from .model_registry import get_registry
 
 class RAGModel:
     """
@@ -40,14 +41,30 @@ class RAGModel:
         print(f"[RAG] ✅ Embedding 模型已載入至 {device}")
 
     @classmethod
-    def get_instance(cls):
-        """獲取 RAG 模型單例"""
-        if cls._instance is None:
-            with cls._lock:
-                if cls._instance is None:
-                    print("[RAG] 首次初始化 RAG 模型...")
-                    cls._instance = cls()
+    def _load(cls):
+        """給 model_registry 用的 loader"""
+        with cls._lock:
+            print("[RAG] 初始化 RAG 模型...")
+            cls._instance = cls()
         return cls._instance
+
+    @classmethod
+    def _unload(cls, instance):
+        """給 model_registry 用的 unloader：閒置過久或記憶體水位過高時釋放"""
+        with cls._lock:
+            cls._instance = None
+            cls._initialized = False
+        instance.model = None
+
+    @classmethod
+    def get_instance(cls):
+        """獲取 RAG 模型單例（由 model_registry 控管載入 / 閒置卸載）"""
+        return get_registry().get(RAG_MODEL_NAME)
+
+    @classmethod
+    def use(cls):
+        """with RAGModel.use() as rag: ... 區塊內模型不會被卸載"""
+        return get_registry().use(RAG_MODEL_NAME)
     
     @classmethod
     def is_loaded(cls):
@@ -63,6 +80,9 @@ class RAGModel:
     def similarity(self, query_embeddings, chunk_embeddings):
         return self.model.similarity(query_embeddings, chunk_embeddings)
 
+RAG_MODEL_NAME = "rag_embedding"
+get_registry().register(RAG_MODEL_NAME, loader=RAGModel._load, unloader=RAGModel._unload)
+
 def create_bm25(chunks: list[str]) -> BM25Okapi:
     # jieba.cut returns a generator, we need list of tokens
     tokenized_chunks = [list(jieba.cut(chunk)) for chunk in chunks]
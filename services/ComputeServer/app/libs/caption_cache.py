@@ -0,0 +1,111 @@
+"""
+同一支攝影機跨片段共用的 caption 快取。
+
+key = (camera_id, 縮圖的感知雜湊 dHash)，存在 Redis：
+    caption_cache:{camera_id}        HASH  phash(hex) -> caption
+    caption_cache:{camera_id}:lru    ZSET  phash(hex) -> 最後使用時間（用來做大小上限的 LRU 淘汰）
+兩個 key 都有 TTL（每次寫入時延長）。查詢時以 Hamming 距離 <= radius 視為命中。
+Redis 不可用時快取自動停用，不影響主流程。
+"""
+import os
+import time
+from typing import Dict, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from .redis_client import get_redis
+
+CAPTION_CACHE_TTL = int(os.getenv("CAPTION_CACHE_TTL", str(6 * 3600)))
+CAPTION_CACHE_MAX_ENTRIES = int(os.getenv("CAPTION_CACHE_MAX_ENTRIES", "512"))
+CAPTION_CACHE_RADIUS = int(os.getenv("CAPTION_CACHE_RADIUS", "4"))
+
+
+def dhash(frame: np.ndarray, hash_size: int = 8) -> int:
+    """difference hash：縮成 (hash_size+1) x hash_size 灰階，比較左右相鄰像素，得到 hash_size^2 bits。"""
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    value = 0
+    for b in bits:
+        value = (value << 1) | int(b)
+    return value
+
+
+class CameraCaptionCache:
+    """
+    單一攝影機的 caption 快取（一個 job 建一個）。
+    建立時把這支攝影機的所有雜湊一次讀進來，之後的查詢都在記憶體內算 Hamming 距離。
+    """
+
+    def __init__(self, camera_id: str, radius: int = CAPTION_CACHE_RADIUS):
+        self.camera_id = str(camera_id)
+        self.radius = int(radius)
+        self.key = f"caption_cache:{self.camera_id}"
+        self.lru_key = f"{self.key}:lru"
+        self.enabled = True
+        self.hits = 0
+        self.misses = 0
+        self._entries: Dict[int, str] = {}
+        try:
+            raw = get_redis().hgetall(self.key)
+            for k, v in raw.items():
+                self._entries[int(k, 16)] = v.decode("utf-8") if isinstance(v, bytes) else str(v)
+        except Exception as e:
+            print(f"[CaptionCache] ⚠️ Redis 不可用，停用 caption 快取: {e}")
+            self.enabled = False
+
+    def lookup(self, phash: int) -> Optional[str]:
+        """找 Hamming 距離最近且 <= radius 的 caption；命中時更新 LRU 時間。"""
+        if not self.enabled:
+            return None
+        best: Optional[Tuple[int, int]] = None
+        for h in self._entries:
+            d = bin(h ^ phash).count("1")
+            if d <= self.radius and (best is None or d < best[0]):
+                best = (d, h)
+                if d == 0:
+                    break
+        if best is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        try:
+            get_redis().zadd(self.lru_key, {format(best[1], "x"): time.time()})
+        except Exception:
+            pass
+        return self._entries[best[1]]
+
+    def store(self, phash: int, caption: str) -> None:
+        """寫入 caption，延長 TTL，並把超過上限的最舊項目淘汰。"""
+        if not self.enabled or not caption:
+            return
+        self._entries[phash] = caption
+        field = format(phash, "x")
+        try:
+            r = get_redis()
+            pipe = r.pipeline()
+            pipe.hset(self.key, field, caption)
+            pipe.zadd(self.lru_key, {field: time.time()})
+            pipe.expire(self.key, CAPTION_CACHE_TTL)
+            pipe.expire(self.lru_key, CAPTION_CACHE_TTL)
+            pipe.zcard(self.lru_key)
+            size = pipe.execute()[-1]
+            overflow = int(size) - CAPTION_CACHE_MAX_ENTRIES
+            if overflow > 0:
+                evicted = [m.decode() if isinstance(m, bytes) else m
+                           for m, _ in r.zpopmin(self.lru_key, overflow)]
+                if evicted:
+                    r.hdel(self.key, *evicted)
+                    for m in evicted:
+                        self._entries.pop(int(m, 16), None)
+        except Exception as e:
+            print(f"[CaptionCache] ⚠️ 寫入失敗: {e}")
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "caption_cache_lookups": lookups,
+            "caption_cache_hits": self.hits,
+            "caption_cache_hit_rate": (self.hits / lookups) if lookups else 0.0,
+        }
@@ -0,0 +1,179 @@
+"""
+Vlog 剪輯片段的內容定址快取（content-addressed clip cache）。
+
+同一天的 Vlog 常被重新生成（舊的由 APIServer 的 _remove_previous_daily_vlogs 刪除），
+而且大多數事件不變；每個剪好的片段以
+    (bucket/object, clip_start, clip_duration, 縮放, 編碼參數)
+的 sha256 為 key 存起來，下次同樣的片段直接拿來用，不必重新下載與編碼。
+
+兩層：
+    1. 本機磁碟：VLOG_CLIP_CACHE_DIR/{key[:2]}/{key}.mp4，命中時更新 mtime 當作 LRU 時間，
+       超過 VLOG_CLIP_CACHE_MAX_MB 時依 mtime 淘汰最舊的檔案（0 = 不使用本機層）
+    2. MinIO（選用）：VLOG_CLIP_CACHE_PREFIX 有設定時，片段也存到 MINIO_BUCKET/{prefix}/{key}.mp4，
+       其他節點本機沒有時從這裡拿（物件的生命週期交給 bucket 的 lifecycle 規則）
+
+寫入一律先寫暫存檔再 atomic rename；同一個 key 同時寫入時後寫的覆蓋先寫的（內容相同）。
+"""
+import hashlib
+import os
+import shutil
+import threading
+from typing import Dict, List, Optional
+
+from .storage import get_minio_client
+
+VLOG_CLIP_CACHE_DIR = os.getenv("VLOG_CLIP_CACHE_DIR", "/tmp/vlog-clip-cache")
+VLOG_CLIP_CACHE_MAX_MB = int(os.getenv("VLOG_CLIP_CACHE_MAX_MB", "2048"))  # 0 = 不使用本機層
+VLOG_CLIP_CACHE_PREFIX = os.getenv("VLOG_CLIP_CACHE_PREFIX", "").strip("/")  # 空字串 = 不使用 MinIO 層
+MINIO_BUCKET = os.getenv("MINIO_BUCKET", "media-bucket")
+
+_STATS_LOCK = threading.Lock()
+_STATS: Dict[str, int] = {"lookups": 0, "disk_hits": 0, "minio_hits": 0, "stores": 0, "evictions": 0}
+
+
+def clip_cache_enabled() -> bool:
+    return VLOG_CLIP_CACHE_MAX_MB > 0 or bool(VLOG_CLIP_CACHE_PREFIX)
+
+
+def clip_cache_key(bucket: str, object_name: str, clip_start: float, clip_duration: float,
+                   scale: str, encoder: str) -> str:
+    # 時間取到毫秒，避免浮點誤差讓同一個片段算出不同的 key
+    payload = f"{bucket}/{object_name}|{float(clip_start):.3f}|{float(clip_duration):.3f}|{scale}|{encoder}"
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _bump(name: str, n: int = 1) -> None:
+    with _STATS_LOCK:
+        _STATS[name] += n
+
+
+def clip_cache_stats() -> Dict[str, int]:
+    with _STATS_LOCK:
+        return dict(_STATS)
+
+
+def _disk_path(key: str) -> str:
+    return os.path.join(VLOG_CLIP_CACHE_DIR, key[:2], f"{key}.mp4")
+
+
+def _minio_object(key: str) -> str:
+    return f"{VLOG_CLIP_CACHE_PREFIX}/{key}.mp4"
+
+
+def _link_or_copy(src: str, dest: str) -> None:
+    """優先 hard link（同一個檔案系統時不複製資料），否則複製。"""
+    tmp = f"{dest}.{os.getpid()}.{threading.get_ident()}.part"
+    try:
+        try:
+            os.link(src, tmp)
+        except OSError:
+            shutil.copyfile(src, tmp)
+        os.replace(tmp, dest)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def _evict(keep: str) -> None:
+    """本機層超過上限時，依 mtime 從最舊的開始刪（不刪剛寫入的 keep）。"""
+    budget = VLOG_CLIP_CACHE_MAX_MB * 1024 * 1024
+    files = []
+    total = 0
+    for dirpath, _, filenames in os.walk(VLOG_CLIP_CACHE_DIR):
+        for name in filenames:
+            if not name.endswith(".mp4"):
+                continue
+            path = os.path.join(dirpath, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+    if total <= budget:
+        return
+    for _, size, path in sorted(files):
+        if total <= budget:
+            break
+        if path == keep:
+            continue
+        try:
+            # 已經 hard link 到任務暫存目錄的片段不受影響
+            os.remove(path)
+            total -= size
+            _bump("evictions")
+        except FileNotFoundError:
+            pass
+
+
+def fetch_clip(key: str, dest_path: str) -> Optional[str]:
+    """
+    快取命中時把片段放到 dest_path（任務自己的暫存目錄，之後被淘汰也不影響這次的合併）。
+
+    Returns:
+        "disk" | "minio"；沒有命中回 None
+    """
+    _bump("lookups")
+    if VLOG_CLIP_CACHE_MAX_MB > 0:
+        path = _disk_path(key)
+        if os.path.isfile(path):
+            try:
+                os.utime(path, None)
+                _link_or_copy(path, dest_path)
+                _bump("disk_hits")
+                return "disk"
+            except FileNotFoundError:
+                pass  # 剛好被淘汰，當作沒有命中
+    if VLOG_CLIP_CACHE_PREFIX:
+        try:
+            get_minio_client().fget_object(MINIO_BUCKET, _minio_object(key), dest_path)
+        except Exception:
+            return None
+        _bump("minio_hits")
+        if VLOG_CLIP_CACHE_MAX_MB > 0:
+            # 回填本機層失敗（磁碟滿、權限…）不影響這次命中
+            try:
+                _store_disk(key, dest_path)
+            except Exception as e:
+                print(f"[ClipCache] ⚠️ 回填本機快取失敗 key={key}: {e}")
+        return "minio"
+    return None
+
+
+def cached_clip_ratio(keys: List[str]) -> float:
+    """keys 中已在快取裡的比例（只檢查是否存在，不計入 lookups / hits）；快取停用時回 0。"""
+    if not keys or not clip_cache_enabled():
+        return 0.0
+    found = 0
+    for key in keys:
+        if VLOG_CLIP_CACHE_MAX_MB > 0 and os.path.isfile(_disk_path(key)):
+            found += 1
+            continue
+        if VLOG_CLIP_CACHE_PREFIX:
+            try:
+                get_minio_client().stat_object(MINIO_BUCKET, _minio_object(key))
+                found += 1
+            except Exception:
+                pass
+    return found / len(keys)
+
+
+def _store_disk(key: str, src_path: str) -> None:
+    path = _disk_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    _link_or_copy(src_path, path)
+    _evict(keep=path)
+
+
+def store_clip(key: str, src_path: str) -> None:
+    """把剛剪好的片段存進快取（本機層 + 選用的 MinIO 層）；失敗只記 log，不影響 Vlog 生成。"""
+    if not clip_cache_enabled():
+        return
+    try:
+        if VLOG_CLIP_CACHE_MAX_MB > 0:
+            _store_disk(key, src_path)
+        if VLOG_CLIP_CACHE_PREFIX:
+            get_minio_client().fput_object(MINIO_BUCKET, _minio_object(key), src_path, content_type="video/mp4")
+        _bump("stores")
+    except Exception as e:
+        print(f"[ClipCache] ⚠️ 寫入快取失敗 key={key}: {e}")
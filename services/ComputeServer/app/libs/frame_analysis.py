@@ -0,0 +1,283 @@
+"""
+影格分析的批次運算（模糊度、相鄰幀差異），供 videosprocessing 與 benchmarks 共用。
+只依賴 numpy / OpenCV，不載入任何模型。
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import cv2
+import numpy as np
+
+# OpenCV 的運算會釋放 GIL，因此用 thread pool 就能吃到多核
+ANALYSIS_THREADS = int(os.getenv("FRAME_ANALYSIS_THREADS", "0")) or (os.cpu_count() or 1)
+_EXECUTOR: Optional[ThreadPoolExecutor] = None
+_EXECUTOR_LOCK = threading.Lock()
+
+
+def get_analysis_executor() -> ThreadPoolExecutor:
+    """共用的分析 thread pool（每個 process 一個，延遲建立）。"""
+    global _EXECUTOR
+    if _EXECUTOR is None:
+        with _EXECUTOR_LOCK:
+            if _EXECUTOR is None:
+                _EXECUTOR = ThreadPoolExecutor(max_workers=ANALYSIS_THREADS, thread_name_prefix="frame-analysis")
+    return _EXECUTOR
+
+
+def _chunk_bounds(n: int, chunk_size: int) -> List[range]:
+    chunk_size = max(1, int(chunk_size))
+    return [range(i, min(i + chunk_size, n)) for i in range(0, n, chunk_size)]
+
+
+def to_gray(frame: np.ndarray, scale: float = 1.0) -> np.ndarray:
+    """BGR/灰階 → 灰階，scale < 1 時用 INTER_AREA 縮小。"""
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    if scale and scale != 1.0:
+        gray = cv2.resize(gray, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return gray
+
+
+def stack_gray(frames: List[np.ndarray], scale: float = 1.0) -> np.ndarray:
+    """把多張幀轉成連續的 (N, H, W) uint8 灰階陣列（各幀需同尺寸）。"""
+    if not frames:
+        return np.empty((0, 0, 0), dtype=np.uint8)
+    first = to_gray(frames[0], scale)
+    out = np.empty((len(frames),) + first.shape, dtype=np.uint8)
+    out[0] = first
+    for i in range(1, len(frames)):
+        out[i] = to_gray(frames[i], scale)
+    return out
+
+
+def laplacian_variance_batch(gray_stack: np.ndarray,
+                             *,
+                             chunk_size: int = 4,
+                             parallel: bool = True) -> np.ndarray:
+    """
+    批次計算 Laplacian 變異數（模糊度指標）。
+
+    Args:
+        gray_stack: (N, H, W) uint8 灰階幀
+        chunk_size: 每個 thread 一次處理的幀數
+        parallel: False 時在呼叫端 thread 直接算（小批次時避免排程開銷）
+
+    Returns:
+        (N,) float32 變異數。uint8 的 Laplacian 在 float32 下是精確整數，
+        變異數由 cv2.meanStdDev 以 double 累加，與原本 CV_64F 的結果在浮點誤差內一致。
+    """
+    if gray_stack.ndim != 3:
+        raise ValueError("gray_stack 必須是 (N, H, W) 的灰階陣列")
+    n = gray_stack.shape[0]
+    out = np.empty((n,), dtype=np.float32)
+    if n == 0:
+        return out
+
+    def _score(rng: range) -> None:
+        for i in rng:
+            lap = cv2.Laplacian(gray_stack[i], cv2.CV_32F)
+            _, std = cv2.meanStdDev(lap)
+            out[i] = float(std[0, 0]) ** 2
+
+    chunks = _chunk_bounds(n, chunk_size)
+    if not parallel or len(chunks) == 1 or ANALYSIS_THREADS <= 1:
+        for rng in chunks:
+            _score(rng)
+    else:
+        # list() 讓 worker 內的例外在這裡拋出
+        list(get_analysis_executor().map(_score, chunks))
+    return out
+
+
+def resize_stack(gray_stack: np.ndarray, scale: float) -> np.ndarray:
+    """對 (N, H, W) 灰階整批縮放（預設 INTER_LINEAR，與原本幀差前的壓縮一致）。"""
+    if gray_stack.shape[0] == 0 or not scale or scale == 1.0:
+        return gray_stack
+    first = cv2.resize(gray_stack[0], (0, 0), fx=scale, fy=scale)
+    out = np.empty((gray_stack.shape[0],) + first.shape, dtype=gray_stack.dtype)
+    out[0] = first
+    for i in range(1, gray_stack.shape[0]):
+        out[i] = cv2.resize(gray_stack[i], (0, 0), fx=scale, fy=scale)
+    return out
+
+
+def adjacent_mse(gray_stack: np.ndarray, previous: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    一次算出所有相鄰幀對的 MSE（float32，不會有 uint8 溢位繞回的問題）。
+
+    Returns:
+        (N,) float32；第 i 個值是第 i 幀與前一幀的 MSE。
+        previous 為 None 時第 0 個值為 0（沒有可比較的前一幀）。
+    """
+    n = gray_stack.shape[0]
+    out = np.zeros((n,), dtype=np.float32)
+    if n == 0:
+        return out
+    cur = gray_stack.astype(np.float32)
+    if n > 1:
+        d = cur[1:] - cur[:-1]
+        np.square(d, out=d)
+        out[1:] = d.reshape(n - 1, -1).mean(axis=1)
+    if previous is not None:
+        d0 = cur[0] - previous.astype(np.float32)
+        out[0] = float(np.mean(d0 * d0))
+    return out
+
+
+def frame_difference_batch(gray_stack: np.ndarray,
+                           previous: Optional[np.ndarray],
+                           threshold: float,
+                           module: str,
+                           *,
+                           pregate_mse: float = 0.0,
+                           pregate_scale: float = 0.25,
+                           chunk_size: int = 4,
+                           parallel: bool = True) -> Dict[str, Any]:
+    """
+    相鄰幀差異引擎（輸入為已壓縮的灰階 stack）。
+
+    - MSE_L2：adjacent_mse 一次向量化算完
+    - SSIM：各幀對分 chunk 丟進 thread pool 同時計算
+    - pregate_mse > 0 時（僅 SSIM）：先在 pregate_scale 的縮圖上算 MSE，
+      低於 pregate_mse 的幀對視為幾乎相同 → 直接判定不顯著、跳過 SSIM（ssim_value=None）
+
+    previous 是上一批最後一幀（跨批次比較用）；為 None 時第 0 幀視為顯著、數值為 0。
+
+    Returns:
+        {
+            "diff_values": (N,) float32,       # MSE 模式的 mse_value
+            "ssim_values": List[float|None],   # SSIM 模式的 ssim_value
+            "is_significant": List[bool],
+            "ssim_pairs": int,                 # 實際計算 SSIM 的幀對數
+            "pregated_pairs": int,             # 被 pre-gate 擋掉的幀對數
+        }
+    """
+    n = gray_stack.shape[0]
+    first_pair = 0 if previous is not None else 1
+    result: Dict[str, Any] = {
+        "diff_values": np.zeros((n,), dtype=np.float32),
+        "ssim_values": [0.0] * n,
+        "is_significant": [True] * n,
+        "ssim_pairs": 0,
+        "pregated_pairs": 0,
+    }
+    if n == 0:
+        return result
+
+    if module == "MSE_L2":
+        diff_values = adjacent_mse(gray_stack, previous)
+        result["diff_values"] = diff_values
+        for i in range(first_pair, n):
+            result["is_significant"][i] = bool(diff_values[i] >= threshold)
+        return result
+
+    if module != "SSIM":
+        raise ValueError("module 必須是 'MSE_L2' 或 'SSIM'")
+    from skimage.metrics import structural_similarity as ssim
+
+    pairs = list(range(first_pair, n))
+    if pregate_mse and pregate_mse > 0 and pairs:
+        small = resize_stack(gray_stack, pregate_scale)
+        small_prev = cv2.resize(previous, (small.shape[2], small.shape[1])) if previous is not None else None
+        gate_values = adjacent_mse(small, small_prev)
+        kept = []
+        for i in pairs:
+            if gate_values[i] < pregate_mse:
+                result["ssim_values"][i] = None
+                result["is_significant"][i] = False
+                result["pregated_pairs"] += 1
+            else:
+                kept.append(i)
+        pairs = kept
+
+    def _ref(i: int) -> np.ndarray:
+        return gray_stack[i - 1] if i > 0 else previous
+
+    def _score(chunk: List[int]) -> None:
+        for i in chunk:
+            value = float(ssim(gray_stack[i], _ref(i), data_range=255))
+            result["ssim_values"][i] = value
+            # 越大越相似，我們要剃除相似，所以小於門檻的視為重要幀
+            result["is_significant"][i] = bool(value <= threshold)
+
+    chunks = [pairs[r.start:r.stop] for r in _chunk_bounds(len(pairs), chunk_size)]
+    if not parallel or len(chunks) <= 1 or ANALYSIS_THREADS <= 1:
+        for chunk in chunks:
+            _score(chunk)
+    else:
+        list(get_analysis_executor().map(_score, chunks))
+    result["ssim_pairs"] = len(pairs)
+    return result
+
+
+def foreground_ratios_mog2(gray_stack: np.ndarray,
+                           *,
+                           history: int = 120,
+                           var_threshold: float = 16.0,
+                           normalize_brightness: bool = True) -> np.ndarray:
+    """
+    以 MOG2 背景相減計算每一幀的前景比例（前景像素 / 總像素）。
+
+    gray_stack 需依時間順序、包含每一張抽樣幀（通常是 FrameBatch 的 analysis tier 小灰階），
+    背景模型才跟得上場景。normalize_brightness=True 時先把每幀平均亮度拉到同一水準，
+    開關燈、日照變化這類整體亮度改變不會被當成前景；陰影（MOG2 標成 127）也不計入。
+
+    Returns:
+        (N,) float32；第 0 幀沒有背景可比較，固定為 1.0（一律視為有活動）。
+    """
+    n = gray_stack.shape[0]
+    out = np.zeros((n,), dtype=np.float32)
+    if n == 0:
+        return out
+    subtractor = cv2.createBackgroundSubtractorMOG2(history=history, varThreshold=var_threshold, detectShadows=True)
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
+    for i in range(n):
+        gray = gray_stack[i]
+        if normalize_brightness:
+            mean = float(gray.mean())
+            if mean > 1.0:
+                gray = cv2.convertScaleAbs(gray, alpha=128.0 / mean)
+        mask = subtractor.apply(gray)
+        # 只算確定的前景（255），再用 opening 去掉零星雜訊點
+        _, mask = cv2.threshold(mask, 200, 255, cv2.THRESH_BINARY)
+        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
+        out[i] = np.count_nonzero(mask) / mask.size
+    out[0] = 1.0
+    return out
+
+
+_HOG_LOCAL = threading.local()
+
+
+def _get_hog() -> "cv2.HOGDescriptor":
+    """HOGDescriptor 不保證 thread-safe，每個 thread 各建一個。"""
+    hog = getattr(_HOG_LOCAL, "hog", None)
+    if hog is None:
+        hog = cv2.HOGDescriptor()
+        hog.setSVMDetector(cv2.HOGDescriptor_getDefaultPeopleDetector())
+        _HOG_LOCAL.hog = hog
+    return hog
+
+
+def detect_people_hog(frames: List[np.ndarray],
+                      *,
+                      max_width: int = 640,
+                      hit_threshold: float = 0.0,
+                      parallel: bool = True) -> List[bool]:
+    """
+    以 OpenCV 內建的 HOG 行人偵測判斷每張幀是否有人（寬度先縮到 max_width 以內）。
+
+    Returns:
+        List[bool]，與 frames 同長度。
+    """
+    def _detect(frame: np.ndarray) -> bool:
+        h, w = frame.shape[:2]
+        if max_width and w > max_width:
+            frame = cv2.resize(frame, (max_width, max(1, int(round(h * max_width / w)))), interpolation=cv2.INTER_AREA)
+        rects, _ = _get_hog().detectMultiScale(frame, hitThreshold=hit_threshold, winStride=(8, 8), padding=(8, 8), scale=1.05)
+        return len(rects) > 0
+
+    if not parallel or len(frames) <= 1 or ANALYSIS_THREADS <= 1:
+        return [_detect(f) for f in frames]
+    return list(get_analysis_executor().map(_detect, frames))
@@ -0,0 +1,341 @@
+"""
+影片描述流程用的欄位式（columnar）幀容器。
+
+原本每個階段都產生一份新的 list[dict]（每幀 .copy() 一次），這裡改成：
+    - stamp / variance / ssim_value / mse_value / is_not_blurry / is_significant / has_activity：各一條 NumPy 欄位
+      （has_activity 預設 True，只有 activity pre-detector 判定畫面沒有人 / 活動時才設成 False）
+    - caption：Python list（長度同幀數，未處理為 None）
+    - 影像：一塊連續的 (slots, H, W, C) uint8 緩衝區，slot 欄位記錄每幀的影像位置（-1 = 沒有影像）
+各階段只就地填欄位；只有入選 caption 的幀佔用影像 slot，caption 完就還回去重複使用。
+
+欄位以屬性存取（batch.variance[rows] = ...），回傳的是目前長度的 view；
+extend() / append() 可能擴充底層陣列，之後需重新取屬性，不要長期保留舊的 view。
+
+分層儲存（tier）：
+    analysis  ：每一幀都留一份小灰階（寬 FRAME_ANALYSIS_THUMB_WIDTH），供之後的輕量分析使用
+    candidate ：入選 caption 的幀；codec="jpeg" / "webp" 時以壓縮後的 bytes 保存，要用時才解碼，
+                codec="raw" 時放在連續的 BGR 緩衝區（整批分析的舊流程用）
+    其餘被淘汰的幀不保留任何影像。tier_bytes() / peak_tier_bytes 回報各層佔用的位元組數。
+"""
+import io
+import json
+import os
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+SKIPPED_CAPTION = "<skipped due to blur or insignificance>"
+
+FRAME_CANDIDATE_CODEC = os.getenv("FRAME_CANDIDATE_CODEC", "jpeg").lower()  # jpeg | webp | raw
+FRAME_CANDIDATE_QUALITY = int(os.getenv("FRAME_CANDIDATE_QUALITY", "90"))
+FRAME_ANALYSIS_THUMB_WIDTH = int(os.getenv("FRAME_ANALYSIS_THUMB_WIDTH", "160"))  # 0 = 不保留分析用小圖
+
+_CODECS = {
+    "jpeg": (".jpg", cv2.IMWRITE_JPEG_QUALITY),
+    "webp": (".webp", cv2.IMWRITE_WEBP_QUALITY),
+}
+
+# 欄位名稱 → (dtype, 預設值)
+_COLUMNS = {
+    "stamp": (np.float64, np.nan),
+    "variance": (np.float32, np.nan),
+    "ssim_value": (np.float32, np.nan),
+    "mse_value": (np.float32, np.nan),
+    "is_not_blurry": (np.bool_, False),
+    "is_significant": (np.bool_, False),
+    "has_activity": (np.bool_, True),
+}
+
+
+def _nan_to_none(value: float) -> Optional[float]:
+    return None if np.isnan(value) else float(value)
+
+
+class FrameBatch:
+    def __init__(self, capacity: int = 64, image_slots: int = 16, codec: str = "raw",
+                 quality: int = FRAME_CANDIDATE_QUALITY, analysis_width: int = 0):
+        if codec != "raw" and codec not in _CODECS:
+            raise ValueError(f"codec 必須是 raw / {' / '.join(_CODECS)} 其中之一")
+        capacity = max(1, int(capacity))
+        self._n = 0
+        self._data: Dict[str, np.ndarray] = {
+            name: np.full(capacity, default, dtype=dtype) for name, (dtype, default) in _COLUMNS.items()
+        }
+        self._slots = np.full(capacity, -1, dtype=np.int32)
+        self.captions: List[Optional[str]] = []
+        self.codec = codec
+        self.quality = int(quality)
+        self.analysis_width = max(0, int(analysis_width))
+        self._images: Optional[np.ndarray] = None       # codec="raw" 的連續緩衝區
+        self._encoded: List[Optional[bytes]] = []       # 壓縮 codec 的 bytes（以 slot 為索引）
+        self._encoded_bytes = 0
+        self._analysis: Optional[np.ndarray] = None     # (capacity, h, w) 分析用小灰階
+        self._initial_image_slots = max(1, int(image_slots))
+        self._used_slots = 0
+        self._free_slots: List[int] = []
+        self.peak_tier_bytes = {"analysis": 0, "candidate": 0}
+
+    # ---- 欄位 ----
+    def __getattr__(self, name: str) -> np.ndarray:
+        data = self.__dict__.get("_data")
+        if data is not None and name in data:
+            return data[name][:self._n]
+        raise AttributeError(name)
+
+    def __len__(self) -> int:
+        return self._n
+
+    def _reserve(self, n: int) -> None:
+        capacity = self._slots.shape[0]
+        if n <= capacity:
+            return
+        new_capacity = max(n, capacity * 2)
+        for name, (dtype, default) in _COLUMNS.items():
+            grown = np.full(new_capacity, default, dtype=dtype)
+            grown[:self._n] = self._data[name][:self._n]
+            self._data[name] = grown
+        slots = np.full(new_capacity, -1, dtype=np.int32)
+        slots[:self._n] = self._slots[:self._n]
+        self._slots = slots
+        if self._analysis is not None:
+            analysis = np.zeros((new_capacity,) + self._analysis.shape[1:], dtype=np.uint8)
+            analysis[:self._n] = self._analysis[:self._n]
+            self._analysis = analysis
+
+    def extend(self, stamps: Iterable[float]) -> slice:
+        """新增多列（只填 stamp），回傳這些列的 slice。"""
+        stamps = np.asarray(list(stamps), dtype=np.float64)
+        start = self._n
+        self._reserve(start + stamps.shape[0])
+        self._n += stamps.shape[0]
+        self._data["stamp"][start:self._n] = stamps
+        self.captions.extend([None] * stamps.shape[0])
+        return slice(start, self._n)
+
+    def append(self, stamp: float) -> int:
+        return self.extend([stamp]).start
+
+    # ---- analysis tier ----
+    def set_analysis(self, rows: slice, gray_stack: np.ndarray) -> None:
+        """把 (N, H, W) 灰階縮到 analysis_width 寬後存進 rows（analysis_width=0 時不保留）。"""
+        if not self.analysis_width or gray_stack.shape[0] == 0:
+            return
+        h, w = gray_stack.shape[1:3]
+        out_w = min(self.analysis_width, w)
+        out_h = max(1, int(round(h * out_w / w)))
+        if self._analysis is None:
+            self._analysis = np.zeros((self._slots.shape[0], out_h, out_w), dtype=np.uint8)
+        elif self._analysis.shape[1:] != (out_h, out_w):
+            raise ValueError(f"分析用小圖尺寸不一致：{(out_h, out_w)} != {self._analysis.shape[1:]}")
+        for dst, gray in zip(range(rows.start, rows.stop), gray_stack):
+            cv2.resize(gray, (out_w, out_h), dst=self._analysis[dst], interpolation=cv2.INTER_AREA)
+        self._track_peak()
+
+    def analysis(self, row: int) -> Optional[np.ndarray]:
+        return self._analysis[row] if self._analysis is not None else None
+
+    def analysis_stack(self) -> Optional[np.ndarray]:
+        """所有列的分析用小灰階 (N, h, w)（view）；沒有 analysis tier 時回 None。"""
+        return self._analysis[:self._n] if self._analysis is not None else None
+
+    # ---- candidate tier（影像 slot）----
+    def _alloc_slot(self, row: int) -> int:
+        slot = int(self._slots[row])
+        if slot >= 0:
+            return slot
+        if self._free_slots:
+            slot = self._free_slots.pop()
+        else:
+            slot = self._used_slots
+            self._used_slots += 1
+            if self.codec != "raw":
+                self._encoded.append(None)
+            elif slot == self._images.shape[0]:
+                grown = np.empty((self._images.shape[0] * 2,) + self._images.shape[1:], dtype=self._images.dtype)
+                grown[:slot] = self._images[:slot]
+                self._images = grown
+        self._slots[row] = slot
+        return slot
+
+    def set_image(self, row: int, frame: np.ndarray) -> None:
+        """保存入選幀的影像：raw 複製進連續緩衝區（需同尺寸），其餘 codec 壓縮成 bytes。"""
+        if self.codec == "raw":
+            if self._images is None:
+                self._images = np.empty((self._initial_image_slots,) + frame.shape, dtype=frame.dtype)
+            elif frame.shape != self._images.shape[1:]:
+                raise ValueError(f"影像尺寸不一致：{frame.shape} != {self._images.shape[1:]}")
+            np.copyto(self._images[self._alloc_slot(row)], frame)
+        else:
+            ext, flag = _CODECS[self.codec]
+            ok, buf = cv2.imencode(ext, frame, [flag, self.quality])
+            if not ok:
+                raise RuntimeError(f"影像編碼失敗（{self.codec}）")
+            slot = self._alloc_slot(row)
+            self._encoded_bytes -= len(self._encoded[slot] or b"")
+            self._encoded[slot] = buf.tobytes()
+            self._encoded_bytes += len(self._encoded[slot])
+        self._track_peak()
+
+    def image(self, row: int) -> Optional[np.ndarray]:
+        """
+        該列影像（沒有影像回 None）。raw 回傳緩衝區 view（drop_image 後內容可能被覆寫），
+        壓縮 codec 每次呼叫都會解碼出新的 BGR 陣列。
+        """
+        slot = int(self._slots[row])
+        if slot < 0:
+            return None
+        if self.codec == "raw":
+            return self._images[slot]
+        return cv2.imdecode(np.frombuffer(self._encoded[slot], dtype=np.uint8), cv2.IMREAD_COLOR)
+
+    def images(self, rows: Iterable[int]) -> List[np.ndarray]:
+        return [self.image(int(r)) for r in rows]
+
+    def has_image(self) -> np.ndarray:
+        return self._slots[:self._n] >= 0
+
+    def drop_image(self, row: int) -> None:
+        slot = int(self._slots[row])
+        if slot >= 0:
+            self._slots[row] = -1
+            self._free_slots.append(slot)
+            if self.codec != "raw":
+                self._encoded_bytes -= len(self._encoded[slot] or b"")
+                self._encoded[slot] = None
+
+    def release_images(self) -> None:
+        """釋放 candidate tier 的所有影像（caption 完成後呼叫）；analysis tier 保留。"""
+        self._images = None
+        self._encoded = []
+        self._encoded_bytes = 0
+        self._slots[:] = -1
+        self._used_slots = 0
+        self._free_slots.clear()
+
+    # ---- 記憶體統計 ----
+    def tier_bytes(self) -> Dict[str, int]:
+        """目前各層佔用的位元組數（raw 緩衝區以已配置的容量計）。"""
+        candidate = self._encoded_bytes if self.codec != "raw" else (
+            int(self._images.nbytes) if self._images is not None else 0)
+        return {
+            "analysis": int(self._analysis.nbytes) if self._analysis is not None else 0,
+            "candidate": candidate,
+        }
+
+    def _track_peak(self) -> None:
+        for tier, value in self.tier_bytes().items():
+            if value > self.peak_tier_bytes[tier]:
+                self.peak_tier_bytes[tier] = value
+
+    # ---- 常用查詢 ----
+    def selected(self) -> np.ndarray:
+        """清晰、顯著且（pre-detector 判定）有活動的列（會送進 caption / LLM）。"""
+        return np.flatnonzero(self.is_not_blurry & self.is_significant & self.has_activity)
+
+    def caption_candidates(self) -> np.ndarray:
+        """selected() 中仍保有影像的列。"""
+        return np.flatnonzero(self.is_not_blurry & self.is_significant & self.has_activity & self.has_image())
+
+    def captioned_count(self) -> int:
+        return sum(1 for c in self.captions if c and c != SKIPPED_CAPTION)
+
+    def summary(self) -> str:
+        return (f"frames_dicts summary: total={self._n}, blurry={int(self._n - self.is_not_blurry.sum())}, "
+                f"significant={int(self.is_significant.sum())}")
+
+    # ---- 與舊的 list[dict] 格式互轉 ----
+    @classmethod
+    def from_dicts(cls, frames_dicts: List[Dict[str, Any]]) -> "FrameBatch":
+        batch = cls(capacity=len(frames_dicts) or 1)
+        rows = batch.extend(
+            float(f["stamp"]) if f.get("stamp") is not None else np.nan for f in frames_dicts
+        )
+        for row, item in zip(range(rows.start, rows.stop), frames_dicts):
+            for name in ("variance", "ssim_value", "mse_value", "is_not_blurry", "is_significant", "has_activity"):
+                value = item.get(name)
+                if value is not None:
+                    batch._data[name][row] = value
+            batch.captions[row] = item.get("caption")
+            frame = item.get("frame")
+            if frame is not None and hasattr(frame, "shape"):
+                batch.set_image(row, frame)
+        return batch
+
+    def to_dicts(self, include_images: bool = False) -> List[Dict[str, Any]]:
+        out = []
+        for row in range(self._n):
+            item = {
+                "stamp": _nan_to_none(self.stamp[row]),
+                "variance": _nan_to_none(self.variance[row]),
+                "is_not_blurry": bool(self.is_not_blurry[row]),
+                "ssim_value": _nan_to_none(self.ssim_value[row]),
+                "mse_value": _nan_to_none(self.mse_value[row]),
+                "is_significant": bool(self.is_significant[row]),
+                "has_activity": bool(self.has_activity[row]),
+                "caption": self.captions[row],
+            }
+            if include_images:
+                item["frame"] = self.image(row)
+            out.append(item)
+        return out
+
+    # ---- 序列化（job checkpoint 用）----
+    def to_bytes(self, extra: Optional[Dict[str, Any]] = None) -> bytes:
+        """
+        序列化成 .npz bytes：欄位、captions、analysis tier 與仍保有的 candidate 影像
+        （壓縮 codec 直接存 bytes，不重新編碼）。extra 為一併保存的 JSON 資料。
+        """
+        n = self._n
+        arrays: Dict[str, np.ndarray] = {name: self._data[name][:n] for name in _COLUMNS}
+        image_rows = np.flatnonzero(self.has_image())
+        arrays["image_rows"] = image_rows.astype(np.int64)
+        if len(image_rows) and self.codec == "raw":
+            arrays["raw_images"] = np.stack(self.images(image_rows))
+        elif len(image_rows):
+            blobs = [self._encoded[int(self._slots[r])] for r in image_rows]
+            arrays["encoded"] = np.frombuffer(b"".join(blobs), dtype=np.uint8)
+            arrays["encoded_offsets"] = np.cumsum([0] + [len(b) for b in blobs]).astype(np.int64)
+        if self._analysis is not None:
+            arrays["analysis"] = self._analysis[:n]
+        meta = {
+            "codec": self.codec,
+            "quality": self.quality,
+            "analysis_width": self.analysis_width,
+            "captions": self.captions,
+            "extra": extra or {},
+        }
+        arrays["meta"] = np.frombuffer(json.dumps(meta, ensure_ascii=False, default=str).encode("utf-8"), dtype=np.uint8)
+        buf = io.BytesIO()
+        np.savez(buf, **arrays)
+        return buf.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> Tuple["FrameBatch", Dict[str, Any]]:
+        """to_bytes 的反向；回傳 (batch, extra)。"""
+        with np.load(io.BytesIO(data), allow_pickle=False) as z:
+            meta = json.loads(z["meta"].tobytes().decode("utf-8"))
+            stamps = z["stamp"]
+            batch = cls(capacity=len(stamps) or 1, codec=meta["codec"],
+                        quality=meta["quality"], analysis_width=meta["analysis_width"])
+            rows = batch.extend(stamps)
+            for name in _COLUMNS:
+                if name in z.files:  # 舊版 checkpoint 可能沒有後來新增的欄位，維持預設值
+                    batch._data[name][rows] = z[name]
+            batch.captions = list(meta["captions"])
+            if "analysis" in z.files:
+                analysis = z["analysis"]
+                batch._analysis = np.zeros((batch._slots.shape[0],) + analysis.shape[1:], dtype=np.uint8)
+                batch._analysis[rows] = analysis
+            image_rows = [int(r) for r in z["image_rows"]]
+            if "raw_images" in z.files:
+                for row, image in zip(image_rows, z["raw_images"]):
+                    batch.set_image(row, image)
+            elif "encoded" in z.files:
+                blob, offsets = z["encoded"], z["encoded_offsets"]
+                for i, row in enumerate(image_rows):
+                    slot = batch._alloc_slot(row)
+                    batch._encoded[slot] = blob[offsets[i]:offsets[i + 1]].tobytes()
+                    batch._encoded_bytes += len(batch._encoded[slot])
+        batch._track_peak()
+        return batch, meta.get("extra") or {}
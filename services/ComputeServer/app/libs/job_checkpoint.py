@@ -0,0 +1,111 @@
+"""
+影片描述 job 的階段 checkpoint（Redis，沿用 libs.redis_client）。
+
+一個 job 一個 HASH：job_ckpt:{job_id}，field 為階段名稱：
+    frames     ：串流取幀 + 過濾完成（FrameBatch，含壓縮後的 candidate 影像）
+    captions   ：caption 完成（FrameBatch，影像已釋放）
+    llm        ：LLM 結果（llm_result / frames_summary / usage）
+    embeddings ：已算好 embedding 的 events
+另外存一個 _fingerprint（input_url + params 的雜湊），job 內容不同時舊的 checkpoint 直接作廢。
+整個 HASH 共用一個 TTL（JOB_CHECKPOINT_TTL，每次寫入都會刷新）。
+
+worker 當掉被重派（acks_late）、soft time limit 或 LLM 失敗後重新排入時，
+同一個 job_id 會從第一個還沒完成的階段繼續。Redis 不可用時等同沒有 checkpoint。
+"""
+import hashlib
+import json
+import os
+from typing import Any, Dict, List, Optional
+
+from .redis_client import get_redis
+
+JOB_CHECKPOINT_ENABLED = os.getenv("JOB_CHECKPOINT_ENABLED", "1").lower() in ("1", "true", "yes", "on")
+JOB_CHECKPOINT_TTL = int(os.getenv("JOB_CHECKPOINT_TTL", str(6 * 3600)))
+STAGES = ("frames", "captions", "llm", "embeddings")
+
+# 不影響結果、或不該進雜湊的參數
+_FINGERPRINT_IGNORED = {"google_api_key", "progress"}
+
+
+def job_fingerprint(job: dict) -> str:
+    params = {k: v for k, v in (job.get("params") or {}).items() if k not in _FINGERPRINT_IGNORED}
+    payload = json.dumps({"input_url": job.get("input_url"), "params": params}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class JobCheckpoint:
+    def __init__(self, job_id: Optional[str], fingerprint: str = "", enabled: bool = JOB_CHECKPOINT_ENABLED):
+        self.enabled = bool(enabled and job_id)
+        self.key = f"job_ckpt:{job_id}"
+        self.fingerprint = fingerprint
+        self.stats: Dict[str, Any] = {"loaded": [], "saved": [], "bytes_saved": 0, "resumed_from": None}
+        self._checked = False
+
+    @classmethod
+    def for_job(cls, job: dict) -> "JobCheckpoint":
+        return cls(job.get("job_id"), job_fingerprint(job))
+
+    def _check_fingerprint(self) -> None:
+        """第一次讀取前比對 fingerprint，不同就清掉舊的 checkpoint。"""
+        if self._checked:
+            return
+        self._checked = True
+        r = get_redis()
+        stored = r.hget(self.key, "_fingerprint")
+        if stored is not None and stored.decode("utf-8") != self.fingerprint:
+            print(f"[Checkpoint] {self.key} 的 job 內容已變更，捨棄舊的 checkpoint")
+            r.delete(self.key)
+
+    def load(self, stage: str) -> Optional[bytes]:
+        if not self.enabled:
+            return None
+        try:
+            self._check_fingerprint()
+            data = get_redis().hget(self.key, stage)
+        except Exception as e:
+            print(f"[Checkpoint] ⚠️ 讀取 {self.key}/{stage} 失敗: {e}")
+            return None
+        if data is not None:
+            self.stats["loaded"].append(stage)
+            self.stats["resumed_from"] = self.resumed_from()
+        return data
+
+    def save(self, stage: str, data: bytes) -> None:
+        if not self.enabled:
+            return
+        try:
+            self._check_fingerprint()
+            pipe = get_redis().pipeline()
+            pipe.hset(self.key, mapping={stage: data, "_fingerprint": self.fingerprint})
+            pipe.expire(self.key, JOB_CHECKPOINT_TTL)
+            pipe.execute()
+            self.stats["saved"].append(stage)
+            self.stats["bytes_saved"] += len(data)
+        except Exception as e:
+            print(f"[Checkpoint] ⚠️ 寫入 {self.key}/{stage} 失敗: {e}")
+
+    def load_json(self, stage: str) -> Optional[Any]:
+        data = self.load(stage)
+        if data is None:
+            return None
+        try:
+            return json.loads(data)
+        except ValueError:
+            return None
+
+    def save_json(self, stage: str, value: Any) -> None:
+        self.save(stage, json.dumps(value, ensure_ascii=False, default=str).encode("utf-8"))
+
+    def clear(self) -> None:
+        """job 結果已送出後呼叫。"""
+        if not self.enabled:
+            return
+        try:
+            get_redis().delete(self.key)
+        except Exception as e:
+            print(f"[Checkpoint] ⚠️ 刪除 {self.key} 失敗: {e}")
+
+    def resumed_from(self) -> Optional[str]:
+        """本次實際從哪個階段之後繼續（沒有載入任何 checkpoint 回 None）。"""
+        loaded: List[str] = [s for s in STAGES if s in self.stats["loaded"]]
+        return loaded[-1] if loaded else None
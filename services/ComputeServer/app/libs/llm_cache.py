@@ -0,0 +1,66 @@
+"""
+LLM 回應快取（content-addressed）。
+
+key = sha256(模型名稱, system prompt 版本, 生成設定, 壓縮後的 frames 摘要)；
+value = 已通過 LLMResponse 驗證的結果（JSON）與當次的 token 用量。
+同一段影片重送（acks_late / visibility timeout 重派、手動重跑）時直接命中，不再呼叫 Gemini。
+
+LLM_CACHE_BACKEND：redis（預設，沿用 libs.redis_client）| disk（LLM_CACHE_DIR）| off
+LLM_CACHE_TTL：秒，預設 7 天
+"""
+import hashlib
+import json
+import os
+import time
+from typing import Any, Dict, Optional
+
+from .redis_client import get_redis
+
+LLM_CACHE_BACKEND = os.getenv("LLM_CACHE_BACKEND", "redis").lower()
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", "/tmp/llm-cache")
+
+
+def make_cache_key(model_name: str, system_prompt: str, config: Dict[str, Any], prompt_text: str) -> str:
+    """system prompt 以內容雜湊當版本（可用 SYSTEM_PROMPT_VERSION 覆蓋），改 prompt 就自然換 key。"""
+    prompt_version = os.getenv("SYSTEM_PROMPT_VERSION") or hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()
+    h = hashlib.sha256()
+    for part in (model_name, prompt_version, json.dumps(config, sort_keys=True, ensure_ascii=False), prompt_text):
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def get_cached_response(key: str) -> Optional[Dict[str, Any]]:
+    """回傳 {"result": ..., "usage": ...}；未命中或快取不可用時回 None。"""
+    try:
+        if LLM_CACHE_BACKEND == "redis":
+            raw = get_redis().get(f"llm_cache:{key}")
+        elif LLM_CACHE_BACKEND == "disk":
+            path = os.path.join(LLM_CACHE_DIR, f"{key}.json")
+            if not os.path.isfile(path) or time.time() - os.path.getmtime(path) > LLM_CACHE_TTL:
+                return None
+            with open(path, "rb") as f:
+                raw = f.read()
+        else:
+            return None
+        return json.loads(raw) if raw else None
+    except Exception as e:
+        print(f"[LLMCache] ⚠️ 讀取失敗: {e}")
+        return None
+
+
+def put_cached_response(key: str, result: Dict[str, Any], usage: Dict[str, Any]) -> None:
+    payload = json.dumps({"result": result, "usage": usage}, ensure_ascii=False)
+    try:
+        if LLM_CACHE_BACKEND == "redis":
+            get_redis().set(f"llm_cache:{key}", payload, ex=LLM_CACHE_TTL)
+        elif LLM_CACHE_BACKEND == "disk":
+            os.makedirs(LLM_CACHE_DIR, exist_ok=True)
+            path = os.path.join(LLM_CACHE_DIR, f"{key}.json")
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(payload)
+            os.replace(tmp, path)
+    except Exception as e:
+        print(f"[LLMCache] ⚠️ 寫入失敗: {e}")
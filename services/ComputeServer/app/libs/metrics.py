@@ -0,0 +1,339 @@
+"""
+每個階段（presign / open / decode / blur / diff / caption / llm / embedding / api_callback）的耗時與資源統計。
+
+- StageRecorder：一個 job 一個，記錄 wall time、CPU time（整個行程）、peak RSS 增量（ru_maxrss 高水位的上升量）、處理項目數
+- 以 contextvar 綁定目前 job 的 recorder：with recording(rec): ... 區塊內呼叫 stage("blur") 即記到該 job
+- 同樣的數字也累加到行程層級的彙總，輸出 Prometheus text format：
+    METRICS_HTTP_PORT > 0       → Celery 主行程起一個 /metrics HTTP endpoint，彙總所有子行程
+    METRICS_PUSHGATEWAY_URL     → 每個 job 結束後 push 到 pushgateway（以 hostname-pid 當 instance）
+
+prefork 時任務跑在子行程，而且每 --max-tasks-per-child 個任務就換一個新的子行程，
+所以 /metrics 不在子行程各自開（同一個 port 只有一個搶得到、換行程後計數歸零）：
+    - 子行程每次記錄後把自己的彙總寫到 METRICS_MULTIPROC_DIR/{pid}.json
+    - 子行程結束時把自己的檔案併進 _archive.json（計數器維持單調遞增）
+    - 主行程的 /metrics 讀取 _archive.json + 所有子行程的檔案加總後輸出
+"""
+import contextvars
+import fcntl
+import json
+import os
+import resource
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List, Optional
+
+METRICS_HTTP_PORT = int(os.getenv("METRICS_HTTP_PORT", "0"))
+METRICS_PUSHGATEWAY_URL = os.getenv("METRICS_PUSHGATEWAY_URL", "")
+METRICS_JOB_NAME = os.getenv("METRICS_JOB_NAME", "compute_worker")
+METRICS_MULTIPROC_DIR = os.getenv("METRICS_MULTIPROC_DIR", "/tmp/compute-metrics")
+_LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60, 120, 300)
+
+
+def _maxrss_bytes() -> int:
+    # Linux 的 ru_maxrss 單位是 KB
+    return int(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss) * 1024
+
+
+class StageRecorder:
+    """單一 job 的各階段統計（同一階段多次呼叫會累加）。"""
+
+    def __init__(self):
+        self._stages: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, wall: float, cpu: float = 0.0, rss_delta: int = 0, items: int = 0) -> None:
+        with self._lock:
+            s = self._stages.setdefault(name, {
+                "calls": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0, "rss_peak_delta_bytes": 0, "items": 0,
+            })
+            s["calls"] += 1
+            s["wall_seconds"] += wall
+            s["cpu_seconds"] += cpu
+            s["rss_peak_delta_bytes"] += max(0, int(rss_delta))
+            s["items"] += int(items or 0)
+        _AGGREGATE.observe(name, wall, cpu, rss_delta, items)
+
+    def as_metrics(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {name: dict(values) for name, values in self._stages.items()}
+
+
+_CURRENT: contextvars.ContextVar[Optional[StageRecorder]] = contextvars.ContextVar("stage_recorder", default=None)
+
+
+def current_recorder() -> Optional[StageRecorder]:
+    return _CURRENT.get()
+
+
+@contextmanager
+def recording(recorder: StageRecorder) -> Iterator[StageRecorder]:
+    """把 recorder 綁定為目前 context 的 job recorder。"""
+    token = _CURRENT.set(recorder)
+    try:
+        yield recorder
+    finally:
+        _CURRENT.reset(token)
+
+
+class _StageHandle:
+    def __init__(self):
+        self.items = 0
+
+    def add_items(self, n: int) -> None:
+        self.items += int(n or 0)
+
+
+@contextmanager
+def stage(name: str, items: int = 0) -> Iterator[_StageHandle]:
+    """量測一個階段；沒有綁定 recorder 時只累加到行程層級彙總。"""
+    handle = _StageHandle()
+    handle.add_items(items)
+    wall0, cpu0, rss0 = time.perf_counter(), time.process_time(), _maxrss_bytes()
+    try:
+        yield handle
+    finally:
+        wall = time.perf_counter() - wall0
+        cpu = time.process_time() - cpu0
+        rss_delta = _maxrss_bytes() - rss0
+        record_stage(name, wall, cpu, rss_delta, handle.items)
+
+
+def record_stage(name: str, wall: float, cpu: float = 0.0, rss_delta: int = 0, items: int = 0) -> None:
+    """記錄一段已量好的時間（例如 generator 內累加的解碼時間）。"""
+    recorder = _CURRENT.get()
+    if recorder is not None:
+        recorder.add(name, wall, cpu, rss_delta, items)
+    else:
+        _AGGREGATE.observe(name, wall, cpu, rss_delta, items)
+
+
+class _Aggregate:
+    """行程層級的累計值（給 Prometheus 用）。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages: Dict[str, Dict[str, Any]] = {}
+
+    def observe(self, name: str, wall: float, cpu: float, rss_delta: int, items: int) -> None:
+        with self._lock:
+            s = self._stages.setdefault(name, {
+                "count": 0, "wall": 0.0, "cpu": 0.0, "rss": 0, "items": 0,
+                "buckets": [0] * len(_LATENCY_BUCKETS),
+            })
+            s["count"] += 1
+            s["wall"] += wall
+            s["cpu"] += cpu
+            s["rss"] += max(0, int(rss_delta))
+            s["items"] += int(items or 0)
+            for i, bound in enumerate(_LATENCY_BUCKETS):
+                if wall <= bound:
+                    s["buckets"][i] += 1
+        if _SHARED_WRITER:
+            _write_shared_snapshot()
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {k: dict(v, buckets=list(v["buckets"])) for k, v in self._stages.items()}
+
+    def render(self) -> str:
+        return _render_stages(self.snapshot())
+
+
+def _merge_stages(into: Dict[str, Dict[str, Any]], stages: Dict[str, Dict[str, Any]]) -> None:
+    for name, s in stages.items():
+        t = into.setdefault(name, {
+            "count": 0, "wall": 0.0, "cpu": 0.0, "rss": 0, "items": 0,
+            "buckets": [0] * len(_LATENCY_BUCKETS),
+        })
+        for key in ("count", "wall", "cpu", "rss", "items"):
+            t[key] += s.get(key, 0)
+        for i, count in enumerate(s.get("buckets", [])[:len(_LATENCY_BUCKETS)]):
+            t["buckets"][i] += count
+
+
+def _render_stages(stages: Dict[str, Dict[str, Any]]) -> str:
+    lines: List[str] = [
+        "# HELP compute_stage_wall_seconds Wall time per pipeline stage.",
+        "# TYPE compute_stage_wall_seconds histogram",
+    ]
+    for name, s in sorted(stages.items()):
+        for bound, count in zip(_LATENCY_BUCKETS, s["buckets"]):
+            lines.append(f'compute_stage_wall_seconds_bucket{{stage="{name}",le="{bound}"}} {count}')
+        lines.append(f'compute_stage_wall_seconds_bucket{{stage="{name}",le="+Inf"}} {s["count"]}')
+        lines.append(f'compute_stage_wall_seconds_sum{{stage="{name}"}} {s["wall"]:.6f}')
+        lines.append(f'compute_stage_wall_seconds_count{{stage="{name}"}} {s["count"]}')
+    for metric, key, help_text in (
+        ("compute_stage_cpu_seconds_total", "cpu", "Process CPU time spent inside each stage."),
+        ("compute_stage_rss_peak_delta_bytes_total", "rss", "Increase of peak RSS observed during each stage."),
+        ("compute_stage_items_total", "items", "Items (frames, events, ...) processed by each stage."),
+    ):
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} counter")
+        for name, s in sorted(stages.items()):
+            value = f"{s[key]:.6f}" if isinstance(s[key], float) else str(s[key])
+            lines.append(f'{metric}{{stage="{name}"}} {value}')
+    return "\n".join(lines) + "\n"
+
+
+_AGGREGATE = _Aggregate()
+
+# ---- prefork 子行程彙總（寫在 METRICS_MULTIPROC_DIR，由主行程的 /metrics 加總）----
+_SHARED_WRITER = False
+_SHARED_WRITE_LOCK = threading.Lock()
+_ARCHIVE_NAME = "_archive.json"
+
+
+def _shared_path(name: str) -> str:
+    return os.path.join(METRICS_MULTIPROC_DIR, name)
+
+
+def _read_stages(path: str) -> Dict[str, Dict[str, Any]]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _write_stages(path: str, stages: Dict[str, Dict[str, Any]]) -> None:
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(stages, f)
+    os.replace(tmp, path)
+
+
+def _write_shared_snapshot() -> None:
+    try:
+        with _SHARED_WRITE_LOCK:
+            _write_stages(_shared_path(f"{os.getpid()}.json"), _AGGREGATE.snapshot())
+    except Exception as e:
+        print(f"[Metrics] ⚠️ 寫入共用 metrics 失敗: {e}")
+
+
+class _SharedLock:
+    """archive 合併（LOCK_EX）與 /metrics 讀取（LOCK_SH）互斥，避免同一份數字被算兩次。"""
+
+    def __init__(self, exclusive: bool):
+        self.exclusive = exclusive
+
+    def __enter__(self):
+        self._file = open(_shared_path(".lock"), "a+")
+        fcntl.flock(self._file, fcntl.LOCK_EX if self.exclusive else fcntl.LOCK_SH)
+        return self
+
+    def __exit__(self, *exc):
+        fcntl.flock(self._file, fcntl.LOCK_UN)
+        self._file.close()
+
+
+def reset_shared_metrics() -> None:
+    """Celery 主行程啟動時（子行程 fork 前）清空上一次執行留下的檔案。"""
+    if METRICS_HTTP_PORT <= 0:
+        return
+    os.makedirs(METRICS_MULTIPROC_DIR, exist_ok=True)
+    for name in os.listdir(METRICS_MULTIPROC_DIR):
+        try:
+            os.remove(_shared_path(name))
+        except OSError:
+            pass
+
+
+def enable_shared_metrics() -> None:
+    """子行程啟動時呼叫：之後每次記錄都寫到共用目錄。"""
+    global _SHARED_WRITER
+    if METRICS_HTTP_PORT <= 0:
+        return
+    os.makedirs(METRICS_MULTIPROC_DIR, exist_ok=True)
+    _SHARED_WRITER = True
+    _write_shared_snapshot()
+
+
+def archive_shared_metrics() -> None:
+    """子行程結束前呼叫：把自己的累計併進 _archive.json，刪掉 {pid}.json。"""
+    global _SHARED_WRITER
+    if not _SHARED_WRITER:
+        return
+    _SHARED_WRITER = False  # 之後不再寫 {pid}.json，避免合併後又被算一次
+    own = _shared_path(f"{os.getpid()}.json")
+    try:
+        with _SharedLock(exclusive=True):
+            archive_path = _shared_path(_ARCHIVE_NAME)
+            archive = _read_stages(archive_path)
+            _merge_stages(archive, _AGGREGATE.snapshot())
+            _write_stages(archive_path, archive)
+            os.remove(own)
+    except Exception as e:
+        print(f"[Metrics] ⚠️ 合併 metrics 失敗: {e}")
+
+
+def collect_shared_stages() -> Dict[str, Dict[str, Any]]:
+    """archive + 所有存活（或被硬殺、來不及合併）子行程的檔案；本行程自己的彙總也算進去。"""
+    stages: Dict[str, Dict[str, Any]] = {}
+    if os.path.isdir(METRICS_MULTIPROC_DIR):
+        with _SharedLock(exclusive=False):
+            for name in os.listdir(METRICS_MULTIPROC_DIR):
+                if name.endswith(".json"):
+                    _merge_stages(stages, _read_stages(_shared_path(name)))
+    if not _SHARED_WRITER:
+        # -P solo 時任務直接跑在主行程
+        _merge_stages(stages, _AGGREGATE.snapshot())
+    return stages
+
+
+def render_prometheus() -> str:
+    """本行程的彙總（push 到 pushgateway 用）。"""
+    return _AGGREGATE.render()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") not in ("", "/metrics"):
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = _render_stages(collect_shared_stages()).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_SERVER: Optional[ThreadingHTTPServer] = None
+_SERVER_LOCK = threading.Lock()
+
+
+def start_metrics_server(port: int = METRICS_HTTP_PORT) -> None:
+    """在 Celery 主行程起 /metrics endpoint（port <= 0 時不啟動），輸出所有子行程的加總。"""
+    global _SERVER
+    if port <= 0:
+        return
+    with _SERVER_LOCK:
+        if _SERVER is not None:
+            return
+        try:
+            _SERVER = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+        except OSError as e:
+            print(f"[Metrics] ⚠️ 無法在 port {port} 啟動 /metrics: {e}")
+            return
+        threading.Thread(target=_SERVER.serve_forever, name="metrics-http", daemon=True).start()
+        print(f"[Metrics] /metrics 已啟動於 port {port}")
+
+
+def push_metrics() -> None:
+    """推送到 pushgateway（未設定 METRICS_PUSHGATEWAY_URL 時不做事）。"""
+    if not METRICS_PUSHGATEWAY_URL:
+        return
+    import requests
+    instance = f"{socket.gethostname()}-{os.getpid()}"
+    url = f"{METRICS_PUSHGATEWAY_URL.rstrip('/')}/metrics/job/{METRICS_JOB_NAME}/instance/{instance}"
+    try:
+        requests.put(url, data=render_prometheus().encode("utf-8"), timeout=5)
+    except Exception as e:
+        print(f"[Metrics] ⚠️ push 到 pushgateway 失敗: {e}")
@@ -0,0 +1,215 @@
+"""
+模型生命週期管理（captioner、RAG embedding 等大型模型共用）。
+
+- 有任務時保持載入；最後一次使用後超過 MODEL_IDLE_TTL 秒就卸載，下次用到再延遲載入
+- 行程 RSS 超過 MODEL_RSS_WATERMARK_MB 時，從最久沒用的閒置模型開始卸載
+- 使用中（use() 區塊內）的模型不會被卸載
+- stats() 提供各模型的載入 / 卸載次數與載入耗時，方便在記憶體與冷啟動成本之間取捨
+
+背景的 reaper thread 在第一次 get() 時才啟動；prefork 的子行程 fork 後會自己重新啟動一條。
+"""
+import gc
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional
+
+MODEL_IDLE_TTL = float(os.getenv("MODEL_IDLE_TTL", "60"))
+MODEL_RSS_WATERMARK_MB = float(os.getenv("MODEL_RSS_WATERMARK_MB", "0"))  # 0 = 不檢查
+MODEL_REAPER_INTERVAL = float(os.getenv("MODEL_REAPER_INTERVAL", "10"))
+
+
+def current_rss_bytes() -> int:
+    """目前行程的 RSS（讀 /proc/self/status；非 Linux 時回傳 0）。"""
+    try:
+        with open("/proc/self/status", "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except Exception:
+        pass
+    return 0
+
+
+def _release_memory() -> None:
+    gc.collect()
+    torch = sys.modules.get("torch")
+    if torch is not None and torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+class _Entry:
+    def __init__(self, name: str, loader: Callable[[], Any], unloader: Optional[Callable[[Any], None]]):
+        self.name = name
+        self.loader = loader
+        self.unloader = unloader
+        self.model: Any = None
+        self.lock = threading.Lock()
+        self.in_use = 0
+        self.last_used = 0.0
+        self.load_count = 0
+        self.unload_count = 0
+        self.last_load_seconds: Optional[float] = None
+        self.total_load_seconds = 0.0
+
+
+class ModelRegistry:
+    def __init__(self, idle_ttl: float = MODEL_IDLE_TTL, rss_watermark_mb: float = MODEL_RSS_WATERMARK_MB):
+        self.idle_ttl = idle_ttl
+        self.rss_watermark_bytes = int(rss_watermark_mb * 1024 * 1024)
+        self._entries: Dict[str, _Entry] = {}
+        self._lock = threading.Lock()
+        self._reaper: Optional[threading.Thread] = None
+        self._reaper_pid: Optional[int] = None
+
+    def register(self, name: str,
+                 loader: Callable[[], Any],
+                 unloader: Optional[Callable[[Any], None]] = None,
+                 *,
+                 replace: bool = False) -> None:
+        """
+        註冊模型（重複註冊同名會沿用已存在的項目）。unloader 收到要卸載的模型物件。
+        replace=True 時先卸載舊的再換成新的 loader（benchmark 換 stub 模型用）。
+        """
+        if replace and name in self._entries:
+            self.unload(name, reason="replaced")
+        with self._lock:
+            if replace or name not in self._entries:
+                self._entries[name] = _Entry(name, loader, unloader)
+
+    def _entry(self, name: str) -> _Entry:
+        try:
+            return self._entries[name]
+        except KeyError:
+            raise KeyError(f"模型未註冊：{name}") from None
+
+    @staticmethod
+    def _load_locked(entry: _Entry) -> Any:
+        """呼叫端需持有 entry.lock。"""
+        if entry.model is None:
+            print(f"[ModelRegistry] 載入模型 {entry.name} ...")
+            t0 = time.perf_counter()
+            entry.model = entry.loader()
+            elapsed = time.perf_counter() - t0
+            entry.load_count += 1
+            entry.last_load_seconds = elapsed
+            entry.total_load_seconds += elapsed
+            print(f"[ModelRegistry] ✅ {entry.name} 載入完成 ({elapsed:.2f}s)")
+        entry.last_used = time.monotonic()
+        return entry.model
+
+    def get(self, name: str) -> Any:
+        """
+        取得模型（未載入就載入），並更新最後使用時間。
+        回傳後沒有釘住，閒置超過 TTL 仍可能被卸載；會持續使用的呼叫端請用 use()。
+        """
+        self._ensure_reaper()
+        entry = self._entry(name)
+        with entry.lock:
+            return self._load_locked(entry)
+
+    @contextmanager
+    def use(self, name: str) -> Iterator[Any]:
+        """區塊內持有模型，期間不會被 idle / RSS 回收。"""
+        self._ensure_reaper()
+        entry = self._entry(name)
+        # 載入與 in_use += 1 在同一個 lock 內，reaper 不會在兩者之間卸載
+        with entry.lock:
+            model = self._load_locked(entry)
+            entry.in_use += 1
+        try:
+            yield model
+        finally:
+            with entry.lock:
+                entry.in_use -= 1
+                entry.last_used = time.monotonic()
+
+    def is_loaded(self, name: str) -> bool:
+        entry = self._entries.get(name)
+        return entry is not None and entry.model is not None
+
+    def unload(self, name: str, reason: str = "manual") -> bool:
+        """卸載模型；使用中則不動並回傳 False。"""
+        entry = self._entry(name)
+        with entry.lock:
+            if entry.model is None or entry.in_use > 0:
+                return False
+            model, entry.model = entry.model, None
+            entry.unload_count += 1
+        try:
+            if entry.unloader is not None:
+                entry.unloader(model)
+        finally:
+            del model
+            _release_memory()
+        print(f"[ModelRegistry] 🧹 已卸載 {name}（{reason}）")
+        return True
+
+    def reap(self) -> None:
+        """執行一次回收：先卸載閒置超過 TTL 的模型，再依 RSS 水位從最久沒用的開始卸載。"""
+        now = time.monotonic()
+        if self.idle_ttl > 0:
+            for name, entry in list(self._entries.items()):
+                if entry.model is not None and entry.in_use == 0 and now - entry.last_used >= self.idle_ttl:
+                    self.unload(name, reason=f"idle {now - entry.last_used:.0f}s")
+        if self.rss_watermark_bytes > 0 and current_rss_bytes() > self.rss_watermark_bytes:
+            idle = sorted(
+                (e for e in self._entries.values() if e.model is not None and e.in_use == 0),
+                key=lambda e: e.last_used,
+            )
+            for entry in idle:
+                if current_rss_bytes() <= self.rss_watermark_bytes:
+                    break
+                self.unload(entry.name, reason="rss watermark")
+
+    def _ensure_reaper(self) -> None:
+        if self.idle_ttl <= 0 and self.rss_watermark_bytes <= 0:
+            return
+        pid = os.getpid()
+        if self._reaper is not None and self._reaper_pid == pid and self._reaper.is_alive():
+            return
+        with self._lock:
+            if self._reaper is not None and self._reaper_pid == pid and self._reaper.is_alive():
+                return
+            self._reaper = threading.Thread(target=self._reaper_loop, name="model-reaper", daemon=True)
+            self._reaper_pid = pid
+            self._reaper.start()
+
+    def _reaper_loop(self) -> None:
+        while True:
+            time.sleep(MODEL_REAPER_INTERVAL)
+            try:
+                self.reap()
+            except Exception as e:
+                print(f"[ModelRegistry] ⚠️ 回收失敗: {e}")
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        now = time.monotonic()
+        return {
+            name: {
+                "loaded": e.model is not None,
+                "in_use": e.in_use,
+                "idle_seconds": (now - e.last_used) if e.last_used else None,
+                "load_count": e.load_count,
+                "unload_count": e.unload_count,
+                "last_load_seconds": e.last_load_seconds,
+                "total_load_seconds": e.total_load_seconds,
+            }
+            for name, e in self._entries.items()
+        }
+
+
+_REGISTRY: Optional[ModelRegistry] = None
+_REGISTRY_LOCK = threading.Lock()
+
+
+def get_registry() -> ModelRegistry:
+    """每個行程一個 registry。"""
+    global _REGISTRY
+    if _REGISTRY is None:
+        with _REGISTRY_LOCK:
+            if _REGISTRY is None:
+                _REGISTRY = ModelRegistry()
+    return _REGISTRY
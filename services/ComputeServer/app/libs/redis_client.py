@@ -0,0 +1,36 @@
+"""
+共用的 Redis 連線（各種快取用）。
+預設連到 Celery broker 同一台 Redis，但換到 REDIS_CACHE_DB 這個 db，避免跟 broker / result 的 key 混在一起。
+"""
+import os
+import threading
+from typing import Optional
+from urllib.parse import urlparse, urlunparse
+
+import redis
+
+_REDIS: Optional["redis.Redis"] = None
+_REDIS_LOCK = threading.Lock()
+
+
+def _default_cache_url() -> str:
+    broker = os.getenv("BROKER_URL", "redis://redis:6379/0")
+    parsed = urlparse(broker)
+    if parsed.scheme not in ("redis", "rediss"):
+        return "redis://redis:6379/2"
+    return urlunparse(parsed._replace(path=f"/{os.getenv('REDIS_CACHE_DB', '2')}"))
+
+
+def get_redis() -> "redis.Redis":
+    """取得（每個 process 一個）Redis client；連線失敗時由呼叫端自行處理例外。"""
+    global _REDIS
+    if _REDIS is None:
+        with _REDIS_LOCK:
+            if _REDIS is None:
+                url = os.getenv("REDIS_CACHE_URL") or _default_cache_url()
+                _REDIS = redis.Redis.from_url(
+                    url,
+                    socket_timeout=float(os.getenv("REDIS_CACHE_TIMEOUT", "2")),
+                    socket_connect_timeout=float(os.getenv("REDIS_CACHE_TIMEOUT", "2")),
+                )
+    return _REDIS
@@ -0,0 +1,111 @@
+"""
+Worker 內的背景階段執行器：讓「等網路」的後段（LLM、embedding、回呼 API）在背景 thread 跑，
+Celery worker 主 thread 可以先去接下一個片段的解碼與 caption。
+
+- max_workers：同時執行的後段數
+- max_inflight：已送出但尚未完成的後段上限；超過時 submit() 會阻塞（背壓，避免前段跑太快把記憶體堆爆）
+- drain()：worker 行程結束前等所有後段完成（由 app.main 的 worker_process_shutdown 呼叫）
+
+每個後段只拿到自己 job 的資料（呼叫端負責傳入獨立的物件），執行器本身不共享任何 job 狀態。
+"""
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+STAGE_EXECUTOR_WORKERS = int(os.getenv("VIDEO_TAIL_WORKERS", "2"))
+STAGE_EXECUTOR_MAX_INFLIGHT = int(os.getenv("VIDEO_TAIL_MAX_INFLIGHT", "2"))
+
+
+class BoundedStageExecutor:
+    def __init__(self, name: str, max_workers: int = STAGE_EXECUTOR_WORKERS,
+                 max_inflight: int = STAGE_EXECUTOR_MAX_INFLIGHT):
+        self.name = name
+        self.max_workers = max(1, int(max_workers))
+        self.max_inflight = max(1, int(max_inflight))
+        self._slots = threading.BoundedSemaphore(self.max_inflight)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+        self._inflight = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.wait_seconds = 0.0
+
+    def _pool(self) -> ThreadPoolExecutor:
+        # prefork 子行程不會繼承 parent 的 thread，依 pid 重新建立
+        pid = os.getpid()
+        if self._executor is None or self._pid != pid:
+            with self._lock:
+                if self._executor is None or self._pid != pid:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=self.name)
+                    self._pid = pid
+        return self._executor
+
+    def submit(self, fn: Callable[..., Any], *args, **kwargs) -> Future:
+        """送出一個後段工作；在途數達上限時阻塞到有空位為止。"""
+        t0 = time.perf_counter()
+        self._slots.acquire()
+        waited = time.perf_counter() - t0
+        with self._lock:
+            self._inflight += 1
+            self.submitted += 1
+            self.wait_seconds += waited
+        try:
+            future = self._pool().submit(fn, *args, **kwargs)
+        except Exception:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    def _release(self, future: Optional[Future]) -> None:
+        with self._lock:
+            self._inflight -= 1
+            if future is not None:
+                if future.exception() is not None:
+                    self.failed += 1
+                    print(f"[{self.name}] ⚠️ 背景階段失敗: {future.exception()}")
+                else:
+                    self.completed += 1
+        self._slots.release()
+
+    def drain(self, timeout: Optional[float] = None) -> bool:
+        """等所有在途工作完成；回傳是否在 timeout 內清空。"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                if self._inflight <= 0:
+                    return True
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.2)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "inflight": self._inflight,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "backpressure_wait_seconds": self.wait_seconds,
+            }
+
+
+_EXECUTORS: Dict[str, BoundedStageExecutor] = {}
+_EXECUTORS_LOCK = threading.Lock()
+
+
+def get_stage_executor(name: str) -> BoundedStageExecutor:
+    with _EXECUTORS_LOCK:
+        if name not in _EXECUTORS:
+            _EXECUTORS[name] = BoundedStageExecutor(name)
+        return _EXECUTORS[name]
+
+
+def drain_all(timeout: Optional[float] = None) -> None:
+    for name, executor in list(_EXECUTORS.items()):
+        if not executor.drain(timeout):
+            print(f"[{name}] ⚠️ 結束前仍有 {executor.stats()['inflight']} 個背景階段未完成")
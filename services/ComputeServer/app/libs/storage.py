@@ -0,0 +1,233 @@
+"""
+影片片段的儲存解析層（ComputeServer 各任務共用）。
+
+s3://bucket/key 依序嘗試：
+    1. 共享磁碟：SHARED_MEDIA_ROOT/{bucket}/{key} 存在就直接讀本機檔
+    2. 本機快取：SEGMENT_CACHE_DIR/{bucket}/{key}（read-through，命中時更新 mtime 當作 LRU 時間）
+    3. 都沒有就從 MinIO 一次整檔 GET 到快取（先寫暫存檔再 atomic rename），超過 SEGMENT_CACHE_MAX_MB 時依 mtime 淘汰最舊的檔案
+
+同一台機器上的縮圖、影片描述、Vlog 剪輯共用同一份快取，一段錄影每個節點只會抓一次。
+多個 worker 行程同時要同一個物件時，以 fcntl 檔案鎖確保只有一個在下載；
+鎖檔是 SEGMENT_CACHE_DIR/.locks/ 底下固定數量（SEGMENT_CACHE_LOCK_SLOTS）的檔案，依物件 hash 分配，
+不會隨快取的物件數量增加。
+
+只需要一小段的呼叫端（Vlog 剪輯）可先用 local_object_path() 看本機有沒有現成的檔案，
+沒有時改用 presigned_object_url() 讓 ffmpeg 直接以 HTTP Range 讀需要的部分。
+"""
+import fcntl
+import hashlib
+import os
+import threading
+from datetime import timedelta
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlparse
+
+SHARED_MEDIA_ROOT = os.getenv("SHARED_MEDIA_ROOT", "")
+SEGMENT_CACHE_DIR = os.getenv("SEGMENT_CACHE_DIR", "/tmp/segment-cache")
+SEGMENT_CACHE_MAX_MB = int(os.getenv("SEGMENT_CACHE_MAX_MB", "2048"))  # 0 = 不使用本機快取
+SEGMENT_CACHE_LOCK_SLOTS = max(1, int(os.getenv("SEGMENT_CACHE_LOCK_SLOTS", "64")))
+
+_raw_minio_endpoint = os.getenv("MINIO_ENDPOINT", "minio:9000")
+if "://" in _raw_minio_endpoint:
+    _scheme, _endpoint = _raw_minio_endpoint.split("://", 1)
+    MINIO_ENDPOINT = _endpoint
+    MINIO_SECURE = _scheme.lower() == "https"
+else:
+    MINIO_ENDPOINT = _raw_minio_endpoint
+    MINIO_SECURE = os.getenv("MINIO_SECURE", "false").lower() == "true"
+MINIO_ACCESS_KEY = os.getenv("MINIO_ROOT_USER", "minioadmin")
+MINIO_SECRET_KEY = os.getenv("MINIO_ROOT_PASSWORD", "minioadmin")
+PRESIGN_EXPIRES = int(os.getenv("PRESIGN_EXPIRES", "3600"))  # 秒
+
+_MINIO = None
+_MINIO_LOCK = threading.Lock()
+_STATS_LOCK = threading.Lock()
+_STATS: Dict[str, int] = {"shared_hits": 0, "cache_hits": 0, "fetches": 0, "bytes_fetched": 0, "evictions": 0}
+
+
+def get_minio_client():
+    global _MINIO
+    if _MINIO is None:
+        with _MINIO_LOCK:
+            if _MINIO is None:
+                from minio import Minio
+                _MINIO = Minio(
+                    MINIO_ENDPOINT,
+                    access_key=MINIO_ACCESS_KEY,
+                    secret_key=MINIO_SECRET_KEY,
+                    secure=MINIO_SECURE,
+                )
+    return _MINIO
+
+
+def parse_s3_url(url: str) -> Optional[Tuple[str, str]]:
+    """s3://bucket/key → (bucket, key)；不是 s3:// 回 None。"""
+    if not isinstance(url, str) or not url.startswith("s3://"):
+        return None
+    parsed = urlparse(url)
+    bucket = (parsed.netloc or "").strip()
+    key = (parsed.path or "").lstrip("/")
+    if not bucket or not key:
+        raise ValueError(f"invalid s3 url: {url}")
+    return bucket, key
+
+
+def _bump(name: str, n: int = 1) -> None:
+    with _STATS_LOCK:
+        _STATS[name] += n
+
+
+def storage_stats() -> Dict[str, int]:
+    with _STATS_LOCK:
+        return dict(_STATS)
+
+
+def _safe_join(root: str, bucket: str, key: str) -> str:
+    path = os.path.normpath(os.path.join(root, bucket, key))
+    if not path.startswith(os.path.normpath(root) + os.sep):
+        raise ValueError(f"非法的物件路徑: {bucket}/{key}")
+    return path
+
+
+def _shared_path(bucket: str, key: str) -> Optional[str]:
+    if not SHARED_MEDIA_ROOT:
+        return None
+    path = _safe_join(SHARED_MEDIA_ROOT, bucket, key)
+    return path if os.path.isfile(path) else None
+
+
+def _lock_path(bucket: str, key: str) -> str:
+    """物件對應的下載鎖檔（不同物件可能共用同一個，只是偶爾多等一下）。"""
+    digest = hashlib.sha1(f"{bucket}/{key}".encode("utf-8")).hexdigest()
+    lock_dir = os.path.join(SEGMENT_CACHE_DIR, ".locks")
+    os.makedirs(lock_dir, exist_ok=True)
+    return os.path.join(lock_dir, f"{int(digest, 16) % SEGMENT_CACHE_LOCK_SLOTS}.lock")
+
+
+def _evict(keep: str) -> None:
+    """快取超過上限時，依 mtime 從最舊的開始刪（不刪剛寫入的 keep）。"""
+    budget = SEGMENT_CACHE_MAX_MB * 1024 * 1024
+    files = []
+    total = 0
+    for dirpath, _, filenames in os.walk(SEGMENT_CACHE_DIR):
+        for name in filenames:
+            if name.endswith((".lock", ".part", ".minio")):
+                continue
+            path = os.path.join(dirpath, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+    if total <= budget:
+        return
+    for _, size, path in sorted(files):
+        if total <= budget:
+            break
+        if path == keep:
+            continue
+        try:
+            # 正在被其他行程讀取的檔案 unlink 後仍可讀完（Linux 語意）
+            os.remove(path)
+            total -= size
+            _bump("evictions")
+        except FileNotFoundError:
+            pass
+        try:
+            # 舊版每個物件一個 {path}.lock，順手清掉
+            os.remove(path + ".lock")
+        except FileNotFoundError:
+            pass
+
+
+def local_object_path(bucket: str, key: str) -> Optional[Tuple[str, str]]:
+    """本機已有的副本（共享磁碟 / 節點快取）→ (path, "shared" | "cache")；沒有就回 None，不會下載。"""
+    shared = _shared_path(bucket, key)
+    if shared:
+        _bump("shared_hits")
+        return shared, "shared"
+    if SEGMENT_CACHE_MAX_MB <= 0:
+        return None
+    path = _safe_join(SEGMENT_CACHE_DIR, bucket, key)
+    if os.path.isfile(path):
+        os.utime(path, None)
+        _bump("cache_hits")
+        return path, "cache"
+    return None
+
+
+def object_size(bucket: str, key: str) -> int:
+    """物件大小（HEAD）；物件不存在時拋出 MinIO 的例外。"""
+    return int(get_minio_client().stat_object(bucket, key).size)
+
+
+def presigned_object_url(bucket: str, key: str, expires: int = PRESIGN_EXPIRES) -> str:
+    return get_minio_client().presigned_get_object(bucket, key, expires=timedelta(seconds=expires))
+
+
+def fetch_object(bucket: str, key: str, fallback_dir: Optional[str] = None) -> Tuple[str, str]:
+    """
+    取得物件的本機路徑。
+
+    Args:
+        fallback_dir: 本機快取停用（SEGMENT_CACHE_MAX_MB=0）時，改下載到這個（任務自己的暫存）目錄
+    Returns:
+        (path, source)；source 為 "shared" | "cache" | "fetched" | "download"
+    Raises:
+        物件不存在或下載失敗時拋出 MinIO 的例外
+    """
+    shared = _shared_path(bucket, key)
+    if shared:
+        _bump("shared_hits")
+        return shared, "shared"
+
+    if SEGMENT_CACHE_MAX_MB <= 0:
+        if not fallback_dir:
+            raise RuntimeError("本機快取已停用（SEGMENT_CACHE_MAX_MB=0）")
+        path = os.path.join(fallback_dir, f"source_{os.getpid()}_{threading.get_ident()}{os.path.splitext(key)[1]}")
+        get_minio_client().fget_object(bucket, key, path)
+        _bump("fetches")
+        _bump("bytes_fetched", os.path.getsize(path))
+        return path, "download"
+
+    path = _safe_join(SEGMENT_CACHE_DIR, bucket, key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if os.path.isfile(path):
+        os.utime(path, None)
+        _bump("cache_hits")
+        return path, "cache"
+
+    with open(_lock_path(bucket, key), "a+") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            # 等鎖期間可能已經有別的行程下載好了
+            if os.path.isfile(path):
+                os.utime(path, None)
+                _bump("cache_hits")
+                return path, "cache"
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+            try:
+                get_minio_client().fget_object(bucket, key, tmp_path)
+                os.replace(tmp_path, path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            _bump("fetches")
+            _bump("bytes_fetched", os.path.getsize(path))
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+    _evict(keep=path)
+    return path, "fetched"
+
+
+def resolve_local_path(url: str) -> Optional[Tuple[str, str]]:
+    """
+    s3:// → (本機路徑, source)；本機檔案路徑 → (原路徑, "local")；其他（http 等）回 None。
+    """
+    s3 = parse_s3_url(url)
+    if s3 is not None:
+        return fetch_object(*s3)
+    if isinstance(url, str) and "://" not in url and os.path.isfile(url):
+        return url, "local"
+    return None
@@ -25,6 +25,8 @@ app.conf.update(
     task_always_eager=_bool("CELERY_TASK_ALWAYS_EAGER", False),
     task_acks_late=_bool("CELERY_ACKS_LATE", True),
     worker_prefetch_multiplier=int(os.getenv("CELERY_PREFETCH_MULTIPLIER", "1")),
+    # worker 只訂閱 -Q default；worker 內部送出的任務（重試等）也要進同一個 queue
+    task_default_queue=os.getenv("CELERY_DEFAULT_QUEUE", "default"),
     broker_transport_options={
         "visibility_timeout": int(os.getenv("CELERY_VISIBILITY_TIMEOUT", "300"))
     },
@@ -37,22 +39,71 @@ app.conf.update(
 app.autodiscover_tasks(packages=["app"], related_name="tasks")
 
 # Celery Worker 啟動時預載入模型
-from celery.signals import worker_ready
+from celery.signals import worker_init, worker_ready, worker_process_init, worker_process_shutdown
+
+@worker_init.connect
+def on_worker_init(**kwargs):
+    """
+    主行程啟動、子行程 fork 前：清掉上一次執行留下的子行程 metrics 檔案
+    """
+    try:
+        from app.libs.metrics import reset_shared_metrics
+        reset_shared_metrics()
+    except Exception as e:
+        print(f"[Worker] ⚠️ 清理 metrics 目錄失敗: {e}")
+
 
 @worker_ready.connect
 def on_worker_ready(**kwargs):
     """
-    Worker 啟動時預載入模型
-    類似 BLIP 的啟動控管,確保模型在 Worker 啟動時就載入
+    Worker 啟動完成
+    模型不在主行程預載：prefork 的子行程在這之前就已 fork，主行程載入的模型只會佔記憶體，
+    而且閒置超過 MODEL_IDLE_TTL 就被卸載；改由子行程在 worker_process_init 視設定預載。
+    /metrics 開在主行程（METRICS_HTTP_PORT > 0 才會啟動），彙總所有子行程（含已回收的）的數字。
+    """
+    try:
+        from app.libs.metrics import start_metrics_server
+        start_metrics_server()
+    except Exception as e:
+        print(f"[Worker] ⚠️ /metrics 啟動失敗: {e}")
+    print("[Worker] 🎯 Celery Worker 已啟動，Worker 準備就緒!")
+
+
+@worker_process_init.connect
+def on_worker_process_init(**kwargs):
+    """
+    執行任務的子行程啟動時，把 stage metrics 寫到共用目錄給主行程的 /metrics 彙總；
+    MODEL_IDLE_TTL <= 0（模型常駐）時順便預載 RAG Embedding 模型，否則用到時才載入
     """
-    print("[Worker] 🚀 Celery Worker 已啟動,開始預載入模型...")
-    
-    # 預載入 RAG Embedding 模型
     try:
-        from app.libs.RAG import RAGModel
-        rag = RAGModel.get_instance()
-        print(f"[Worker] ✅ RAG Embedding 模型預載入完成")
+        from app.libs.metrics import enable_shared_metrics
+        enable_shared_metrics()
+    except Exception as e:
+        print(f"[Worker] ⚠️ 共用 metrics 啟用失敗: {e}")
+
+    try:
+        from app.libs.model_registry import MODEL_IDLE_TTL
+        if MODEL_IDLE_TTL <= 0:
+            from app.libs.RAG import RAGModel
+            RAGModel.get_instance()
+            print("[Worker] ✅ RAG Embedding 模型預載入完成")
     except Exception as e:
         print(f"[Worker] ⚠️ RAG 模型預載入失敗: {e}")
-    
-    print("[Worker] 🎯 所有模型預載入完成,Worker 準備就緒!")
\ No newline at end of file
+
+
+@worker_process_shutdown.connect
+def on_worker_process_shutdown(**kwargs):
+    """
+    Worker 子行程結束前，等背景後段（VIDEO_TAIL_ASYNC 的 LLM / 回呼）跑完，避免結果遺失；
+    之後把這個子行程的 metrics 併進 archive，換新的子行程後計數不會歸零
+    """
+    try:
+        from app.libs.stage_executor import drain_all
+        drain_all(timeout=float(os.getenv("VIDEO_TAIL_DRAIN_TIMEOUT", "120")))
+    except Exception as e:
+        print(f"[Worker] ⚠️ 背景階段收尾失敗: {e}")
+    try:
+        from app.libs.metrics import archive_shared_metrics
+        archive_shared_metrics()
+    except Exception as e:
+        print(f"[Worker] ⚠️ metrics 合併失敗: {e}")
@@ -105,11 +105,8 @@ def generate_embeddings_for_recording(self, recording_id: str, job_id: str | Non
         _update_inference_job(job_id, status="processing", progress=1.0, params_patch={"recording_id": recording_id})
     
     try:
-        # 獲取 RAG 模型實例 (單例)
-        rag = RAGModel.get_instance()
-        
-        # 查詢該錄影的所有事件
-        with Session(engine) as session:
+        # 查詢該錄影的所有事件（RAG 模型在整個批次期間釘住，不會被閒置回收卸載）
+        with RAGModel.use() as rag, Session(engine) as session:
             result = session.execute(
                 text("""
                     SELECT id, summary
@@ -232,11 +229,9 @@ def generate_embedding_for_event(self, event_id: str, summary: str, job_id: str
         _update_inference_job(job_id, status="processing", progress=10.0, params_patch={"event_id": event_id})
     
     try:
-        # 獲取 RAG 模型實例
-        rag = RAGModel.get_instance()
-        
         # 生成 embedding
-        embedding = rag.encode([f"passage: {summary}"])[0]
+        with RAGModel.use() as rag:
+            embedding = rag.encode([f"passage: {summary}"])[0]
         embedding_list = embedding.tolist()
         
         # 更新到資料庫
@@ -285,10 +280,9 @@ def generate_diary_embeddings(self, diary_id: str, chunks: List[str], job_id: st
                 _update_inference_job(job_id, status="failed", progress=100.0, error_message="missing diary_id or chunks")
             raise ValueError("missing diary_id or chunks")
 
-        rag = RAGModel.get_instance()
         total = len(chunks)
 
-        with Session(engine) as session:
+        with RAGModel.use() as rag, Session(engine) as session:
             # 清除舊 chunks（重新生成）
             session.execute(
                 text("DELETE FROM diary_chunks WHERE diary_id = :did"),
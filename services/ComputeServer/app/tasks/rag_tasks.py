@@ -59,12 +59,12 @@ def _update_inference_job(job_id: str, *, status: str, progress: float | None =
 
 @app.task(name="tasks.calculate_embedding", bind=True)
 def calculate_embedding(self, text: str, is_query: bool = False, job_id: str | None = None) -> list[float]:
-    rag = RAGModel.get_instance()
     if job_id:
         _update_inference_job(job_id, status="processing", progress=10.0)
     prefix = "query: " if is_query else "passage: "
     # encode returns list of embeddings, we take the first one
-    embedding = rag.encode([f"{prefix}{text}"])[0]
+    with RAGModel.use() as rag:
+        embedding = rag.encode([f"{prefix}{text}"])[0]
     if job_id:
         _update_inference_job(job_id, status="success", progress=100.0)
     return embedding.tolist()
@@ -89,8 +89,6 @@ def suggest_vlog_highlights(self, query: str, candidates: list[dict], limit: int
             _update_inference_job(job_id, status="success", progress=100.0, metrics_patch={"result_count": 0})
         return []
 
-    rag = RAGModel.get_instance()
-    
     # 準備資料
     chunks = [c['text'] for c in candidates]
     ids = [c['id'] for c in candidates]
@@ -110,27 +108,29 @@ def suggest_vlog_highlights(self, query: str, candidates: list[dict], limit: int
     print(f"[RAG] BM25 前5名ID: {bm25_ranked_ids[:5]}")
     
     # 向量搜尋
-    # 準備 Embeddings
-    cand_embeddings = []
-    missing_emb_count = 0
-    for c in candidates:
-        if c.get('embedding') and c['embedding']:
-            # Ensure embedding is list/array
-            cand_embeddings.append(c['embedding'])
-        else:
-            # Calculate on the fly if missing
-            missing_emb_count += 1
-            emb = rag.encode([f"passage: {c['text']}"])[0]
-            cand_embeddings.append(emb)
-    
-    print(f"[RAG] 需要即時計算的 embedding 數量: {missing_emb_count}/{len(candidates)}")
+    # 區塊內 RAG 模型不會被閒置回收卸載
+    with RAGModel.use() as rag:
+        # 準備 Embeddings
+        cand_embeddings = []
+        missing_emb_count = 0
+        for c in candidates:
+            if c.get('embedding') and c['embedding']:
+                # Ensure embedding is list/array
+                cand_embeddings.append(c['embedding'])
+            else:
+                # Calculate on the fly if missing
+                missing_emb_count += 1
+                emb = rag.encode([f"passage: {c['text']}"])[0]
+                cand_embeddings.append(emb)
+    
+        print(f"[RAG] 需要即時計算的 embedding 數量: {missing_emb_count}/{len(candidates)}")
             
-    # Prepare Query Embedding
-    query_embedding = rag.encode([f"query: {query}"])[0]
+        # Prepare Query Embedding
+        query_embedding = rag.encode([f"query: {query}"])[0]
     
-    # Similarity
-    # similarity returns a matrix (1, N) if query is 1.
-    sim_scores = rag.similarity([query_embedding], cand_embeddings)[0]
+        # Similarity
+        # similarity returns a matrix (1, N) if query is 1.
+        sim_scores = rag.similarity([query_embedding], cand_embeddings)[0]
     
     # Rank Vector
     # sim_scores is tensor/array.
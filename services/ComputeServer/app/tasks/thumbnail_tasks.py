@@ -64,37 +64,12 @@ def _generate_thumbnail_from_url(video_url: str, thumbnail_path: str) -> bool:
         是否成功生成
     """
     try:
-        # 若是 s3://，優先用 MinIO 內網直接下載到本地再取幀（避免 presigned API/權限問題）
-        local_video_path = None
+        # 若是 s3://，走共用的儲存解析層（共享磁碟 / 節點快取 / MinIO 整檔下載），避免 presigned API/權限問題
         if video_url.startswith("s3://"):
             try:
-                from minio import Minio
-                from urllib.parse import urlparse
-                # s3://bucket/key
-                parsed = urlparse(video_url)
-                bucket = (parsed.netloc or "").strip()
-                key = (parsed.path or "").lstrip("/")
-                if not bucket or not key:
-                    raise ValueError(f"invalid s3 url: {video_url}")
-
-                client = Minio(
-                    MINIO_ENDPOINT,
-                    access_key=MINIO_ACCESS_KEY,
-                    secret_key=MINIO_SECRET_KEY,
-                    secure=MINIO_SECURE,
-                )
-
-                local_video_path = os.path.join(os.path.dirname(thumbnail_path), "source.mp4")
-                resp = client.get_object(bucket, key)
-                try:
-                    with open(local_video_path, "wb") as f:
-                        for d in resp.stream(1024 * 1024):
-                            f.write(d)
-                finally:
-                    resp.close()
-                    resp.release_conn()
-
-                video_url = local_video_path
+                from ..libs.storage import fetch_object, parse_s3_url
+                video_url, source = fetch_object(*parse_s3_url(video_url), fallback_dir=os.path.dirname(thumbnail_path))
+                logger.debug(f"縮圖來源: {video_url} ({source})")
             except Exception as e:
                 logger.error(f"從 MinIO 下載影片失敗: {e}", exc_info=True)
                 return False
@@ -3,11 +3,12 @@ from ..DTO import *
 import cv2
 import numpy as np
 import gc
-from typing import List, Dict, Any, Optional, Tuple, Literal
+from typing import List, Dict, Any, Optional, Tuple, Literal, Iterable, Iterator
 from PIL import Image
 import torch
 import math
 import json
+import copy
 from datetime import datetime, timedelta
 from pathlib import Path
 import time
@@ -16,6 +17,11 @@ import requests
 import dotenv
 import os
 import re
+import subprocess
+import tempfile
+import functools
+import difflib
+import base64
 import boto3
 from botocore.config import Config
 from urllib.parse import quote
@@ -24,6 +30,19 @@ from pydantic import BaseModel, Field
 import torch
 from transformers import AutoModelForCausalLM
 
+from ..libs.frame_batch import FrameBatch, SKIPPED_CAPTION, FRAME_CANDIDATE_CODEC, FRAME_ANALYSIS_THUMB_WIDTH
+from ..libs.frame_analysis import (
+    stack_gray, resize_stack, laplacian_variance_batch, frame_difference_batch,
+    foreground_ratios_mog2, detect_people_hog,
+)
+from ..libs.caption_cache import CameraCaptionCache, dhash, CAPTION_CACHE_RADIUS
+from ..libs.model_registry import get_registry
+from ..libs.stage_executor import get_stage_executor
+from ..libs.job_checkpoint import JobCheckpoint
+from ..libs.llm_cache import make_cache_key, get_cached_response, put_cached_response
+from ..libs.storage import resolve_local_path, storage_stats
+from ..libs.metrics import StageRecorder, stage, record_stage, recording, current_recorder, push_metrics
+
 
 dotenv.load_dotenv()
 
@@ -46,7 +65,9 @@ def _dbg(msg: str):
     if DEBUG:
         print(f"[DEBUG] {msg}")
 
-def _frames_dicts_summary(frames_dicts: List[Dict[str, Any]]) -> str:
+def _frames_dicts_summary(frames_dicts) -> str:
+    if isinstance(frames_dicts, FrameBatch):
+        return frames_dicts.summary()
     total = len(frames_dicts)
     blurry = sum(1 for f in frames_dicts if not f.get("is_not_blurry", False))
     significant = sum(1 for f in frames_dicts if f.get("is_significant", False))
@@ -97,10 +118,35 @@ def ensure_http_video_url(url: str) -> str:
     若是 s3:// 就轉 presigned http(s)；否則原樣回傳。
     """
     if isinstance(url, str) and url.startswith("s3://"):
-        return _s3_to_presigned_http(url)
+        with stage("presign", items=1):
+            return _s3_to_presigned_http(url)
     return url
 
 
+SEGMENT_LOCAL_FASTPATH = os.getenv("SEGMENT_LOCAL_FASTPATH", "1").lower() in ("1", "true", "yes", "on")
+
+
+def resolve_video_source(url: str, video_info: Optional[Dict[str, Any]] = None) -> str:
+    """
+    解碼來源：優先用本機檔（共享磁碟 / 節點快取，見 libs.storage），
+    拿不到時才退回 presigned HTTP 串流。video_info 會記錄 input_source。
+    """
+    if video_info is None:
+        video_info = {}
+    if SEGMENT_LOCAL_FASTPATH:
+        try:
+            with stage("fetch"):
+                resolved = resolve_local_path(url)
+            if resolved is not None:
+                path, source = resolved
+                video_info["input_source"] = source
+                return path
+        except Exception as e:
+            _dbg(f"resolve_video_source(): 本機路徑不可用，改用 presigned URL: {e}")
+    video_info["input_source"] = "presigned" if isinstance(url, str) and url.startswith("s3://") else "url"
+    return ensure_http_video_url(url)
+
+
 def _generate_video_thumbnail(video_url: str, thumbnail_path: str) -> bool:
     """
     從視頻第一幀生成縮圖
@@ -256,23 +302,8 @@ def _upload_thumbnail_bytes_to_s3(jpeg_bytes: bytes, object_key: str) -> bool:
         _dbg(f"上傳縮圖 bytes 到 S3 失敗: {e}")
         return False
 
-def _update_recording_thumbnail_via_api(recording_id: str, thumbnail_s3_key: str) -> bool:
-    """透過 API Server 回寫 recordings.thumbnail_s3_key。"""
-    try:
-        if not recording_id or not thumbnail_s3_key:
-            return False
-        resp = requests.patch(
-            f"{API_SERVER_URL}/m2m/recordings/{recording_id}/thumbnail",
-            params={"thumbnail_s3_key": thumbnail_s3_key},
-            headers=headers,
-            timeout=10,
-        )
-        resp.raise_for_status()
-        _dbg(f"錄影縮圖路徑已更新: recording_id={recording_id} -> {thumbnail_s3_key}")
-        return True
-    except Exception as e:
-        _dbg(f"更新錄影縮圖路徑失敗: {e}")
-        return False
+# 模糊度 / 幀差以小批次計算：批次越大吞吐越好，但同時留在記憶體的幀越多
+BLUR_BATCH_SIZE = int(os.getenv("BLUR_BATCH_SIZE", "16"))
 
 # SSIM 需用 skimage；只有在 module="SSIM" 時才會用到
 try:
@@ -283,10 +314,13 @@ except Exception:
 
 # 計時裝飾器
 def timer(func):
-    
+    """印出耗時，並把 wall / CPU / peak RSS 增量記進目前 job 的 StageRecorder（以函式名稱為階段名）。"""
+
+    @functools.wraps(func)
     def wrapper(*args, **kwargs):
         start_time = time.time()
-        result = func(*args, **kwargs)
+        with stage(func.__name__):
+            result = func(*args, **kwargs)
         end_time = time.time()
         _dbg(f"Function {func.__name__} took {end_time - start_time:.2f} seconds")
         return result
@@ -367,123 +401,386 @@ def get_video_frames(video_url: str, target_fps: int = 3):
         "frames": frames_dicts
     }
 
-@timer
-def get_video_frames_fast(video_url: str, target_fps: int = 3):
+def iter_video_frames(video_url: str, target_fps: int = 3, video_info: Optional[Dict[str, Any]] = None):
     """
-    GPT改我程式的加速版
+    逐幀產生抽樣後的幀（generator），不把整段影片留在記憶體。
+    yield {"stamp": 秒數, "frame": np.ndarray(BGR)}；
+    video_info 若有傳入，會就地填入 fps / duration / extracted_frames 等資訊（迭代結束後才完整）。
     """
-    _dbg(f"get_video_frames_fast() called with video_url={video_url}, target_fps={target_fps}")
-    video_url = ensure_http_video_url(video_url)
+    _dbg(f"iter_video_frames() called with video_url={video_url}, target_fps={target_fps}")
+    if video_info is None:
+        video_info = {}
+    video_url = resolve_video_source(video_url, video_info)
     if target_fps <= 0:
         raise ValueError("target_fps 必須是正數，且大於0")
 
-    cap = cv2.VideoCapture(video_url, cv2.CAP_FFMPEG)
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    if fps <= 0 or total_frames <= 0:
+    with stage("open"):
+        cap = cv2.VideoCapture(video_url, cv2.CAP_FFMPEG)
+    kept = 0
+    decode_seconds = 0.0
+    decode_cpu = 0.0
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        if fps <= 0 or total_frames <= 0:
+            raise ValueError(f"影片檔案無法正確讀取或總幀為0, target_fps: {target_fps}, video_original_fps: {fps}, total_frames: {total_frames}")
+
+        # 以「幀」為單位計算抽樣步長（避免時間制導致重解碼）
+        step = max(1, int(round(fps / target_fps)))  # 每抓一張要跳過幾幀
+        video_info.update({
+            "video_url": video_url,
+            "fps": fps,
+            "duration": total_frames / fps,
+            "total_frames": total_frames,
+            "target_frame": target_fps,
+            "possible_extracts": math.floor(total_frames / step),
+            "extracted_frames": 0,
+            "effective_fps": fps / step,  # 實際抽到的 fps（可能略低於 target_fps）
+            "frame_source": "opencv",
+            "width": int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            "height": int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+        })
+
+        idx = 0
+        # 只順序讀取，不做 set/seek
+        while True:
+            t0, c0 = time.perf_counter(), time.process_time()
+            ret, frame = cap.read()
+            decode_seconds += time.perf_counter() - t0
+            decode_cpu += time.process_time() - c0
+            if not ret:
+                break
+            # 只保留需要的幀（以 idx 做取樣）
+            if idx % step == 0:
+                kept += 1
+                video_info["extracted_frames"] = kept
+                _update_decode_stats(video_info, decode_seconds, idx + 1, kept)
+                # 用幀索引推算時間戳（以秒）
+                yield {"stamp": idx / fps, "frame": frame}
+            idx += 1
+        _update_decode_stats(video_info, decode_seconds, idx, kept)
+    finally:
+        # 釋放 VideoCapture 相關資源（generator 提前關閉時也會走到這裡）
         cap.release()
-        raise ValueError(f"影片檔案無法正確讀取或總幀為0, target_fps: {target_fps}, video_original_fps: {fps}, total_frames: {total_frames}")
+        del cap
+        record_stage("decode", decode_seconds, decode_cpu, 0, kept)
+
+
+def iter_video_frames_adaptive(video_url: str,
+                               target_fps: int = 3,
+                               video_info: Optional[Dict[str, Any]] = None,
+                               min_fps: float = 0.5,
+                               motion_threshold: float = 4.0):
+    """
+    依畫面動態調整抽樣率的 generator（介面同 iter_video_frames）。
 
-    # 以「幀」為單位計算抽樣步長（避免時間制導致重解碼）
-    step = max(1, int(round(fps / target_fps)))  # 每抓一張要跳過幾幀
-    effective_fps = fps / step  # 實際抽到的 fps（可能略低於 target_fps）
+    - 每張抽到的幀縮成 64 寬灰階，和上一張抽樣幀算平均絕對差（便宜的動態指標）
+    - 動態 >= motion_threshold：立即回到 target_fps（上限）
+    - 動態持續偏低：每次把抽樣率減半，最低到 min_fps（下限）
+    - 沒抽到的幀只 grab()（不 retrieve / 不轉色彩），抽到才 retrieve()
 
-    frames = []
+    stamp 仍以「原始幀索引 / 原始 fps」計算，所以下游 frames_summary 的 stamp 與
+    _idx_to_time_from_summary 的 index→秒數映射不受抽樣率變化影響。
+    video_info["sampling_timeline"] 記錄抽樣率的變化：[{"stamp": 秒, "fps": 抽樣率, "motion": 指標}, ...]
+    """
+    _dbg(f"iter_video_frames_adaptive() called with video_url={video_url}, target_fps={target_fps}, "
+         f"min_fps={min_fps}, motion_threshold={motion_threshold}")
+    if video_info is None:
+        video_info = {}
+    video_url = resolve_video_source(video_url, video_info)
+    if target_fps <= 0:
+        raise ValueError("target_fps 必須是正數，且大於0")
+    max_fps = float(target_fps)
+    min_fps = max(1e-3, min(float(min_fps), max_fps))
+
+    with stage("open"):
+        cap = cv2.VideoCapture(video_url, cv2.CAP_FFMPEG)
     kept = 0
-    idx = 0
+    decode_seconds = 0.0
+    decode_cpu = 0.0
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        if fps <= 0 or total_frames <= 0:
+            raise ValueError(f"影片檔案無法正確讀取或總幀為0, target_fps: {target_fps}, video_original_fps: {fps}, total_frames: {total_frames}")
+
+        rate = max_fps
+        timeline: List[Dict[str, Any]] = [{"stamp": 0.0, "fps": rate, "motion": None}]
+        video_info.update({
+            "video_url": video_url,
+            "fps": fps,
+            "duration": total_frames / fps,
+            "total_frames": total_frames,
+            "target_frame": target_fps,
+            "possible_extracts": math.floor(total_frames / max(1, int(round(fps / max_fps)))),
+            "extracted_frames": 0,
+            "effective_fps": None,
+            "frame_source": "adaptive",
+            "width": int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            "height": int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            "sampling_min_fps": min_fps,
+            "sampling_motion_threshold": motion_threshold,
+            "sampling_timeline": timeline,
+        })
 
-    # 只順序讀取，不做 set/seek
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
+        idx = 0
+        next_idx = 0
+        prev_small = None
+        while True:
+            t0, c0 = time.perf_counter(), time.process_time()
+            ok = cap.grab()
+            frame = None
+            if ok and idx >= next_idx:
+                ok, frame = cap.retrieve()
+            decode_seconds += time.perf_counter() - t0
+            decode_cpu += time.process_time() - c0
+            if not ok:
+                break
+            if frame is None:
+                idx += 1
+                continue
+
+            stamp = idx / fps
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            small = cv2.resize(gray, (64, max(1, int(round(64 * gray.shape[0] / gray.shape[1])))),
+                               interpolation=cv2.INTER_AREA)
+            if prev_small is not None:
+                motion = float(cv2.absdiff(small, prev_small).mean())
+                new_rate = max_fps if motion >= motion_threshold else max(min_fps, rate / 2.0)
+                if new_rate != rate:
+                    rate = new_rate
+                    timeline.append({"stamp": stamp, "fps": rate, "motion": motion})
+            prev_small = small
 
-        # 只保留需要的幀（以 idx 做取樣）
-        if idx % step == 0:
-            # 用幀索引推算時間戳（以秒）
-            ts = idx / fps
-            frames.append({"stamp": ts, "frame": frame})
             kept += 1
+            video_info["extracted_frames"] = kept
+            _update_decode_stats(video_info, decode_seconds, idx + 1, kept)
+            next_idx = idx + max(1, int(round(fps / rate)))
+            yield {"stamp": stamp, "frame": frame}
+            idx += 1
+        _update_decode_stats(video_info, decode_seconds, idx, kept)
+        duration = total_frames / fps
+        video_info["effective_fps"] = (kept / duration) if duration > 0 else None
+    finally:
+        cap.release()
+        del cap
+        record_stage("decode", decode_seconds, decode_cpu, 0, kept)
 
-        idx += 1
 
-    duration_sec = total_frames / fps
-    cap.release()
-    
-    # 釋放 VideoCapture 相關資源
-    del cap
-    gc.collect()
+def _update_decode_stats(video_info: Dict[str, Any], decode_seconds: float, source_frames: int, output_frames: int):
+    """記錄解碼耗時與速度（只計算等待解碼器的時間，不含下游分析）。"""
+    video_info["frame_source_decode_seconds"] = decode_seconds
+    video_info["frame_source_decode_fps"] = (source_frames / decode_seconds) if decode_seconds > 0 else None
+    video_info["frame_source_output_fps"] = (output_frames / decode_seconds) if decode_seconds > 0 else None
 
-    video_info = {
+
+def _probe_video_stream(video_url: str) -> Dict[str, Any]:
+    """用 ffprobe 讀取第一條視訊串流的寬高、fps、幀數與長度。"""
+    cmd = [
+        "ffprobe", "-v", "error",
+        "-select_streams", "v:0",
+        "-show_entries", "stream=width,height,avg_frame_rate,r_frame_rate,nb_frames,duration:format=duration",
+        "-of", "json",
+        video_url,
+    ]
+    result = subprocess.run(cmd, capture_output=True, text=True, timeout=60)
+    if result.returncode != 0:
+        raise ValueError(f"ffprobe 無法讀取影片: {result.stderr.strip()[:500]}")
+    info = json.loads(result.stdout or "{}")
+    streams = info.get("streams") or []
+    if not streams:
+        raise ValueError("ffprobe 找不到視訊串流")
+    stream = streams[0]
+
+    def _rate(v: Optional[str]) -> float:
+        try:
+            num, den = str(v).split("/")
+            return float(num) / float(den) if float(den) else 0.0
+        except Exception:
+            return 0.0
+
+    fps = _rate(stream.get("avg_frame_rate")) or _rate(stream.get("r_frame_rate"))
+    try:
+        duration = float(stream.get("duration") or (info.get("format") or {}).get("duration") or 0.0)
+    except Exception:
+        duration = 0.0
+    try:
+        total_frames = int(stream.get("nb_frames") or 0)
+    except Exception:
+        total_frames = 0
+    if total_frames <= 0 and fps > 0 and duration > 0:
+        total_frames = int(round(duration * fps))
+    return {
+        "width": int(stream.get("width") or 0),
+        "height": int(stream.get("height") or 0),
+        "fps": fps,
+        "duration": duration,
+        "total_frames": total_frames,
+    }
+
+
+def iter_video_frames_ffmpeg(video_url: str,
+                             target_fps: int = 3,
+                             video_info: Optional[Dict[str, Any]] = None,
+                             analysis_width: int = 0,
+                             buffer_count: int = 2):
+    """
+    以 ffmpeg rawvideo pipe 取幀的 generator（介面同 iter_video_frames）。
+    由 ffmpeg 的 fps filter 直接抽樣、scale filter 直接縮到分析用尺寸，
+    只有抽到的幀才做色彩轉換，Python 端讀進預先配置好的 NumPy 緩衝區。
+
+    注意：yield 出來的 frame 是重複使用的緩衝區 view（flags.owndata=False），
+    需要跨迭代保留時請自行 copy()。
+    像素格式維持 BGR，下游 OpenCV 分析與 captioner 的轉換流程不變。
+    """
+    _dbg(f"iter_video_frames_ffmpeg() called with video_url={video_url}, target_fps={target_fps}, analysis_width={analysis_width}")
+    if video_info is None:
+        video_info = {}
+    video_url = resolve_video_source(video_url, video_info)
+    if target_fps <= 0:
+        raise ValueError("target_fps 必須是正數，且大於0")
+
+    with stage("open"):
+        probe = _probe_video_stream(video_url)
+    fps, total_frames = probe["fps"], probe["total_frames"]
+    src_w, src_h = probe["width"], probe["height"]
+    if fps <= 0 or total_frames <= 0 or src_w <= 0 or src_h <= 0:
+        raise ValueError(f"影片檔案無法正確讀取或總幀為0, target_fps: {target_fps}, video_original_fps: {fps}, total_frames: {total_frames}")
+
+    # 輸出尺寸：寬度縮到 analysis_width（不放大），高度等比並取偶數
+    out_w, out_h = src_w, src_h
+    if analysis_width and 0 < int(analysis_width) < src_w:
+        out_w = int(analysis_width) // 2 * 2
+        out_h = max(2, int(round(src_h * out_w / src_w / 2)) * 2)
+    duration = probe["duration"] or (total_frames / fps)
+    video_info.update({
         "video_url": video_url,
         "fps": fps,
-        "duration": duration_sec,
+        "duration": duration,
         "total_frames": total_frames,
         "target_frame": target_fps,
-        "possible_extracts": math.floor(total_frames / step),
-        "extracted_frames": kept,
-        "effective_fps": effective_fps
-    }
+        "possible_extracts": math.floor(duration * target_fps),
+        "extracted_frames": 0,
+        "effective_fps": float(target_fps),
+        "frame_source": "ffmpeg",
+        "width": src_w,
+        "height": src_h,
+        "analysis_size": [out_w, out_h],
+    })
+
+    cmd = [
+        "ffmpeg", "-nostdin", "-v", "error",
+        "-i", video_url,
+        "-an", "-sn",
+        "-vf", f"fps={target_fps},scale={out_w}:{out_h}:flags=area",
+        "-f", "rawvideo", "-pix_fmt", "bgr24",
+        "pipe:1",
+    ]
+    frame_bytes = out_w * out_h * 3
+    buffers = [np.empty((out_h, out_w, 3), dtype=np.uint8) for _ in range(max(1, int(buffer_count)))]
+    stderr_file = tempfile.TemporaryFile()
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr_file, bufsize=frame_bytes)
+    kept = 0
+    decode_seconds = 0.0
+    decode_cpu = 0.0
+    try:
+        while True:
+            buf = buffers[kept % len(buffers)]
+            view = memoryview(buf).cast("B")
+            got = 0
+            t0, c0 = time.perf_counter(), time.process_time()
+            while got < frame_bytes:
+                n = proc.stdout.readinto(view[got:])
+                if not n:
+                    break
+                got += n
+            decode_seconds += time.perf_counter() - t0
+            decode_cpu += time.process_time() - c0
+            if got < frame_bytes:
+                break  # EOF（最後不完整的幀直接丟棄）
+
+            stamp = kept / float(target_fps)
+            kept += 1
+            video_info["extracted_frames"] = kept
+            _update_decode_stats(video_info, decode_seconds, int(round(stamp * fps)) + 1, kept)
+            yield {"stamp": stamp, "frame": buf.view()}
+
+        returncode = proc.wait()
+        _update_decode_stats(video_info, decode_seconds, total_frames, kept)
+        if returncode != 0 and kept == 0:
+            stderr_file.seek(0)
+            err = stderr_file.read().decode(errors="ignore").strip()
+            raise RuntimeError(f"ffmpeg 解碼失敗 (code={returncode}): {err[:500]}")
+    finally:
+        # generator 提前關閉或出錯時，確保 ffmpeg 子行程被收掉
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+        if proc.stdout is not None:
+            proc.stdout.close()
+        stderr_file.close()
+        # 解碼在 ffmpeg 子行程內，這裡的 CPU time 只含 Python 端讀 pipe 的部分
+        record_stage("decode", decode_seconds, decode_cpu, 0, kept)
+
+
+_FRAME_SOURCES = {
+    "opencv": iter_video_frames,
+    "ffmpeg": iter_video_frames_ffmpeg,
+    "adaptive": iter_video_frames_adaptive,
+}
+
+
+@timer
+def get_video_frames_fast(video_url: str, target_fps: int = 3):
+    """
+    GPT改我程式的加速版
+    （保留整批回傳的介面；主流程改用 iter_video_frames + select_frames_streaming）
+    frames 為 FrameBatch，所有抽到的幀都放進同一塊連續影像緩衝區。
+    """
+    _dbg(f"get_video_frames_fast() called with video_url={video_url}, target_fps={target_fps}")
+    video_info: Dict[str, Any] = {}
+    frames = FrameBatch()
+    for item in iter_video_frames(video_url, target_fps, video_info=video_info):
+        frames.set_image(frames.append(item["stamp"]), item["frame"])
+    gc.collect()
     return {"video_info": video_info, "frames": frames}
+
+
 @timer
 def analyze_blur(
-    frames_dicts: List[Dict[str, Any]],
-    threshold: float = 20.0
-) -> List[Dict[str, Any]]:
+    frames_dicts,
+    threshold: float = 20.0,
+    scale: float = 1.0
+) -> FrameBatch:
     """
-    針對 frames_dict（[{ 'stamp': float, 'frame': np.ndarray(BGR) }, ...]）計算清晰度。
+    針對 FrameBatch（或舊格式 [{ 'stamp': float, 'frame': np.ndarray(BGR) }, ...]）計算清晰度。
     使用 Laplacian 變異數作為指標，低於 threshold 視為模糊。
+    以批次方式計算（libs.frame_analysis.laplacian_variance_batch，float32 + thread pool）；
+    scale < 1 時先縮小灰階再算（門檻需依解析度調整）。
 
-    回傳：list[dict]，每個元素結構為
-        {
-            "stamp": <float>,
-            "frame": <np.ndarray (BGR)>,
-            "variance": <float>,          # Laplacian 變異數
-            "is_not_blurry": <bool>           # 變異數 < 門檻 -> False
-        }
+    就地填入 variance / is_not_blurry 欄位並回傳同一個 FrameBatch；
+    沒有影像的幀維持 variance=NaN、is_not_blurry=False，讓後續容易過濾掉。
     """
-    _dbg(f"analyze_blur() call: {_frames_dicts_summary(frames_dicts)}，threshold={threshold}")
-    analyzed = []
-
-    for item in frames_dicts:
-        # 預設值＆基本檢查
-        stamp = None
-        frame = None
-        variance = np.nan
-        is_blurry = True  # 無效資料一律視為模糊，讓後續容易過濾掉
-
-        if isinstance(item, dict):
-            stamp = float(item.get("stamp")) if item.get("stamp") is not None else None
-            frame = item.get("frame")
-
-        if frame is not None and hasattr(frame, "shape"):
-            # gray + Laplacian
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
-            lap = cv2.Laplacian(gray, cv2.CV_64F)
-            variance = float(lap.var())
-            is_blurry = variance <= threshold # 小於門檻視為模糊
-
-        analyzed.append({
-            "stamp": stamp,
-            "frame": frame,
-            "variance": variance,
-            "is_not_blurry": not is_blurry # 這裡的 is_not_blurry 反轉了邏輯，True 表示清晰
-        })
-        
-        # 每處理 10 個幀後進行一次垃圾回收（避免記憶體累積）
-        if len(analyzed) % 10 == 0:
-            gc.collect()
+    _dbg(f"analyze_blur() call: {_frames_dicts_summary(frames_dicts)}，threshold={threshold}, scale={scale}")
+    batch = frames_dicts if isinstance(frames_dicts, FrameBatch) else FrameBatch.from_dicts(frames_dicts)
 
-    # 處理完成後進行垃圾回收
-    gc.collect()
-    return analyzed
+    # 分段批次計算（避免一次把整段影片的灰階都疊起來）
+    rows = np.flatnonzero(batch.has_image())
+    for start in range(0, len(rows), BLUR_BATCH_SIZE):
+        chunk = rows[start:start + BLUR_BATCH_SIZE]
+        variances = laplacian_variance_batch(stack_gray(batch.images(chunk), scale))
+        batch.variance[chunk] = variances
+        batch.is_not_blurry[chunk] = ~(np.asarray(variances) <= threshold)  # 小於門檻視為模糊
+
+    return batch
 
 @timer
 def filter_by_frame_difference(
-    frames_dicts: List[Dict[str, Any]],
+    frames_dicts,
     threshold: float = 0.8,
     compression_proportion: float = 0.5,
-    module: str = "SSIM"):
+    module: str = "SSIM",
+    pregate_mse: float = 0.0):
     """
     module:
     "MSE_L2" : 灰階均方差，"({n}-({n-1}))^2 if n < 1"
@@ -492,63 +789,39 @@ def filter_by_frame_difference(
     [c(\\mathbf {x} ,\\mathbf {y} )]^{\\beta }
     [s(\\mathbf {x} ,\\mathbf {y} )]^{\\gamma }}(維基抄下來的，還有一堆沒有抄，好奇的自己去查)
 
-    step 1 : 將影像壓縮，並形成對應的 key -> stamp ; value -> frame
-    step 2 : 掠過第一張，從第二張開始，與前一張做差異比對，並根據key 修改原始dict的參數 
+    step 1 : 將影像轉灰階並壓縮，疊成連續的 (N, H, W) stack
+    step 2 : 交給 frame_difference_batch：MSE 一次向量化算完（float32，不再 uint8 溢位），
+             SSIM 幀對在 thread pool 平行計算；pregate_mse > 0 時先用縮圖 MSE 擋掉幾乎相同的幀對
+    step 3 : 第一張固定視為顯著，其餘依結果就地填入 FrameBatch 的 ssim_value / mse_value / is_significant 欄位
     """
-    _dbg(f"filter_by_frame_difference() call: {_frames_dicts_summary(frames_dicts)}，threshold={threshold}, compression_proportion={compression_proportion}, module={module}")
+    _dbg(f"filter_by_frame_difference() call: {_frames_dicts_summary(frames_dicts)}，threshold={threshold}, compression_proportion={compression_proportion}, module={module}, pregate_mse={pregate_mse}")
     if module not in ["MSE_L2", "SSIM"]:
         raise ValueError("module 必須是 'MSE_L2' 或 'SSIM'")
     if module == "SSIM" and not _HAS_SKIMAGE:
         raise ImportError("使用 SSIM 需要安裝 scikit-image：pip install scikit-image")
+    batch = frames_dicts if isinstance(frames_dicts, FrameBatch) else FrameBatch.from_dicts(frames_dicts)
+    rows = np.flatnonzero(batch.has_image())
+    if len(rows) == 0:
+        return batch
 
-    compression_frames = [
-        {   "stamp": item["stamp"],
-            "frame": cv2.resize(
-                        cv2.cvtColor(item["frame"], cv2.COLOR_BGR2GRAY) if item["frame"].ndim == 3 else item["frame"],
-                        (0, 0),
-                        fx=compression_proportion,
-                        fy=compression_proportion
-                    )
-        }
-        for item in frames_dicts.copy()
-     ] # 複製的 frames_dicts，避免修改原始資料，並壓縮影像作運算
-    
-    filtered_frames = [] #處理過的陣列
-    for idx in range(len(compression_frames)):  # ← 索引修正
-        if idx == 0:
-            filtered_item = frames_dicts[idx].copy()
-            filtered_item["ssim_value"] = 0 if module == "SSIM" else None
-            filtered_item["mse_value"] = 0 if module == "MSE_L2" else None
-            filtered_item["is_significant"] = True
-            filtered_frames.append(filtered_item)
-            continue
+    # 壓縮後的灰階 stack（影像緩衝區本身不動）
+    compression_stack = resize_stack(stack_gray(batch.images(rows)), compression_proportion)
+    diff = frame_difference_batch(compression_stack, None, threshold, module, pregate_mse=pregate_mse)
+    del compression_stack
+
+    _fill_difference_columns(batch, rows, diff, module)
+    _dbg(f"filter_by_frame_difference() ssim_pairs={diff['ssim_pairs']}, pregated_pairs={diff['pregated_pairs']}")
+
+    return batch  # 同一個 FrameBatch，已填入是否顯著的標記
 
-        current_frame = compression_frames[idx]["frame"]
-        previous_frame = compression_frames[idx - 1]["frame"]
-        diff_value = 0
-        ssim_value = 0
-        is_significant = False
-        if module == "MSE_L2":
-            
-            diff_value = np.mean((current_frame - previous_frame) ** 2)
-            is_significant = diff_value >= threshold
-        elif module == "SSIM":
-            # using skimage
-            ssim_value = ssim(current_frame, previous_frame, data_range=255)
-            # 越大越相似，我們要剃除相似，所以小於門檻的視為重要幀
-            is_significant = ssim_value <= threshold
-
-        filtered_item = frames_dicts[idx].copy()
-        filtered_item["ssim_value"] = ssim_value if module == "SSIM" else None
-        filtered_item["mse_value"] = diff_value if module == "MSE_L2" else None
-        filtered_item["is_significant"] = bool(is_significant)
-        filtered_frames.append(filtered_item)
-    
-    # 清理壓縮後的幀列表（不再需要）
-    del compression_frames
-    gc.collect()
-    
-    return filtered_frames  # 返回處理後的幀列表，包含是否顯著的標記
+
+def _fill_difference_columns(batch: FrameBatch, rows, diff: Dict[str, Any], module: str) -> None:
+    """把 frame_difference_batch 的結果寫進對應列（沒用到的指標維持 NaN）。"""
+    if module == "SSIM":
+        batch.ssim_value[rows] = [np.nan if v is None else v for v in diff["ssim_values"]]
+    else:
+        batch.mse_value[rows] = diff["diff_values"]
+    batch.is_significant[rows] = diff["is_significant"]
 
 
     # 處理方式規劃2,如過速度太慢再回來做
@@ -557,8 +830,190 @@ def filter_by_frame_difference(
     # A - B 
 
 
+@timer
+def select_frames_streaming(
+    video_url: str,
+    target_fps: int = 3,
+    blur_threshold: float = 20.0,
+    difference_threshold: float = 0.8,
+    compression_proportion: float = 0.5,
+    module: str = "SSIM",
+    frame_source: str = "opencv",
+    analysis_width: int = 0,
+    pregate_mse: float = 0.0,
+    adaptive_min_fps: float = 0.5,
+    adaptive_motion_threshold: float = 4.0) -> Dict[str, Any]:
+    """
+    串流版的 取幀 → 模糊度 → 幀差 → 是否送 caption 判斷。
+    每解碼一幀就立即評分，只有「清晰且顯著」（會被送去 caption）的幀保留（壓縮後的）影像，
+    其餘幀只留下分數與旗標（frame=None），記憶體峰值不再隨影片長度與 fps 成長。
+
+    判斷邏輯與 analyze_blur + filter_by_frame_difference 相同：
+    幀差永遠與「上一張抽樣幀」比較（不論上一張是否模糊）。
+
+    frame_source: "opencv"（cv2.VideoCapture 逐幀讀）或 "ffmpeg"（rawvideo pipe，
+    由 ffmpeg 抽樣並縮到 analysis_width；注意模糊門檻是以分析解析度計算的）。
+    pregate_mse: 僅 SSIM；> 0 時縮圖 MSE 低於此值的幀對直接視為不顯著、跳過 SSIM（預設關閉）。
+    frame_source="adaptive"：依動態調整抽樣率（target_fps 為上限、adaptive_min_fps 為下限，
+    adaptive_motion_threshold 為縮圖平均絕對差的門檻），見 iter_video_frames_adaptive。
+
+    解碼出來的幀先複製進一塊重複使用的暫存區（BLUR_BATCH_SIZE 張，各幀需同尺寸），評分後：
+        - 每一幀只留一份小灰階（FrameBatch analysis tier，寬 FRAME_ANALYSIS_THUMB_WIDTH）
+        - 入選 caption 的幀以 FRAME_CANDIDATE_CODEC（預設 jpeg）壓縮保存，captioner 要用時才解碼
+        - 其餘幀不保留影像（暫存區下一批直接覆寫）
+    video_info["frame_tier_bytes"] 回報各層的峰值位元組數，以及若保留原始 BGR 需要的量。
+
+    回傳：
+        {
+            "video_info": {...},          # 同 get_video_frames_fast
+            "frames": FrameBatch,         # stamp / variance / is_not_blurry / ssim_value / mse_value / is_significant 欄位
+            "thumbnail_jpeg": bytes|None  # 第一張幀的縮圖（第一張幀本身不一定會被保留）
+        }
+    """
+    _dbg(f"select_frames_streaming() called with video_url={video_url}, target_fps={target_fps}, "
+         f"blur_threshold={blur_threshold}, difference_threshold={difference_threshold}, "
+         f"compression_proportion={compression_proportion}, module={module}, "
+         f"frame_source={frame_source}, analysis_width={analysis_width}, pregate_mse={pregate_mse}")
+    if module not in ["MSE_L2", "SSIM"]:
+        raise ValueError("module 必須是 'MSE_L2' 或 'SSIM'")
+    if frame_source not in _FRAME_SOURCES:
+        raise ValueError(f"frame_source 必須是 {list(_FRAME_SOURCES)} 其中之一")
+    if module == "SSIM" and not _HAS_SKIMAGE:
+        raise ImportError("使用 SSIM 需要安裝 scikit-image：pip install scikit-image")
+
+    video_info: Dict[str, Any] = {}
+    frames = FrameBatch(codec=FRAME_CANDIDATE_CODEC, analysis_width=FRAME_ANALYSIS_THUMB_WIDTH)
+    thumbnail_jpeg = None
+    previous_small = None
+    staging: Optional[np.ndarray] = None  # (BLUR_BATCH_SIZE, H, W, C)，每個微批次重複使用
+    pending_stamps: List[float] = []
+
+    def _flush() -> None:
+        """對暫存區內一小批已解碼的幀評分，只有清晰且顯著的幀複製進 FrameBatch。"""
+        nonlocal previous_small
+        n = len(pending_stamps)
+        staged = staging[:n]
+        with stage("blur", items=n):
+            grays = stack_gray(staged)
+            variances = laplacian_variance_batch(grays)
+        with stage("diff", items=n):
+            small = resize_stack(grays, compression_proportion)
+            # 幀差永遠與上一張抽樣幀比較，跨批次時以上一批最後一幀當基準
+            diff = frame_difference_batch(small, previous_small, difference_threshold, module, pregate_mse=pregate_mse)
+        previous_small = small[-1].copy()
+        video_info["diff_ssim_pairs"] = video_info.get("diff_ssim_pairs", 0) + diff["ssim_pairs"]
+        video_info["diff_pregated_pairs"] = video_info.get("diff_pregated_pairs", 0) + diff["pregated_pairs"]
+
+        rows = frames.extend(pending_stamps)
+        frames.set_analysis(rows, grays)
+        frames.variance[rows] = variances
+        frames.is_not_blurry[rows] = ~(np.asarray(variances) <= blur_threshold)  # 小於門檻視為模糊
+        _fill_difference_columns(frames, rows, diff, module)
+        # 只有會送進 captioner 的幀才保留影像
+        keep = frames.is_not_blurry[rows] & frames.is_significant[rows]
+        for i in np.flatnonzero(keep):
+            frames.set_image(rows.start + int(i), staged[i])
+        pending_stamps.clear()
+
+    source_kwargs: Dict[str, Any] = {}
+    if frame_source == "ffmpeg":
+        source_kwargs["analysis_width"] = int(analysis_width)
+    elif frame_source == "adaptive":
+        source_kwargs["min_fps"] = float(adaptive_min_fps)
+        source_kwargs["motion_threshold"] = float(adaptive_motion_threshold)
+    frame_iter = _FRAME_SOURCES[frame_source](video_url, target_fps, video_info=video_info, **source_kwargs)
+    # ffmpeg 來源的 frame 是重複使用的緩衝區，一律先複製進暫存區
+    for item in frame_iter:
+        frame = item["frame"]
+        if thumbnail_jpeg is None:
+            thumbnail_jpeg = _frame_to_thumbnail_jpeg_bytes(frame)
+        if staging is None:
+            staging = np.empty((BLUR_BATCH_SIZE,) + frame.shape, dtype=frame.dtype)
+        np.copyto(staging[len(pending_stamps)], frame)
+        pending_stamps.append(item["stamp"])
+        del item, frame
+        if len(pending_stamps) >= BLUR_BATCH_SIZE:
+            _flush()
+    if pending_stamps:
+        _flush()
+    candidates = int(frames.has_image().sum())
+    video_info["frame_tier_bytes"] = {
+        "analysis": frames.peak_tier_bytes["analysis"],
+        "candidate": frames.peak_tier_bytes["candidate"],
+        "candidate_codec": frames.codec,
+        "candidate_raw_equivalent": candidates * (int(staging[0].nbytes) if staging is not None else 0),
+        "staging": int(staging.nbytes) if staging is not None else 0,
+    }
+    staging = None
+
+    _dbg(f"select_frames_streaming() done: {_frames_dicts_summary(frames)}")
+    return {"video_info": video_info, "frames": frames, "thumbnail_jpeg": thumbnail_jpeg}
+
+
+# caption 前的人物 / 活動預偵測（CPU）：off | mog2（背景相減前景比例）| hog（OpenCV 行人偵測）
+ACTIVITY_DETECTOR = os.getenv("ACTIVITY_DETECTOR", "off").lower()
+ACTIVITY_MIN_FOREGROUND = float(os.getenv("ACTIVITY_MIN_FOREGROUND", "0.005"))
+_ACTIVITY_DETECTORS = ("off", "mog2", "hog")
+
+
+@timer
+def pre_detect_activity(frames: FrameBatch,
+                        detector: str = ACTIVITY_DETECTOR,
+                        min_foreground: float = ACTIVITY_MIN_FOREGROUND,
+                        video_info: Optional[Dict[str, Any]] = None) -> FrameBatch:
+    """
+    介於 filter_by_frame_difference 與 img_captioning 之間的便宜預偵測。
+    很多居家攝影機的幀只是因為光線變化通過模糊度 / SSIM 門檻，這裡把「畫面上沒有人或活動」的
+    caption 候選幀標成 has_activity=False 並釋放影像，不送 VLM、也不進 LLM。
+
+    detector:
+        "mog2"：對 analysis tier（每一張抽樣幀的小灰階）依序做背景相減，
+                前景比例 < min_foreground 的候選幀視為沒有活動；沒有 analysis tier 時不做任何事
+        "hog" ：對候選幀跑 OpenCV 內建 HOG 行人偵測，沒偵測到人的視為沒有活動
+        "off" ：不做任何事
+    video_info 有給時寫入 activity_detector / activity_checked / activity_vlm_calls_saved。
+    """
+    if detector not in _ACTIVITY_DETECTORS:
+        raise ValueError(f"activity_detector 必須是 {list(_ACTIVITY_DETECTORS)} 其中之一")
+    candidates = frames.caption_candidates()
+    inactive: List[int] = []
+    checked = 0
+    if detector == "mog2":
+        gray_stack = frames.analysis_stack()
+        if gray_stack is None:
+            _dbg("pre_detect_activity(): 沒有 analysis tier，略過 mog2")
+        elif len(candidates):
+            with stage("activity", items=len(frames)):
+                ratios = foreground_ratios_mog2(gray_stack)
+            checked = len(candidates)
+            inactive = [int(r) for r in candidates if ratios[r] < min_foreground]
+    elif detector == "hog" and len(candidates):
+        with stage("activity", items=len(candidates)):
+            # 分批解碼，避免所有候選幀同時解壓在記憶體裡
+            for start in range(0, len(candidates), BLUR_BATCH_SIZE):
+                rows = [int(r) for r in candidates[start:start + BLUR_BATCH_SIZE]]
+                people = detect_people_hog(frames.images(rows))
+                inactive.extend(row for row, found in zip(rows, people) if not found)
+        checked = len(candidates)
+
+    for row in inactive:
+        frames.has_activity[row] = False
+        frames.drop_image(row)
+    _dbg(f"pre_detect_activity() detector={detector}: {len(inactive)} / {checked} candidates without activity")
+    if video_info is not None:
+        video_info["activity_detector"] = detector
+        video_info["activity_checked"] = checked
+        video_info["activity_vlm_calls_saved"] = len(inactive)
+    return frames
+
+
 # 你原本就有的 _dbg / timer / _frames_dicts_summary ... 這裡沿用
 
+# Moondream2 的 caption() 一次只吃一張圖（沒有多圖的 forward），所以逐張編碼 + 解碼；
+# CAPTION_CHUNK_SIZE 只決定每幾張做一次清理（torch.cuda.empty_cache），不影響速度與峰值記憶體
+CAPTION_CHUNK_SIZE = max(1, int(os.getenv("CAPTION_CHUNK_SIZE", "8")))
+CAPTION_TORCH_THREADS = int(os.getenv("CAPTION_TORCH_THREADS", "0")) or (os.cpu_count() or 1)
+
 class Moondream2ImageCaptioner:
     """
     Moondream2 captioner (Transformers).
@@ -617,6 +1072,10 @@ class Moondream2ImageCaptioner:
         )
         self.model.eval()
 
+        # CPU 推論：讓 torch 的 intra-op thread 數吃滿可用核心（預設常只用到一半）
+        if not self.device.startswith("cuda"):
+            torch.set_num_threads(CAPTION_TORCH_THREADS)
+
         # 若你會反覆呼叫（很多幀），官方也提到可以 compile() 提升速度（可選） :contentReference[oaicite:5]{index=5}
         # try:
         #     self.model.compile()
@@ -652,101 +1111,156 @@ class Moondream2ImageCaptioner:
 
         return caption
 
+    @torch.inference_mode()
+    def describe_many(self, images: Iterable[Image.Image], length: str = "normal",
+                      max_tokens: int = 128) -> Iterator[str]:
+        """
+        依序為多張圖片產生 caption（generator，與輸入順序相同）。
+        每張圖各自 encode + 解碼完才取下一張，同時只持有一張圖的 vision embedding；
+        images 可以是 generator，呼叫端就不必一次把整批圖片轉好。
+        與 describe 不同的是不在每張之後 gc / empty_cache，清理交給呼叫端。
+        """
+        settings = {"max_tokens": int(max_tokens)}
+        for img in images:
+            result = self.model.caption(img.convert("RGB"), length=length, settings=settings)
+            yield result["caption"] if isinstance(result, dict) else str(result)
+
+
+CAPTIONER_MODEL_NAME = "moondream2_captioner"
+
+
+def _load_captioner() -> Moondream2ImageCaptioner:
+    os.makedirs("/srv/app/adapters/.cache/transformers", exist_ok=True)
+    return Moondream2ImageCaptioner(
+        model_name="vikhyatk/moondream2",
+        cache_dir="/srv/app/adapters/.cache/transformers",
+        device=None,
+        # < 6GB 先開：
+        use_4bit=True,
+        # dtype=torch.float16,  # 視你的 GPU 而定
+    )
+
+
+def _unload_captioner(captioner: Moondream2ImageCaptioner) -> None:
+    captioner.model = None
+
+
+get_registry().register(CAPTIONER_MODEL_NAME, loader=_load_captioner, unloader=_unload_captioner)
 
-_CAPTIONER = None
-_CAPTIONER_LOCK = threading.Lock()
 
 def get_captioner() -> Moondream2ImageCaptioner:
-    global _CAPTIONER
+    """取得 captioner（由 model_registry 控管：閒置超過 MODEL_IDLE_TTL 或 RSS 過高時卸載，用到再載入）"""
     _dbg("get_captioner() called")
-    if _CAPTIONER is None:
-        with _CAPTIONER_LOCK:
-            if _CAPTIONER is None:
-                os.makedirs("/srv/app/adapters/.cache/transformers", exist_ok=True)
-                _CAPTIONER = Moondream2ImageCaptioner(
-                    model_name="vikhyatk/moondream2",
-                    cache_dir="/srv/app/adapters/.cache/transformers",
-                    device=None,
-                    # < 6GB 先開：
-                    use_4bit=True,
-                    # dtype=torch.float16,  # 視你的 GPU 而定
-                )
-    return _CAPTIONER
+    return get_registry().get(CAPTIONER_MODEL_NAME)
 
 
 
 @timer
-def img_captioning(frames_dicts: List[Dict[str, Any]]):
+def img_captioning(frames_dicts,
+                   video_info: Optional[Dict[str, Any]] = None,
+                   camera_id: Optional[str] = None,
+                   cache_radius: Optional[int] = None):
     """
     Generate image captions for selected video frames using a singleton VLM captioner.
 
     Design considerations:
-    - Frames are processed sequentially to avoid GPU memory spikes.
-    - Only frames passing blur/significance filters are sent to the vision-language model.
-    - Aggressive memory cleanup is intentionally applied to support low-VRAM GPUs (≈6GB).
-    - The captioner instance is reused (singleton) to avoid repeated model initialization.
+    - Frames that pass the blur/significance filters are captioned one by one through
+      Moondream2ImageCaptioner.describe_many (Moondream2 has no multi-image forward pass);
+      frames are decoded / converted lazily so only one image is held at a time.
+    - Cleanup runs once every CAPTION_CHUNK_SIZE frames instead of after every frame.
+    - The captioner is held through model_registry: reused across jobs, unloaded after MODEL_IDLE_TTL
+      of inactivity, and not loaded at all when every candidate is served from the caption cache.
+    - If video_info is given, per-frame latency / throughput are written into it (caption_* keys)
+      so that _collect_metrics can report them.
+    - If camera_id is given, captions are looked up in the per-camera perceptual-hash cache
+      (libs.caption_cache) first; only misses go to the VLM. cache_radius < 0 disables the cache.
+    - Captions are written into the FrameBatch caption column in place; the image buffer
+      is released once every candidate has been captioned.
     """
 
     _dbg(f"img_captioning() called with {_frames_dicts_summary(frames_dicts)}")
+    frames = frames_dicts if isinstance(frames_dicts, FrameBatch) else FrameBatch.from_dicts(frames_dicts)
+
+    # Skip frames that are either blurry or semantically insignificant.
+    # This acts as a cheap pre-filter to reduce expensive VLM invocations.
+    candidates = [int(r) for r in frames.caption_candidates()]
+    skipped = np.ones(len(frames), dtype=bool)
+    skipped[candidates] = False
+    for row in np.flatnonzero(skipped):
+        # Mark skipped frames explicitly to keep downstream logic simple and explicit.
+        frames.captions[row] = SKIPPED_CAPTION
+
+    # Per-camera caption cache: consecutive segments of a static scene produce near-identical frames.
+    cache = None
+    if camera_id and (cache_radius is None or cache_radius >= 0) and candidates:
+        cache = CameraCaptionCache(camera_id, radius=CAPTION_CACHE_RADIUS if cache_radius is None else cache_radius)
+        if not cache.enabled:
+            cache = None
+    phashes: Dict[int, int] = {}
+    if cache is not None:
+        misses = []
+        for row in candidates:
+            phashes[row] = dhash(frames.image(row))
+            cached = cache.lookup(phashes[row])
+            if cached is not None:
+                frames.captions[row] = cached
+                frames.drop_image(row)
+            else:
+                misses.append(row)
+        _dbg(f"img_captioning() caption cache: {len(candidates) - len(misses)} hits / {len(candidates)} candidates")
+        cache_stats = cache.stats()
+        cache_stats["caption_vlm_calls_saved"] = len(candidates) - len(misses)
+        candidates = misses
+    else:
+        cache_stats = {}
+
+    frame_seconds: List[float] = []
+    if candidates:
+        # The captioner is managed by model_registry (loaded once, unloaded when idle);
+        # holding it via use() keeps it from being reaped while this job is captioning.
+        with stage("caption", items=len(candidates)), get_registry().use(CAPTIONER_MODEL_NAME) as captioner:
+            for start in range(0, len(candidates), CAPTION_CHUNK_SIZE):
+                chunk = candidates[start:start + CAPTION_CHUNK_SIZE]
+
+                # Convert OpenCV BGR frame to PIL RGB image lazily, one frame at a time.
+                # PIL.Image is required by most HuggingFace / VLM APIs.
+                pil_images = (Image.fromarray(cv2.cvtColor(frames.image(row), cv2.COLOR_BGR2RGB)) for row in chunk)
+
+                # max_tokens is intentionally bounded to:
+                #   1) prevent excessive KV-cache growth
+                #   2) stabilize VRAM usage under repeated calls
+                t0 = time.perf_counter()
+                for row, caption in zip(chunk, captioner.describe_many(pil_images, length="normal", max_tokens=96)):
+                    frame_seconds.append(time.perf_counter() - t0)
+                    # Persist caption back into the caption column.
+                    frames.captions[row] = caption
+                    if cache is not None:
+                        cache.store(phashes[row], caption)
+                    # The decoded frame is no longer needed once captioned.
+                    frames.drop_image(row)
+                    t0 = time.perf_counter()
 
-    # Singleton captioner:
-    # The underlying model is heavy (VLM + vision encoder),
-    # so we ensure it is instantiated exactly once per process.
-    captioner = get_captioner()
-
-    processed_count = 0
-
-    for idx, item in enumerate(frames_dicts):
-        # Skip frames that are either blurry or semantically insignificant.
-        # This acts as a cheap pre-filter to reduce expensive VLM invocations.
-        if item["is_not_blurry"] and item["is_significant"]:
-            frame = item["frame"]
-
-            # Convert OpenCV BGR frame to PIL RGB image.
-            # PIL.Image is required by most HuggingFace / VLM APIs.
-            image_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            pil_image = Image.fromarray(image_rgb)
-
-            # Run vision-language inference.
-            # max_tokens is intentionally bounded to:
-            #   1) prevent excessive KV-cache growth
-            #   2) stabilize VRAM usage under repeated calls
-            caption = captioner.describe(
-                pil_image,
-                length="normal",
-                max_tokens=96
-            )
-
-            # Persist caption back into the frame metadata.
-            item["caption"] = caption
-            processed_count += 1
-
-            # Explicitly release large Python-side objects after each iteration.
-            # This reduces CPU RAM pressure and prevents delayed reference cleanup.
-            del image_rgb
-            del pil_image
-
-            # Periodic deep cleanup:
-            # - gc.collect(): reclaim Python objects that are no longer referenced
-            # - torch.cuda.empty_cache(): release unused CUDA memory back to the allocator
-            #
-            # Running this every frame would cause performance jitter,
-            # so we batch it every N frames as a compromise between stability and throughput.
-            if processed_count % 5 == 0:
-                gc.collect()
                 if torch.cuda.is_available():
                     torch.cuda.empty_cache()
-        else:
-            # Mark skipped frames explicitly to keep downstream logic simple and explicit.
-            item["caption"] = "<skipped due to blur or insignificance>"
+                _dbg(f"img_captioning() {len(frame_seconds)}/{len(candidates)} frames captioned")
+
+    if video_info is not None:
+        total_seconds = sum(frame_seconds)
+        video_info["caption_frames"] = len(frame_seconds)
+        video_info["caption_seconds"] = total_seconds
+        video_info["caption_frame_latency_avg"] = (total_seconds / len(frame_seconds)) if frame_seconds else None
+        video_info["caption_frame_latency_max"] = max(frame_seconds) if frame_seconds else None
+        video_info["caption_frames_per_sec"] = (len(frame_seconds) / total_seconds) if total_seconds > 0 else None
+        video_info.update(cache_stats)
 
     # Final cleanup to ensure no residual allocations remain
     # before returning control to the caller.
+    frames.release_images()
     gc.collect()
     if torch.cuda.is_available():
         torch.cuda.empty_cache()
 
-    return frames_dicts
+    return frames
 
 
 # ====== LLM Schema 定義 ======
@@ -869,8 +1383,90 @@ def clean_model_output(model_output: Any) -> Optional[Any]:
 
     # 都失敗就回 None
     return None
+
+
+# 連續且 caption 相似度 >= 此值的幀在 prompt 中合併成一組（> 1 即停用合併）
+LLM_PROMPT_MERGE_RATIO = float(os.getenv("LLM_PROMPT_MERGE_RATIO", "0.9"))
+_CJK_RE = re.compile(r"[\u3000-\u9fff\uac00-\ud7af\uff00-\uffef]")
+_CAPTION_NORM_RE = re.compile(r"[\W_]+", re.UNICODE)
+
+
+def _estimate_tokens(text: str) -> int:
+    """粗估 token 數（不呼叫 API）：CJK 字元約 1 token/字，其餘約 4 字元/token。"""
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def _encode_frames_for_prompt(frames_summary: List[Dict[str, Any]],
+                              merge_ratio: float = LLM_PROMPT_MERGE_RATIO) -> Tuple[List[Dict[str, Any]], List[Tuple[int, int]]]:
+    """
+    把連續相同 / 近似的 caption 合併成一組，降低 prompt 長度。
+
+    回傳 (groups, group_ranges)：
+        groups[g] = {"index": g, "stamp": 第一幀秒數, "until": 最後一幀秒數（只有合併多幀時才有）, "caption": ...}
+        group_ranges[g] = (原始第一幀 index, 原始最後一幀 index)，供 _remap_llm_indices 還原
+    """
+    groups: List[Dict[str, Any]] = []
+    group_ranges: List[Tuple[int, int]] = []
+    last_norm = None
+    for fr in frames_summary:
+        caption = fr.get("caption", "") or ""
+        norm = _CAPTION_NORM_RE.sub(" ", caption.lower()).strip()
+        if groups and last_norm is not None and merge_ratio <= 1.0 and (
+            norm == last_norm or difflib.SequenceMatcher(None, norm, last_norm).ratio() >= merge_ratio
+        ):
+            groups[-1]["until"] = fr.get("stamp")
+            group_ranges[-1] = (group_ranges[-1][0], fr["index"])
+            continue
+        groups.append({"index": len(groups), "stamp": fr.get("stamp"), "caption": caption})
+        group_ranges.append((fr["index"], fr["index"]))
+        last_norm = norm  # 與整組的第一句比，避免相似度一路漂移
+    return groups, group_ranges
+
+
+def _remap_llm_indices(result: dict, group_ranges: List[Tuple[int, int]], frame_count: int) -> dict:
+    """
+    把 LLM 回傳的組 index 還原成原始幀 index：start_index → 該組第一幀、end_index → 該組最後一幀。
+    超出範圍的 index 會映射到同樣超出原始範圍的值，讓 _build_events_from_llm_by_index 照常夾限並計數。
+    回傳新的 dict，不改動傳入的 result（快取存的是組 index 版本，不能被還原過的值覆蓋）。
+    """
+    result = copy.deepcopy(result)
+    n_groups = len(group_ranges)
+
+    def _map(value: Any, pick: int) -> Any:
+        try:
+            g = int(value)
+        except Exception:
+            return value
+        if g < 0:
+            return g
+        if g >= n_groups:
+            return frame_count - 1 + (g - n_groups + 1)
+        return group_ranges[g][pick]
+
+    event_lists = [result.get("final_answer", {}).get("events", []) or []]
+    event_lists += [r.get("events", []) or [] for r in result.get("rounds", []) or []]
+    for events in event_lists:
+        for ev in events:
+            if "start_index" in ev:
+                ev["start_index"] = _map(ev["start_index"], 0)
+            if "end_index" in ev:
+                ev["end_index"] = _map(ev["end_index"], 1)
+    return result
+
+
+class LLMRetryExhausted(RuntimeError):
+    """LLM 在規定次數內都沒有回出合法的結果（error_code 為類別名稱，供重試判斷）。"""
+
+
+def _get_genai_client(api_key: str):
+    """建立 Gemini client（獨立出來，benchmark 可替換成不連網的 stub）。"""
+    import google.genai as genai
+    return genai.Client(api_key=api_key)
+
+
 @timer
-def llm_processing(frames_dicts: List[Dict[str, Any]],
+def llm_processing(frames_dicts,
                    number_of_trys: int = 3,
                    api_key: Optional[str] = None):
     """使用 LLM 處理視頻幀，生成事件描述。
@@ -879,7 +1475,7 @@ def llm_processing(frames_dicts: List[Dict[str, Any]],
     確保返回結構化的事件列表。
     
     Args:
-        frames_dicts: 視頻幀列表，每個包含 caption, stamp 等資訊
+        frames_dicts: FrameBatch（或舊格式的幀 dict 列表），需含 caption / stamp 與過濾旗標
         number_of_trys: 重試次數，預設 3
         api_key: Google API Key（必填，必須由 job params 傳入）
         
@@ -894,8 +1490,8 @@ def llm_processing(frames_dicts: List[Dict[str, Any]],
     _dbg(f"llm_processing() called with {_frames_dicts_summary(frames_dicts)}，number_of_trys={number_of_trys}")
     
     # 錯誤檢查
-    if not frames_dicts or not isinstance(frames_dicts, list):
-        raise ValueError("frames_dicts 必須是非空的列表")
+    if not isinstance(frames_dicts, (FrameBatch, list)) or len(frames_dicts) == 0:
+        raise ValueError("frames_dicts 必須是非空的 FrameBatch 或列表")
     if number_of_trys < 1:
         raise ValueError("number_of_trys 必須大於等於1")  
 
@@ -906,51 +1502,78 @@ def llm_processing(frames_dicts: List[Dict[str, Any]],
     with open(SYSTEM_PROMPT_PATH, "r", encoding="utf-8") as f:
         system_prompt = f.read()
 
-    # 先處理 frames_dicts，確保每個幀都有 caption
-    del_list = ["frame", "is_not_blurry", "is_significant", "variance", "ssim_value", "mse_value"]
-    # 跳過 is_not_blurry 與 is_significant 為 False 的幀
-    new_frames_dicts = []
-    for item in frames_dicts:
-        if item["is_not_blurry"] and item["is_significant"]:
-            new_frames_dicts.append(item)
-
-    cleaned_frames = [
-        {k: v for k, v in fr.items() if k not in del_list}
-        for fr in new_frames_dicts
-    ]
-    
-    # 清理不再需要的原始幀數據
-    del new_frames_dicts
-    gc.collect()
-    
+    # 只取 is_not_blurry 與 is_significant 都為 True 的幀，直接從欄位讀 stamp / caption
+    frames = frames_dicts if isinstance(frames_dicts, FrameBatch) else FrameBatch.from_dicts(frames_dicts)
     frames_summary = [
         {
             "index": i,
-            "stamp": fr.get("stamp"),
-            "caption": fr.get("caption", "")
+            "stamp": float(frames.stamp[row]),
+            "caption": frames.captions[row] or ""
         }
-        for i, fr in enumerate(cleaned_frames)
+        for i, row in enumerate(frames.selected())
     ]
     _dbg(f"Frames prepared for LLM: {len(frames_summary)} frames.")
     
-    # 準備 prompt
+    # 準備 prompt：system_prompt 已經透過 system_instruction 傳入，這裡不再重複；
+    # 連續近似的 caption 合併成一組，並用緊湊的 JSON 分隔符
+    groups, group_ranges = _encode_frames_for_prompt(frames_summary)
     prompt_text = json.dumps({
+        "describe": {
+            "frames": groups
+        }
+    }, ensure_ascii=False, separators=(",", ":"))
+    legacy_prompt_text = json.dumps({
         "system_prompt": system_prompt,
         "describe": {
             "frames": frames_summary
         }
     }, ensure_ascii=False, indent=2)
+    prompt_stats = {
+        "prompt_frames": len(frames_summary),
+        "prompt_groups": len(groups),
+        "prompt_tokens_est_before": _estimate_tokens(legacy_prompt_text),
+        "prompt_tokens_est_after": _estimate_tokens(prompt_text),
+    }
+    del legacy_prompt_text
+    _dbg(f"LLM prompt: {prompt_stats['prompt_frames']} frames -> {prompt_stats['prompt_groups']} groups, "
+         f"estimated input tokens {prompt_stats['prompt_tokens_est_before']} -> {prompt_stats['prompt_tokens_est_after']}")
+
+    model_name = os.getenv("GEMINI_MODEL_NAME", "gemini-2.5-flash-lite")
+    max_output_tokens = int(os.getenv("GEMINI_MAX_OUTPUT_TOKENS", "65535"))
+
+    # 快取：同樣的模型 + system prompt + 壓縮後的 frames 摘要直接沿用上次驗證過的結果，不打 API
+    cache_key = make_cache_key(
+        model_name,
+        system_prompt,
+        {"temperature": 0.0, "max_output_tokens": max_output_tokens, "schema": LLMResponse.model_json_schema()},
+        prompt_text,
+    )
+    cached = get_cached_response(cache_key)
+    if cached is not None:
+        try:
+            validated_result = LLMResponse.model_validate(cached.get("result") or {})
+            result = _remap_llm_indices(validated_result.model_dump(), group_ranges, len(frames_summary))
+            saved = cached.get("usage") or {}
+            usage = {
+                "prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0,
+                "cached": True,
+                "cached_total_tokens": int(saved.get("total_tokens") or 0),
+            }
+            usage.update(prompt_stats)
+            _dbg(f"LLM cache hit ({cache_key[:12]}): {len(result.get('final_answer', {}).get('events', []))} events")
+            return result, frames_summary, usage
+        except Exception as e:
+            _dbg(f"LLM cache 內容無效，改呼叫 API: {e}")
 
     # 使用新的 Google Gemini API（google-genai）和 Schema
     # 注意：google-generativeai 舊 SDK 的 import 是 google.generativeai；本專案使用 google-genai。
-    import google.genai as genai
     from google.genai import types
     
     # 獲取 API Key（必須從 job params 中提供，不允許從環境變數讀取）
     if not api_key:
         raise ValueError("GOOGLE_API_KEY 未設定（請在建立 job 時提供 google_api_key 參數）")
     
-    client = genai.Client(api_key=api_key)
+    client = _get_genai_client(api_key)
     
     # 定義 Safety Settings（關閉安全檢查）
     safety_settings = [
@@ -961,9 +1584,6 @@ def llm_processing(frames_dicts: List[Dict[str, Any]],
     ]
     
     # 使用 Schema 規範輸出
-    model_name = os.getenv("GEMINI_MODEL_NAME", "gemini-2.5-flash-lite")
-    max_output_tokens = int(os.getenv("GEMINI_MAX_OUTPUT_TOKENS", "65535"))
-    
     # 構建 GenerateContentConfig，使用 Schema
     generate_content_config = types.GenerateContentConfig(
         temperature=0.0,
@@ -1031,8 +1651,10 @@ def llm_processing(frames_dicts: List[Dict[str, Any]],
             # 使用 Pydantic 驗證結構
             validated_result = LLMResponse.model_validate(parsed_result)
             
-            # 轉換回字典格式（保持向後兼容）
-            result = validated_result.model_dump()
+            # 轉換回字典格式（保持向後兼容），並把組 index 還原成原始幀 index
+            # 快取存的是組 index 版本，命中時再依當次的 group_ranges 還原
+            grouped_result = validated_result.model_dump()
+            result = _remap_llm_indices(grouped_result, group_ranges, len(frames_summary))
             _dbg(f"{output_num-number_of_trys+1} of try. LLM validated output: {len(result.get('final_answer', {}).get('events', []))} events")
             
             if result:
@@ -1046,9 +1668,13 @@ def llm_processing(frames_dicts: List[Dict[str, Any]],
             number_of_trys -= 1
     
     if not result:
-        raise RuntimeError(f"模型嘗試超過規定{output_num}次錯誤，請檢查模型輸出或重試。")
+        raise LLMRetryExhausted(f"模型嘗試超過規定{output_num}次錯誤，請檢查模型輸出或重試。")
 
-    # 返回結果和 frames_summary
+    put_cached_response(cache_key, grouped_result, usage)
+    usage["cached"] = False
+
+    # 返回結果和 frames_summary（result 的 index 已對應 frames_summary）
+    usage.update(prompt_stats)
     return result, frames_summary, usage
 # ---- 工具：解析 ISO 時間（允許 None） ----
 def _parse_iso_dt(s: Optional[str]) -> Optional[datetime]:
@@ -1148,20 +1774,17 @@ def _build_events_from_llm_by_index(llm_result: dict,
 
 # ---- 收集 metrics（含幀處理與 LLM 事件統計）----
 def _collect_metrics(video_info: dict,
-                     frames_with_flags: List[Dict[str, Any]],
+                     frames_with_flags,
                      frames_summary: List[Dict[str, Any]],
                      *,
                      llm_events_count: int = 0,
                      index_clamp_count: int = 0) -> Dict[str, Any]:
+    if not isinstance(frames_with_flags, FrameBatch):
+        frames_with_flags = FrameBatch.from_dicts(frames_with_flags or [])
     total = len(frames_with_flags)
-    not_blurry = sum(1 for x in frames_with_flags if x.get("is_not_blurry"))
-    significant = sum(1 for x in frames_with_flags if x.get("is_significant"))
-    captioned = sum(
-        1 for x in frames_with_flags
-        if isinstance(x.get("caption"), str)
-        and x["caption"]
-        and x["caption"] != "<skipped due to blur or insignificance>"
-    )
+    not_blurry = int(frames_with_flags.is_not_blurry.sum())
+    significant = int(frames_with_flags.is_significant.sum())
+    captioned = frames_with_flags.captioned_count()
     kept_for_llm = len(frames_summary)
 
     return {
@@ -1173,6 +1796,34 @@ def _collect_metrics(video_info: dict,
         "effective_fps": video_info.get("effective_fps"),
         "extracted_frames": video_info.get("extracted_frames"),
         "possible_extracts": video_info.get("possible_extracts"),
+        "frame_source": video_info.get("frame_source"),
+        "frame_source_decode_seconds": video_info.get("frame_source_decode_seconds"),
+        "frame_source_decode_fps": video_info.get("frame_source_decode_fps"),
+        "sampling_timeline": video_info.get("sampling_timeline"),
+        "input_source": video_info.get("input_source"),  # shared | cache | fetched | presigned | url
+        "segment_cache": storage_stats(),
+        "diff_ssim_pairs": video_info.get("diff_ssim_pairs"),
+        "diff_pregated_pairs": video_info.get("diff_pregated_pairs"),
+        "frame_tier_bytes": video_info.get("frame_tier_bytes"),  # 各層峰值：analysis 小灰階 / candidate 壓縮影像
+        "checkpoint": video_info.get("checkpoint"),  # attempt / loaded / saved / resumed_from
+        "caption_frames": video_info.get("caption_frames"),
+        "caption_seconds": video_info.get("caption_seconds"),
+        "caption_frame_latency_avg": video_info.get("caption_frame_latency_avg"),
+        "caption_frame_latency_max": video_info.get("caption_frame_latency_max"),
+        "caption_frames_per_sec": video_info.get("caption_frames_per_sec"),
+        "caption_cache_lookups": video_info.get("caption_cache_lookups"),
+        "caption_cache_hits": video_info.get("caption_cache_hits"),
+        "caption_cache_hit_rate": video_info.get("caption_cache_hit_rate"),
+        "caption_vlm_calls_saved": video_info.get("caption_vlm_calls_saved"),
+        "activity_detector": video_info.get("activity_detector"),
+        "activity_checked": video_info.get("activity_checked"),
+        "activity_vlm_calls_saved": video_info.get("activity_vlm_calls_saved"),
+
+        # 模型生命週期（載入 / 卸載次數與載入耗時，衡量冷啟動成本）
+        "model_registry": get_registry().stats(),
+
+        # 各階段 wall / CPU / peak RSS 增量 / 項目數（api_callback 在結果送出後才量得到，只進 Prometheus）
+        "stage_metrics": current_recorder().as_metrics() if current_recorder() is not None else None,
 
         # 幀處理統計
         "frames_total": total,
@@ -1193,7 +1844,7 @@ def _collect_metrics(video_info: dict,
 def _make_success_jobresult(job: dict,
                             video_info: dict,
                             events: List[Dict[str, Any]],
-                            frames_with_flags: List[Dict[str, Any]],
+                            frames_with_flags: FrameBatch,
                             frames_summary: List[Dict[str, Any]]) -> Dict[str, Any]:
     # video_start_time / video_end_time 推算
     video_start_dt = _parse_iso_dt(job.get("params", {}).get("video_start_time"))
@@ -1228,7 +1879,7 @@ def _make_failed_jobresult(job: dict,
                            *,
                            code: str,
                            message: str,
-                           frames_with_flags: Optional[List[Dict[str, Any]]] = None,
+                           frames_with_flags: Optional[FrameBatch] = None,
                            frames_summary: Optional[List[Dict[str, Any]]] = None,
                            raw_llm: Optional[dict] = None,
                            index_clamp_count: int = 0) -> Dict[str, Any]:
@@ -1260,52 +1911,203 @@ def _make_failed_jobresult(job: dict,
 
 from ..libs.RAG import RAGModel
 
-def video_description_extraction_main(job: dict):
+VIDEO_METADATA_MAX_KEYFRAMES = int(os.getenv("VIDEO_METADATA_MAX_KEYFRAMES", "12"))
+
+
+def _build_video_metadata(video_info: dict, frames_summary: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    由描述流程已做過的解碼整理出 recordings.video_metadata：長度、fps、解析度，
+    以及送進 LLM 的關鍵幀摘要（平均取樣最多 VIDEO_METADATA_MAX_KEYFRAMES 張的 stamp / caption）。
+    """
+    keyframes = frames_summary or []
+    if len(keyframes) > VIDEO_METADATA_MAX_KEYFRAMES > 0:
+        step = len(keyframes) / VIDEO_METADATA_MAX_KEYFRAMES
+        keyframes = [keyframes[int(i * step)] for i in range(VIDEO_METADATA_MAX_KEYFRAMES)]
+    return {
+        "duration": video_info.get("duration"),
+        "fps": video_info.get("fps"),
+        "width": video_info.get("width"),
+        "height": video_info.get("height"),
+        "total_frames": video_info.get("total_frames"),
+        "keyframe_count": len(frames_summary or []),
+        "keyframes": [{"stamp": k.get("stamp"), "caption": k.get("caption")} for k in keyframes],
+    }
+
+# 一個 job 的所有事件摘要一次送進 encode（內部依 batch_size 切批），CPU 上省掉逐筆 forward 的固定開銷
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+
+
+def _embed_events(rag: RAGModel, events: List[Dict[str, Any]], batch_size: int = EMBEDDING_BATCH_SIZE) -> int:
+    """
+    為有 summary 的事件批次計算 embedding，寫入 event["embedding_b64"]
+    （float32 little-endian 的 base64，比 float list 的 JSON 小約 3 倍）。回傳計算的筆數。
+    """
+    targets = [e for e in events if e.get("summary")]
+    if not targets:
+        return 0
+    embeddings = rag.encode(
+        [f"passage: {e['summary']}" for e in targets],
+        batch_size=max(1, batch_size),
+        convert_to_numpy=True,
+    )
+    embeddings = np.asarray(embeddings, dtype="<f4")
+    for event, emb in zip(targets, embeddings):
+        event["embedding_b64"] = base64.b64encode(emb.tobytes()).decode("ascii")
+    return len(targets)
+
+
+def _restore_frames_checkpoint(checkpoint: JobCheckpoint, name: str) -> Optional[Dict[str, Any]]:
+    """讀回 frames / captions 階段的 checkpoint（格式同 select_frames_streaming 的回傳）。"""
+    with stage("checkpoint"):
+        data = checkpoint.load(name)
+        if data is None:
+            return None
+        try:
+            frames, extra = FrameBatch.from_bytes(data)
+        except Exception as e:
+            _dbg(f"checkpoint {name} 無法讀取，重新計算: {e}")
+            return None
+    thumbnail_b64 = extra.get("thumbnail_b64")
+    _dbg(f"resumed from checkpoint '{name}': {frames.summary()}")
+    return {
+        "video_info": extra.get("video_info") or {},
+        "frames": frames,
+        "thumbnail_jpeg": base64.b64decode(thumbnail_b64) if thumbnail_b64 else None,
+    }
+
+
+def _save_frames_checkpoint(checkpoint: JobCheckpoint, name: str, reply: Dict[str, Any]) -> None:
+    if not checkpoint.enabled:
+        return
+    thumbnail_jpeg = reply.get("thumbnail_jpeg")
+    extra = {
+        "video_info": reply["video_info"],
+        "thumbnail_b64": base64.b64encode(thumbnail_jpeg).decode("ascii") if thumbnail_jpeg else None,
+    }
+    with stage("checkpoint"):
+        checkpoint.save(name, reply["frames"].to_bytes(extra))
+
+
+def _run_front_stages(job: dict, checkpoint: Optional[JobCheckpoint] = None) -> Dict[str, Any]:
+    """
+    前段（step 1~7）：串流取幀、模糊度 / 幀差過濾、caption。
+    回傳 {"video_info", "frames"（FrameBatch）, "thumbnail_jpeg", "checkpoint"}；caption 完成後影像緩衝區已釋放，可安全交給後段。
+    checkpoint 有 captions / frames 階段時直接從該階段之後繼續。
+    """
+    _dbg(f"job received: {json.dumps(job) if isinstance(job, dict) else str(job)}")
+    if checkpoint is None:
+        checkpoint = JobCheckpoint(None)
+    checkpoint.stats["attempt"] = int(job.get("attempt", 0) or 0)
+    params = job.get("params", {})
+
+    reply = _restore_frames_checkpoint(checkpoint, "captions")
+    if reply is not None:
+        reply["video_info"]["checkpoint"] = checkpoint.stats
+        reply["recorder"] = current_recorder()
+        reply["checkpoint"] = checkpoint
+        return reply
+
+    reply = _restore_frames_checkpoint(checkpoint, "frames")
+    if reply is None:
+        reply = _select_frames_for_job(job)
+        _save_frames_checkpoint(checkpoint, "frames", reply)
+    video_info = reply["video_info"]
+    thumbnail_jpeg = reply["thumbnail_jpeg"]
+    reply = reply["frames"]
+
+    # === Step 5.5: 人物 / 活動預偵測（預設關閉），沒有活動的候選幀不送 VLM ===
+    min_foreground = params.get("activity_min_foreground")
+    reply = pre_detect_activity(
+        reply,
+        detector=str(params.get("activity_detector") or ACTIVITY_DETECTOR).lower(),
+        min_foreground=float(min_foreground) if min_foreground is not None else ACTIVITY_MIN_FOREGROUND,
+        video_info=video_info,
+    )
+
+    # === Step 6~7: Caption ===
+    cache_radius = params.get("caption_cache_radius")
+    reply = img_captioning(
+        reply,
+        video_info=video_info,
+        camera_id=params.get("camera_id"),
+        cache_radius=int(cache_radius) if cache_radius is not None else None,
+    )
+    _save_frames_checkpoint(checkpoint, "captions", {
+        "video_info": video_info, "frames": reply, "thumbnail_jpeg": thumbnail_jpeg,
+    })
+    video_info["checkpoint"] = checkpoint.stats
+    return {
+        "video_info": video_info,
+        "frames": reply,
+        "thumbnail_jpeg": thumbnail_jpeg,
+        "recorder": current_recorder(),  # 後段在別的 thread 跑時接著記到同一個 job
+        "checkpoint": checkpoint,
+    }
+
+
+def _select_frames_for_job(job: dict) -> Dict[str, Any]:
+    # === Step 1~5: 串流取幀 + 模糊度過濾 + 幀差過濾 ===
+    # 逐幀評分，只有會被送去 caption 的幀保留影像（記憶體不隨影片長度成長）
+    params = job.get("params", {})
+    return select_frames_streaming(
+        video_url=job.get("input_url", ""),
+        target_fps=int(params.get("target_fps", 3)),
+        blur_threshold=float(params.get("blur_threshold", 20.0)),
+        difference_threshold=float(params.get("difference_threshold", 0.8)),
+        compression_proportion=float(params.get("compression_proportion", 0.5)),
+        module=params.get("difference_module", "SSIM"),
+        frame_source=str(params.get("frame_source", "opencv")),
+        analysis_width=int(params.get("analysis_width", 0) or 0),
+        pregate_mse=float(params.get("ssim_pregate_mse", 0.0) or 0.0),
+        adaptive_min_fps=float(params.get("adaptive_min_fps", 0.5) or 0.5),
+        adaptive_motion_threshold=float(params.get("adaptive_motion_threshold", 4.0) or 4.0),
+    )
+
+
+def video_description_extraction_main(job: dict, front: Optional[Dict[str, Any]] = None):
     """
     step 1 : 從 job 取得 video_url
-    step 2 : 將影片讀取至記憶體 (opencv)，並壓縮大小(先略過，等後續優化)
+    step 2 : 以串流方式逐幀解碼 (opencv)，不把整段影片讀進記憶體
     step 3 : 將影片分割成幀(抽幀，3秒一幀)，並做成 {"stamp": "幀的相對時間", "frame": 幀圖片} 的dict格式
     step 4 : 去除資訊量過低的幀(模糊的、單色無明顯邊緣的)
-    step 5 : 將幀與上一步的幀做差異比對，過濾掉與前一幀差異過小的幀 (先略過，等後續優化)
+    step 5 : 將幀與上一步的幀做差異比對，過濾掉與前一幀差異過小的幀
+             (step 2~5 由 select_frames_streaming 逐幀完成，未入選 caption 的幀立即釋放影像)
     step 6 : 透過 MDL.BLIPImageCaptioner載入Captioner Model
     step 7 : 將剩餘的幀送入Captioner Model，取得每一幀的描述
     step 8 : 將每一幀的描述與時間戳放入prompt中，組成完整的prompt
     step 9 : 將prompt送入 LLM（使用 Schema 規範輸出），取得最終的描述
     step 10: 將結果整理成對應格式，呼叫API Server，讓結果存入資料庫
-    (感覺缺了一個模型存活時間控管的模塊，需要研究如何讓有任務的狀態下不重複載入模型，直到所有任務做完後1分鐘再釋放模型記憶體)
+    (模型存活時間由 libs.model_registry 控管：有任務時保持載入，閒置超過 MODEL_IDLE_TTL（預設 60 秒）後釋放)
+
+    step 1~7 為 CPU 密集的前段（_run_front_stages），step 8~10 主要在等網路（LLM / API）；
+    front 有值時表示前段已經跑完，直接從 step 8 繼續（VIDEO_TAIL_ASYNC 模式用）。
 
+    各階段（frames / captions / llm / embeddings）完成後寫入 libs.job_checkpoint；
+    同一個 job 重跑時從第一個還沒完成的階段繼續。
     """
     try:
-        _dbg(f"job received: {json.dumps(job) if isinstance(job, dict) else str(job)}")
-        # === Step 1~3: 取幀 ===
-        reply = get_video_frames_fast(
-            video_url=job.get("input_url", ""),
-            target_fps=int(job.get("params", {}).get("target_fps", 3))
-        )
-        video_info = reply["video_info"]
-        frames = reply["frames"]
-
-        # === Step 4: 模糊度過濾 ===
-        reply = analyze_blur(
-            frames_dicts=frames,
-            threshold=float(job.get("params", {}).get("blur_threshold", 20.0))
-        )
-
-        # === Step 5: 幀差過濾 ===
-        reply = filter_by_frame_difference(
-            frames_dicts=reply,
-            threshold=float(job.get("params", {}).get("difference_threshold", 0.8)),
-            compression_proportion=float(job.get("params", {}).get("compression_proportion", 0.5)),
-            module=job.get("params", {}).get("difference_module", "SSIM")
-        )
-
-        # === Step 6~7: Caption ===
-        reply = img_captioning(reply)
+        if front is None:
+            front = _run_front_stages(job, JobCheckpoint.for_job(job))
+        video_info = front["video_info"]
+        thumbnail_jpeg = front["thumbnail_jpeg"]
+        reply = front["frames"]
+        checkpoint = front.get("checkpoint") or JobCheckpoint(None)
 
         # === Step 8~9: LLM ===
-        # 從 job params 中獲取 Google API Key（如果有的話）
-        google_api_key = job.get("params", {}).get("google_api_key")
-        llm_result, frames_summary, llm_usage = llm_processing(reply, api_key=google_api_key)
+        llm_checkpoint = checkpoint.load_json("llm")
+        if llm_checkpoint is not None:
+            llm_result = llm_checkpoint["llm_result"]
+            frames_summary = llm_checkpoint["frames_summary"]
+            llm_usage = llm_checkpoint["llm_usage"]
+        else:
+            # 從 job params 中獲取 Google API Key（如果有的話）
+            google_api_key = job.get("params", {}).get("google_api_key")
+            with stage("llm") as llm_stage:
+                llm_result, frames_summary, llm_usage = llm_processing(reply, api_key=google_api_key)
+                llm_stage.add_items(len(frames_summary) if isinstance(frames_summary, list) else 0)
+            checkpoint.save_json("llm", {
+                "llm_result": llm_result, "frames_summary": frames_summary, "llm_usage": llm_usage,
+            })
 
         # 安全檢查：frames_summary 必須存在且非空，否則無法做 index→秒
         if not isinstance(frames_summary, list) or len(frames_summary) == 0:
@@ -1318,19 +2120,22 @@ def video_description_extraction_main(job: dict):
                 raw_llm=llm_result
             )
 
-        # === 強制用 index→秒數映射，完全忽略任何 start_time/end_time ===
-        events, clamp_count = _build_events_from_llm_by_index(llm_result, frames_summary)
+        embeddings_checkpoint = checkpoint.load_json("embeddings")
+        if embeddings_checkpoint is not None:
+            events = embeddings_checkpoint["events"]
+            clamp_count = embeddings_checkpoint["clamp_count"]
+        else:
+            # === 強制用 index→秒數映射，完全忽略任何 start_time/end_time ===
+            events, clamp_count = _build_events_from_llm_by_index(llm_result, frames_summary)
 
-        # === Calculate Embeddings (Added) ===
-        try:
-            rag = RAGModel.get_instance()
-            for event in events:
-                summary_text = event.get("summary", "")
-                if summary_text:
-                    emb = rag.encode([f"passage: {summary_text}"])[0]
-                    event["embedding"] = emb.tolist()
-        except Exception as e:
-            _dbg(f"Embedding calculation failed: {e}")
+            # === Calculate Embeddings (Added) ===
+            try:
+                with stage("embedding", items=len(events)), RAGModel.use() as rag:
+                    _embed_events(rag, events)
+                if events:
+                    checkpoint.save_json("embeddings", {"events": events, "clamp_count": clamp_count})
+            except Exception as e:
+                _dbg(f"Embedding calculation failed: {e}")
 
         if not events:
             return _make_failed_jobresult(
@@ -1352,28 +2157,35 @@ def video_description_extraction_main(job: dict):
                 jr["metrics"]["llm_prompt_tokens"] = int(llm_usage.get("prompt_tokens") or 0)
                 jr["metrics"]["llm_completion_tokens"] = int(llm_usage.get("completion_tokens") or 0)
                 jr["metrics"]["llm_total_tokens"] = int(llm_usage.get("total_tokens") or 0)
+                # 命中 LLM 快取時 token 為 0；cached_total_tokens 是當初實際呼叫的用量（估算省下多少）
+                jr["metrics"]["llm_cached"] = bool(llm_usage.get("cached"))
+                jr["metrics"]["llm_cached_total_tokens"] = int(llm_usage.get("cached_total_tokens") or 0)
+                # prompt 壓縮效果（估計值）：幀數 → 合併後組數、估計 input tokens 前後
+                for key in ("prompt_frames", "prompt_groups", "prompt_tokens_est_before", "prompt_tokens_est_after"):
+                    jr["metrics"][f"llm_{key}"] = llm_usage.get(key)
                 # 供 API Server 記錄使用的模型資訊
                 jr["metrics"]["llm_provider"] = "google"
                 jr["metrics"]["llm_model"] = os.getenv("GEMINI_MODEL_NAME", "gemini-2.5-flash-lite")
 
-        # ====== 影片完成後立刻生成縮圖（併入 videosprocessing；不再依賴 thumbnail_tasks）======
-        try:
-            params = job.get("params", {}) if isinstance(job, dict) else {}
-            recording_id = params.get("video_id") or params.get("recording_id") or job.get("video_id") or job.get("recording_id")
-            user_id = params.get("user_id") or job.get("user_id")
-            input_url = job.get("input_url", "")
-
-            # 僅在必要資訊齊全、且已抽到幀的情況下生成縮圖
-            if recording_id and user_id and isinstance(frames, list) and len(frames) > 0:
-                # 直接用記憶體裡的第一張幀（已在本任務讀取/解碼）
-                first_frame = frames[0].get("frame") if isinstance(frames[0], dict) else None
-                jpeg_bytes = _frame_to_thumbnail_jpeg_bytes(first_frame)
-                if jpeg_bytes:
+        # ====== 縮圖與影片 metadata：直接取自本任務的解碼，隨 JobResult 一次回傳 ======
+        # API Server 收到 thumbnail_s3_key 就直接寫入 recordings；沒有時才退回 tasks.generate_video_thumbnail
+        if isinstance(jr.get("metrics"), dict):
+            jr["metrics"]["video_metadata"] = _build_video_metadata(video_info, frames_summary)
+            try:
+                params = job.get("params", {}) if isinstance(job, dict) else {}
+                recording_id = params.get("video_id") or params.get("recording_id") or job.get("video_id") or job.get("recording_id")
+                user_id = params.get("user_id") or job.get("user_id")
+                input_url = job.get("input_url", "")
+
+                # 僅在必要資訊齊全、且已抽到幀的情況下上傳（縮圖由串流取幀的第一張幀產生）
+                if recording_id and user_id and thumbnail_jpeg:
                     thumb_key = _build_thumbnail_object_key(int(user_id), str(input_url), str(recording_id))
-                    if _upload_thumbnail_bytes_to_s3(jpeg_bytes, thumb_key):
-                        _update_recording_thumbnail_via_api(str(recording_id), thumb_key)
-        except Exception as e:
-            _dbg(f"[Thumbnail Inline] failed: {e}")
+                    with stage("thumbnail_upload", items=1):
+                        uploaded = _upload_thumbnail_bytes_to_s3(thumbnail_jpeg, thumb_key)
+                    if uploaded:
+                        jr["metrics"]["thumbnail_s3_key"] = thumb_key
+            except Exception as e:
+                _dbg(f"[Thumbnail Inline] failed: {e}")
 
         return jr
 
@@ -1401,11 +2213,15 @@ headers = {
     "Content-Type": "application/json"
 }
 
-@app.task(name="tasks.video_description_extraction", bind=True, acks_late=True)
-def video_description_extraction(self, job: dict):
-    start_time = time.time()
+# VIDEO_TAIL_ASYNC=1：前段（解碼 + caption）在 task 內同步跑完後，後段（LLM + embedding + 回呼 API）
+# 交給背景 thread，task 立即返回讓 worker 接下一個片段；在途後段數由 VIDEO_TAIL_MAX_INFLIGHT 限制。
+# 注意：此模式下 task 在前段完成後就 ack，後段若在 worker 被強制終止時仍未完成，結果會遺失。
+VIDEO_TAIL_ASYNC = os.getenv("VIDEO_TAIL_ASYNC", "0").lower() in ("1", "true", "yes", "on")
+
+
+def _post_job_result(job: dict, reply: dict, start_time: float):
+    """把 JobResult 回呼給 API Server（/jobs/{id}/complete）。"""
     try:
-        reply = video_description_extraction_main(job)
         end_time = time.time()
         duration = end_time - start_time
         reply["duration"] = duration
@@ -1415,12 +2231,13 @@ def video_description_extraction(self, job: dict):
         _dbg(f"Posting result to {API_SERVER_URL}/jobs/{job.get('job_id', '?')}/complete")
         _dbg(f"Result: {json.dumps(reply) if isinstance(reply, dict) else str(reply)}")
         try:
-            response = requests.post(
-                f"{API_SERVER_URL}/jobs/{job.get('job_id', '?')}/complete",
-                headers=headers,
-                json=reply,
-                timeout=30
-            )
+            with stage("api_callback", items=1):
+                response = requests.post(
+                    f"{API_SERVER_URL}/jobs/{job.get('job_id', '?')}/complete",
+                    headers=headers,
+                    json=reply,
+                    timeout=30
+                )
             response.raise_for_status()
             return response.json()
         
@@ -1441,8 +2258,80 @@ def video_description_extraction(self, job: dict):
                 "error_message": f"{str(e)}; body={err_body}" if err_body else str(e)
             }
     finally:
+        push_metrics()
         # 任務完成後強制清理記憶體
         gc.collect()
         if torch.cuda.is_available():
             torch.cuda.empty_cache()
 
+
+# 可重試的失敗（soft time limit、LLM 多次失敗…）不直接回報，改為重新排入同一個 job；
+# 重跑時依 checkpoint 從第一個沒完成的階段繼續。job["attempt"] 記錄第幾次重試。
+# 解碼 / presign 等確定性的失敗重跑也一樣，不列入預設的 VIDEO_JOB_RETRY_ON。
+# worker 只吃 -Q default，重新排入時要指定同一個 queue，否則會落到 Celery 內建的 "celery" queue 沒人處理。
+VIDEO_JOB_MAX_RETRIES = int(os.getenv("VIDEO_JOB_MAX_RETRIES", "1"))
+VIDEO_JOB_RETRY_DELAY = int(os.getenv("VIDEO_JOB_RETRY_DELAY", "30"))
+VIDEO_JOB_RETRY_QUEUE = os.getenv("CELERY_DEFAULT_QUEUE", "default")
+VIDEO_JOB_RETRY_ON = {
+    code.strip() for code in os.getenv("VIDEO_JOB_RETRY_ON", "SoftTimeLimitExceeded,LLMRetryExhausted").split(",") if code.strip()
+}
+
+
+def _finish_job(job: dict, reply: dict, start_time: float):
+    """重新排入可重試的失敗（保留 checkpoint）；其餘回呼 API Server，送出成功後清掉 checkpoint。"""
+    attempt = int(job.get("attempt", 0) or 0)
+    if (reply.get("status") == "failed" and reply.get("error_code") in VIDEO_JOB_RETRY_ON
+            and attempt < VIDEO_JOB_MAX_RETRIES and job.get("job_id")):
+        print(f"[VideoJob] job {job.get('job_id')} 失敗（{reply.get('error_code')}），"
+              f"{VIDEO_JOB_RETRY_DELAY}s 後第 {attempt + 1} 次重試")
+        video_description_extraction.apply_async(
+            args=[dict(job, attempt=attempt + 1)],
+            countdown=VIDEO_JOB_RETRY_DELAY,
+            queue=VIDEO_JOB_RETRY_QUEUE,
+        )
+        push_metrics()
+        return {
+            "job_id": job.get("job_id", "?"),
+            "trace_id": job.get("trace_id"),
+            "status": "retry_queued",
+            "attempt": attempt + 1,
+        }
+    result = _post_job_result(job, reply, start_time)
+    if not (isinstance(result, dict) and result.get("error_code") == "API_CALL_FAILED"):
+        JobCheckpoint.for_job(job).clear()
+    return result
+
+
+def _run_tail_and_post(job: dict, front: Dict[str, Any], start_time: float):
+    """背景後段：LLM + embedding + 回呼 API（job / front 都是這個 job 自己的物件）。"""
+    with recording(front.get("recorder") or StageRecorder()):
+        reply = video_description_extraction_main(job, front=front)
+        return _finish_job(job, reply, start_time)
+
+
+@app.task(name="tasks.video_description_extraction", bind=True, acks_late=True)
+def video_description_extraction(self, job: dict):
+    start_time = time.time()
+    if not VIDEO_TAIL_ASYNC:
+        with recording(StageRecorder()):
+            reply = video_description_extraction_main(job)
+            return _finish_job(job, reply, start_time)
+
+    try:
+        with recording(StageRecorder()):
+            front = _run_front_stages(job, JobCheckpoint.for_job(job))
+    except Exception as e:
+        reply = _make_failed_jobresult(
+            job, None,
+            code=getattr(e, "__class__", type(e)).__name__,
+            message=str(e)
+        )
+        return _finish_job(job, reply, start_time)
+
+    # 在途後段已達上限時會在這裡等待（背壓），避免前段無限制地往前跑
+    get_stage_executor("video-tail").submit(_run_tail_and_post, job, front, start_time)
+    return {
+        "job_id": job.get("job_id", "?"),
+        "trace_id": job.get("trace_id"),
+        "status": "tail_queued",
+    }
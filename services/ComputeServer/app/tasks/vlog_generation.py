@@ -3,6 +3,7 @@ Vlog 生成任務
 處理視頻剪輯、合併、轉碼等操作
 """
 import os
+import re
 import logging
 import gc
 from typing import List, Dict, Any, Tuple, Callable
@@ -15,6 +16,7 @@ import tempfile
 import subprocess
 import requests
 import shutil
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 
 # 設置日誌
 logger = logging.getLogger(__name__)
@@ -47,6 +49,37 @@ MAX_SEGMENT_DURATION = float(os.getenv("VLOG_MAX_SEGMENT_DURATION", "6"))  # 每
 MIN_SEGMENT_DURATION = float(os.getenv("VLOG_MIN_SEGMENT_DURATION", "1"))
 MERGE_GAP_THRESHOLD = float(os.getenv("VLOG_MERGE_GAP_THRESHOLD", "0.3"))  # 合併間隔閾值（秒）
 
+# 片段下載 / 剪輯並行度（下載吃網路、剪輯吃 CPU，分開設定）
+VLOG_DOWNLOAD_WORKERS = int(os.getenv("VLOG_DOWNLOAD_WORKERS", "4"))
+VLOG_ENCODE_WORKERS = int(os.getenv("VLOG_ENCODE_WORKERS", "0")) or max(1, (os.cpu_count() or 1) // 2)
+# seek：本機沒有副本時把 presigned URL 直接交給 ffmpeg（只讀需要的 byte range）；download：整檔下載後再剪
+VLOG_CLIP_MODE = os.getenv("VLOG_CLIP_MODE", "seek").lower()
+VLOG_SEEK_TIMEOUT_US = int(float(os.getenv("VLOG_SEEK_TIMEOUT", "30")) * 1_000_000)  # ffmpeg -rw_timeout（微秒）
+# single：一次 ffmpeg filter graph 完成剪輯 + 串接 + 背景音樂（失敗時退回 multi）；multi：逐段剪輯 → concat → 音樂
+# 未設定時：剪輯片段快取啟用就用 multi（只有逐段流程會寫入 / 重用快取），否則用 single
+VLOG_RENDER_MODE = os.getenv("VLOG_RENDER_MODE", "").lower()
+VLOG_RENDER_MAX_INPUTS = int(os.getenv("VLOG_RENDER_MAX_INPUTS", "64"))  # 片段數超過時直接走 multi
+# 剪輯片段快取（libs.clip_cache）中已有這個比例以上的片段時，single 改走 multi，直接重用快取的片段
+VLOG_CLIP_CACHE_REUSE_RATIO = float(os.getenv("VLOG_CLIP_CACHE_REUSE_RATIO", "0.5"))
+
+# 逐段剪輯的編碼參數（也是剪輯片段快取 key 的一部分，改參數時舊的快取自然失效）
+CLIP_ENCODER_ARGS = ['-c:v', 'libx264', '-preset', 'medium', '-crf', '23']
+_RESOLUTION_SCALES = {
+    '480p': '854:480',
+    '720p': '1280:720',
+    '1080p': '1920:1080'
+}
+
+
+def _resolution_scale(settings: Dict[str, Any]) -> str:
+    return _RESOLUTION_SCALES.get((settings or {}).get('resolution', '1080p'), '1280:720')
+
+
+def _segment_cache_key(segment: Dict[str, Any], scale: str) -> str:
+    from ..libs.clip_cache import clip_cache_key
+    return clip_cache_key(segment["bucket"], segment["object_name"], segment["clip_start"],
+                          segment["clip_duration"], scale, " ".join(CLIP_ENCODER_ARGS + ['-an']))
+
 
 def _update_vlog_status(
     vlog_id: str,
@@ -59,6 +92,7 @@ def _update_vlog_status(
     status_message: str | None = None,
     error_message: str | None = None,
     job_id: str | None = None,
+    metrics: Dict[str, Any] | None = None,
 ):
     """調用 API 更新 Vlog 狀態。
     
@@ -72,6 +106,7 @@ def _update_vlog_status(
         status_message: 狀態訊息
         error_message: 錯誤訊息
         job_id: inference_jobs ID（用於同步更新）
+        metrics: 合併進 inference_jobs.metrics 的統計（剪輯片段快取命中率、傳輸量等）
     """
     url = f"{API_BASE_URL}/vlogs/internal/{vlog_id}/status"
     payload: Dict[str, Any] = {}
@@ -91,6 +126,8 @@ def _update_vlog_status(
         payload["error_message"] = error_message
     if job_id is not None:
         payload["job_id"] = job_id
+    if metrics:
+        payload["metrics"] = metrics
 
     if not payload:
         return
@@ -1100,43 +1137,89 @@ def generate_vlog(
                     message += "（跳過）"
                 set_progress(progress_value, message)
 
-            clipped_videos = _download_and_clip_segments(
-                video_segments,
-                temp_dir,
-                settings or {},
-                progress_callback=segment_progress
-            )
+            clip_stats: Dict[str, Any] = {}
+            output_path = os.path.join(temp_dir, f"vlog_{vlog_id}.mp4")
+            final_duration = None
+            render_mode = str((settings or {}).get("render_mode") or VLOG_RENDER_MODE).lower()
+            if not render_mode:
+                from ..libs.clip_cache import clip_cache_enabled
+                render_mode = "multi" if clip_cache_enabled() else "single"
+            if render_mode == "single":
+                # 重新生成時多數片段通常已在剪輯片段快取裡，逐段流程可直接重用、不必重新編碼
+                from ..libs.clip_cache import cached_clip_ratio
+                scale = _resolution_scale(settings or {})
+                reuse_ratio = cached_clip_ratio([_segment_cache_key(seg, scale) for seg in video_segments])
+                if reuse_ratio >= VLOG_CLIP_CACHE_REUSE_RATIO:
+                    logger.info(f"[Vlog] 剪輯片段快取已有 {reuse_ratio:.0%} 的片段，改用逐段流程重用快取")
+                    render_mode = "multi"
+            if render_mode == "single":
+                # 一次 ffmpeg 完成剪輯 + 縮放 + 串接 + 背景音樂；失敗時退回下面的逐段流程
+                last_reported = {"value": -1.0}
+
+                def render_progress(fraction: float):
+                    percent = round(fraction * 100.0)
+                    if percent - last_reported["value"] < 2:
+                        return
+                    last_reported["value"] = percent
+                    set_progress(10.0 + 78.0 * fraction, f"渲染 Vlog 中 {percent:.0f}%")
+
+                try:
+                    final_duration = _render_vlog_single_pass(
+                        video_segments,
+                        temp_dir,
+                        output_path,
+                        settings or {},
+                        progress_callback=render_progress,
+                        stats=clip_stats,
+                    )
+                    final_video_path = output_path
+                except SoftTimeLimitExceeded:
+                    # 逾時不退回逐段流程（只會被硬性時限砍掉），交給外層標記失敗
+                    raise
+                except Exception as exc:
+                    logger.warning(f"[Vlog] 單次渲染失敗，改用逐段剪輯 + 合併: {type(exc).__name__}: {exc}")
+                    clip_stats = {"render_fallback": f"{type(exc).__name__}: {exc}"}
+                    set_progress(10.0, "改用逐段剪輯")
+
+            if final_duration is None:
+                clip_stats["render_mode"] = "multi"
+                clipped_videos = _download_and_clip_segments(
+                    video_segments,
+                    temp_dir,
+                    settings or {},
+                    progress_callback=segment_progress,
+                    stats=clip_stats,
+                )
             
-            # 清理不再需要的片段資訊
-            del video_segments
-            gc.collect()
+                # 清理不再需要的片段資訊
+                del video_segments
+                gc.collect()
             
-            if not clipped_videos:
-                 raise ValueError("視頻剪輯失敗，沒有生成任何片段")
+                if not clipped_videos:
+                     raise ValueError("視頻剪輯失敗，沒有生成任何片段")
 
-            # 合併視頻片段
-            output_path = os.path.join(temp_dir, f"vlog_{vlog_id}.mp4")
-            set_progress(80.0, "剪輯完成，開始合併影片")
-            final_duration = _merge_videos(clipped_videos, output_path, settings or {})
+                # 合併視頻片段
+                set_progress(80.0, "剪輯完成，開始合併影片")
+                final_duration = _merge_videos(clipped_videos, output_path, settings or {})
             
-            # 清理剪輯後的視頻列表（文件仍在，但列表可以釋放）
-            del clipped_videos
-            gc.collect()
+                # 清理剪輯後的視頻列表（文件仍在，但列表可以釋放）
+                del clipped_videos
+                gc.collect()
             
-            # 保存最終影片路徑（用於縮圖生成）
-            final_video_path = output_path
+                # 保存最終影片路徑（用於縮圖生成）
+                final_video_path = output_path
             
-            try:
-                output_path = _apply_music_track(output_path, temp_dir, settings or {})
-                # 如果音樂處理成功，更新最終影片路徑
-                if output_path and os.path.exists(output_path):
+                try:
+                    output_path = _apply_music_track(output_path, temp_dir, settings or {})
+                    # 如果音樂處理成功，更新最終影片路徑
+                    if output_path and os.path.exists(output_path):
+                        final_video_path = output_path
+                    # 音樂處理完成後清理記憶體
+                    gc.collect()
+                except Exception as exc:
+                    logger.error(f"[Vlog] 套用背景音樂失敗: {exc}，使用原始影片")
+                    # 如果音樂處理失敗，使用原始合併的影片
                     final_video_path = output_path
-                # 音樂處理完成後清理記憶體
-                gc.collect()
-            except Exception as exc:
-                logger.error(f"[Vlog] 套用背景音樂失敗: {exc}，使用原始影片")
-                # 如果音樂處理失敗，使用原始合併的影片
-                final_video_path = output_path
             
             # 確保最終影片文件存在
             if not os.path.exists(final_video_path):
@@ -1189,7 +1272,8 @@ def generate_vlog(
                 duration=final_duration,
                 progress=100.0,
                 status_message="Vlog 生成完成",
-                thumbnail_s3_key=thumbnail_s3_key
+                thumbnail_s3_key=thumbnail_s3_key,
+                metrics={"vlog_render": clip_stats},
             )
             
             logger.info(f"[Vlog] Vlog 生成成功: {vlog_id}, 影片: {object_name}, 縮圖: {thumbnail_s3_key or '無'}")
@@ -1198,7 +1282,8 @@ def generate_vlog(
                 "vlog_id": vlog_id,
                 "s3_key": object_name,
                 "duration": final_duration,
-                "status": "success"
+                "status": "success",
+                "segment_stats": clip_stats,
             }
             
         finally:
@@ -1240,129 +1325,499 @@ def generate_vlog(
         raise
 
 
+def _log_segment_error(idx: int, segment: Dict[str, Any], exc: Exception) -> None:
+    error_type = type(exc).__name__
+    error_msg = str(exc)
+    logger.error(f"[Vlog] 處理片段 {idx} (event {segment.get('event_id')}) 時出錯: {error_type}: {error_msg}")
+    logger.error(f"[Vlog] 片段詳情: bucket={segment.get('bucket')}, object={segment.get('object_name')}, clip_start={segment.get('clip_start')}, clip_duration={segment.get('clip_duration')}")
+
+    # 如果是 S3 錯誤，提供更詳細的信息
+    if "NoSuchKey" in error_msg or "Object does not exist" in error_msg:
+        logger.error(f"[Vlog] S3 物件不存在，可能原因：")
+        logger.error(f"[Vlog]   1. 影片檔案已被刪除")
+        logger.error(f"[Vlog]   2. 資料庫中的 s3_key 與實際 S3 檔案不一致")
+        logger.error(f"[Vlog]   3. 檔案上傳失敗但事件記錄已建立")
+
+
+def _fetch_segment_source(source_idx: int, bucket: str, object_name: str, temp_dir: str) -> Tuple[str, str]:
+    """取得原始錄影的本機路徑（同一段錄影在本節點只會下載一次）。"""
+    from ..libs.storage import fetch_object
+
+    # 本機快取停用時會下載到 fallback_dir；每個來源各用一個子目錄，
+    # 避免同一個下載 thread 接著下載的檔案覆蓋到還在剪輯中的輸入
+    fallback_dir = os.path.join(temp_dir, f"source_{source_idx}")
+    os.makedirs(fallback_dir, exist_ok=True)
+    return fetch_object(bucket, object_name, fallback_dir=fallback_dir)
+
+
+def _resolve_segment_source(source_idx: int, bucket: str, object_name: str, temp_dir: str,
+                            clip_mode: str) -> Tuple[str, str, int]:
+    """
+    決定片段要從哪裡讀，回傳 (路徑或 URL, source, 物件大小)。
+
+    clip_mode="seek"：本機已有副本（共享磁碟 / 節點快取）就直接用，否則回傳 presigned URL
+    （source="seek"），由 ffmpeg 以 HTTP Range 只讀 moov 與需要的 GOP；
+    clip_mode="download"：一律整檔取得（fetch_object）。
+    """
+    from ..libs.storage import local_object_path, object_size, presigned_object_url
+
+    if clip_mode == "seek":
+        local = local_object_path(bucket, object_name)
+        if local is not None:
+            return local[0], local[1], os.path.getsize(local[0])
+        size = object_size(bucket, object_name)  # 順便確認物件存在
+        return presigned_object_url(bucket, object_name), "seek", size
+    path, source = _fetch_segment_source(source_idx, bucket, object_name, temp_dir)
+    return path, source, os.path.getsize(path)
+
+
+_FFMPEG_BYTES_READ_RE = re.compile(r"Statistics: (\d+) bytes read")
+
+
+def _clip_segment(idx: int, segment: Dict[str, Any], input_path: str,
+                  temp_dir: str, scale: str, threads: int, over_http: bool = False,
+                  cache_key: str | None = None) -> Tuple[str, int]:
+    """
+    用 FFmpeg 剪出指定時間範圍並縮放，回傳 (輸出路徑, 從 HTTP 讀取的位元組數)。
+
+    over_http=True 時 input_path 是 presigned URL：-ss 放在 -i 前面做 input seeking，
+    ffmpeg 只會以 Range 請求讀需要的部分；以 verbose log 的 "Statistics: N bytes read" 統計實際傳輸量。
+    cache_key 有給時，剪好的片段寫入剪輯片段快取（libs.clip_cache）。
+    """
+    output_path = os.path.join(temp_dir, f"clip_{idx}.mp4")
+    # FFmpeg 命令：移除原始音軌（-an），只保留影像
+    cmd = ['ffmpeg', '-y']
+    if over_http:
+        cmd += ['-v', 'verbose', '-rw_timeout', str(VLOG_SEEK_TIMEOUT_US)]
+    cmd += [
+        '-ss', str(segment['clip_start']),
+        '-i', input_path,
+        '-t', str(segment['clip_duration']),
+        '-vf', f'scale={scale}',
+        *CLIP_ENCODER_ARGS,
+        '-threads', str(threads),
+        '-an',  # 刪除原始音軌
+        output_path
+    ]
+    proc = subprocess.run(cmd, check=True, capture_output=True)
+    if cache_key:
+        from ..libs.clip_cache import store_clip
+        store_clip(cache_key, output_path)
+    bytes_read = 0
+    if over_http:
+        bytes_read = sum(int(n) for n in _FFMPEG_BYTES_READ_RE.findall(proc.stderr.decode("utf-8", "replace")))
+    return output_path, bytes_read
+
+
 def _download_and_clip_segments(
     segments: List[Dict[str, Any]], 
     temp_dir: str, 
     settings: Dict[str, Any],
     progress_callback: Callable[[int, int, bool], None] | None = None,
+    stats: Dict[str, Any] | None = None,
 ) -> List[str]:
     """下載並剪輯視頻片段。
     
-    從 MinIO 下載視頻，使用 FFmpeg 剪輯指定時間範圍的片段。
+    透過 libs.storage 取得原始視頻的本機路徑（共享磁碟 / 節點快取 / MinIO 整檔下載），
+    使用 FFmpeg 剪輯指定時間範圍的片段。
+    
+    片段先依 (bucket, object_name) 分組：同一段錄影只取得一次，所有片段都從同一份本機檔剪出，
+    下載到任務暫存目錄的檔案在最後一個片段剪完（或失敗）後才刪除。
+    
+    剪輯片段快取（libs.clip_cache，key 為 錄影 / 起點 / 長度 / 解析度 / 編碼參數）啟用時，
+    先把命中的片段直接放進暫存目錄，只有沒命中的片段才需要取得來源與編碼；剪好的片段再寫回快取。
+    
+    clip_mode（settings["clip_mode"]，預設 VLOG_CLIP_MODE）為 "seek" 時，本機沒有副本的錄影
+    不整檔下載，直接把 presigned URL 交給 ffmpeg 做 input seeking（錄影是 +faststart，
+    只會讀 moov 與需要的 GOP）；某段錄影 seek 剪輯失敗時，改為整檔下載後重剪該錄影失敗的片段。
+    
+    下載與剪輯分別在兩個有上限的 thread pool 上跑（VLOG_DOWNLOAD_WORKERS / VLOG_ENCODE_WORKERS），
+    片段下載完就直接排進剪輯 pool，不必等前一個片段編碼完。每個 FFmpeg 用
+    cpu_count / VLOG_ENCODE_WORKERS 個 thread，整體吃滿 CPU 而不過度搶核。
+    回傳的路徑一律依 segments 的原始順序排列（與完成順序無關）。
     
     Args:
         segments: 片段列表，每個包含 bucket, object_name, clip_start, clip_duration 等
         temp_dir: 臨時目錄
-        settings: 設定字典（resolution 等）
-        progress_callback: 可選的進度回調函數 (idx, total, success)
+        settings: 設定字典（resolution, clip_mode 等）
+        progress_callback: 可選的進度回調函數 (idx, total, success)；
+            在呼叫端的 thread 上、依完成順序呼叫，idx 為「已完成片段數 - 1」，因此進度單調遞增
+        stats: 有給時寫入 clip_mode / sources / source_fetches / seek_clips / seek_fallbacks /
+            bytes_downloaded（整檔下載）/ bytes_seeked（HTTP seek 讀取）/ bytes_transferred / bytes_saved
+            （bytes_saved = 每個片段各自整檔下載時的量 - bytes_transferred）、
+            clip_cache_lookups / clip_cache_hits / clip_cache_hit_ratio
     
     Returns:
-        List[str]: 剪輯後的視頻文件路徑列表
+        List[str]: 剪輯後的視頻文件路徑列表（依 segments 順序，失敗的片段略過）
     """
-    from minio import Minio
+    from ..libs.clip_cache import clip_cache_enabled, fetch_clip
+
+    clip_mode = str(settings.get('clip_mode') or VLOG_CLIP_MODE).lower()
+    if clip_mode not in ("seek", "download"):
+        logger.warning(f"[Vlog] 未知的 clip_mode={clip_mode}，改用 download")
+        clip_mode = "download"
     
-    client = Minio(
-        MINIO_ENDPOINT,
-        access_key=MINIO_ACCESS_KEY,
-        secret_key=MINIO_SECRET_KEY,
-        secure=MINIO_SECURE
-    )
+    # 解析解析度
+    scale = _resolution_scale(settings)
+    
+    total = len(segments)
+    encode_workers = max(1, min(VLOG_ENCODE_WORKERS, total or 1))
+    ffmpeg_threads = max(1, (os.cpu_count() or 1) // encode_workers)
+    results: Dict[int, str] = {}
+    completed = 0
+    # 來源 → [路徑或 URL, source, 尚未剪完的片段數]
+    sources: Dict[Tuple[str, str], list] = {}
+    # seek 失敗、等整檔下載完再重剪的片段
+    fallback_waiting: Dict[Tuple[str, str], List[int]] = {}
+    counters = {"source_fetches": 0, "seek_clips": 0, "seek_fallbacks": 0,
+                "bytes_downloaded": 0, "bytes_seeked": 0, "bytes_baseline": 0}
+
+    def report(success: bool):
+        nonlocal completed
+        completed += 1
+        # 每處理 5 個片段後進行一次垃圾回收
+        if completed % 5 == 0:
+            gc.collect()
+        if progress_callback:
+            try:
+                progress_callback(completed - 1, total, success)
+            except Exception as cb_err:
+                logger.debug(f"進度回調錯誤: {cb_err}")
+
+    def release_source(key: Tuple[str, str]):
+        entry = sources[key]
+        entry[2] -= 1
+        # 只刪除下載到任務暫存目錄的輸入文件；共享磁碟 / 節點快取的檔案留給其他任務
+        if entry[2] == 0 and entry[1] == "download":
+            try:
+                os.remove(entry[0])
+            except Exception as e:
+                logger.warning(f"刪除臨時輸入文件失敗: {e}")
+
+    def submit_clips(key: Tuple[str, str], members: List[int]):
+        input_path, input_source = sources[key][0], sources[key][1]
+        for idx in members:
+            clip_future = encode_pool.submit(
+                _clip_segment, idx, segments[idx], input_path, temp_dir, scale, ffmpeg_threads,
+                input_source == "seek", cache_keys.get(idx),
+            )
+            pending[clip_future] = ("clip", (idx, input_source))
+
+    # 先查剪輯片段快取：命中的片段不必取得來源、也不必編碼
+    cache_keys: Dict[int, str] = {}
+    if clip_cache_enabled():
+        cache_keys = {idx: _segment_cache_key(segment, scale) for idx, segment in enumerate(segments)}
+        with ThreadPoolExecutor(max_workers=max(1, min(VLOG_DOWNLOAD_WORKERS, total or 1)),
+                                thread_name_prefix="vlog-clip-cache") as pool:
+            hits = list(pool.map(
+                lambda idx: fetch_clip(cache_keys[idx], os.path.join(temp_dir, f"clip_{idx}.mp4")),
+                range(total),
+            ))
+        for idx, hit in enumerate(hits):
+            if hit:
+                results[idx] = os.path.join(temp_dir, f"clip_{idx}.mp4")
+                report(True)
+    cache_hits = len(results)
+
+    # 沒命中的片段依錄影分組（保留第一次出現的順序）
+    groups: Dict[Tuple[str, str], List[int]] = {}
+    for idx, segment in enumerate(segments):
+        if idx not in results:
+            groups.setdefault((segment["bucket"], segment["object_name"]), []).append(idx)
+    source_index = {key: i for i, key in enumerate(groups)}
+    download_workers = max(1, min(VLOG_DOWNLOAD_WORKERS, len(groups) or 1))
+
+    download_pool = ThreadPoolExecutor(max_workers=download_workers, thread_name_prefix="vlog-download")
+    encode_pool = ThreadPoolExecutor(max_workers=encode_workers, thread_name_prefix="vlog-encode")
+    try:
+        # future → (階段, 來源 key 或 (片段 idx, source))
+        pending: Dict[Future, Tuple[str, Any]] = {
+            download_pool.submit(_resolve_segment_source, source_index[key], key[0], key[1], temp_dir, clip_mode): ("resolve", key)
+            for key in groups
+        }
+        while pending:
+            done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+            for future in done:
+                phase, ref = pending.pop(future)
+                if phase == "resolve":
+                    key, members = ref, groups[ref]
+                    try:
+                        input_path, input_source, size = future.result()
+                    except Exception as stat_err:
+                        # 物件不存在時跳過這段錄影的所有片段
+                        error_msg = f"S3 物件不存在: bucket={key[0]}, object={key[1]}, event_ids={[segments[i].get('event_id') for i in members]}"
+                        logger.error(f"[Vlog] {error_msg}, 錯誤: {stat_err}")
+                        for _ in members:
+                            report(False)
+                        continue
+                    counters["bytes_baseline"] += size * len(members)
+                    if input_source in ("fetched", "download"):
+                        counters["source_fetches"] += 1
+                        counters["bytes_downloaded"] += size
+                    sources[key] = [input_path, input_source, len(members)]
+                    submit_clips(key, members)
+                elif phase == "fallback":
+                    key, waiting = ref, fallback_waiting.pop(ref)
+                    try:
+                        input_path, input_source = future.result()
+                    except Exception as e:
+                        for idx in waiting:
+                            _log_segment_error(idx, segments[idx], e)
+                            report(False)
+                            release_source(key)
+                        continue
+                    if input_source in ("fetched", "download"):
+                        counters["source_fetches"] += 1
+                        counters["bytes_downloaded"] += os.path.getsize(input_path)
+                    # 之後的片段都改讀本機檔；還在跑的 seek 剪輯不受影響
+                    sources[key][0], sources[key][1] = input_path, input_source
+                    submit_clips(key, waiting)
+                else:
+                    idx, input_source = ref
+                    segment = segments[idx]
+                    key = (segment["bucket"], segment["object_name"])
+                    try:
+                        results[idx], bytes_read = future.result()
+                    except Exception as e:
+                        if input_source == "seek":
+                            # seek 剪輯失敗 → 這段錄影改為整檔下載（每段錄影只觸發一次）
+                            logger.warning(f"[Vlog] 片段 {idx} seek 剪輯失敗，改為整檔下載: {type(e).__name__}: {e}")
+                            if key in fallback_waiting:
+                                fallback_waiting[key].append(idx)
+                            elif sources[key][1] != "seek":
+                                submit_clips(key, [idx])
+                            else:
+                                counters["seek_fallbacks"] += 1
+                                fallback_waiting[key] = [idx]
+                                fallback_future = download_pool.submit(
+                                    _fetch_segment_source, source_index[key], key[0], key[1], temp_dir,
+                                )
+                                pending[fallback_future] = ("fallback", key)
+                            continue
+                        _log_segment_error(idx, segment, e)
+                        report(False)
+                    else:
+                        if input_source == "seek":
+                            counters["seek_clips"] += 1
+                            counters["bytes_seeked"] += bytes_read
+                        report(True)
+                    release_source(key)
+    finally:
+        # 正常結束時兩個 pool 都已空；超時 / 例外時取消還沒開始的工作，不等執行中的 FFmpeg
+        download_pool.shutdown(wait=False, cancel_futures=True)
+        encode_pool.shutdown(wait=False, cancel_futures=True)
+    
+    bytes_transferred = counters["bytes_downloaded"] + counters["bytes_seeked"]
+    bytes_saved = max(0, counters["bytes_baseline"] - bytes_transferred)
+    cache_hit_ratio = (cache_hits / total) if cache_keys and total else 0.0
+    logger.info(f"[Vlog] 片段剪輯完成: {len(results)}/{total}（快取命中 {cache_hits}/{len(cache_keys)}，"
+                f"{len(groups)} 段錄影，clip_mode={clip_mode}，"
+                f"整檔下載 {counters['source_fetches']} 段 {counters['bytes_downloaded'] / 1024 / 1024:.1f} MB、"
+                f"seek {counters['seek_clips']} 個片段 {counters['bytes_seeked'] / 1024 / 1024:.1f} MB"
+                f"（退回整檔 {counters['seek_fallbacks']} 段），省下 {bytes_saved / 1024 / 1024:.1f} MB；"
+                f"下載 {download_workers} / 編碼 {encode_workers} workers，每個 FFmpeg {ffmpeg_threads} threads）")
+    if stats is not None:
+        stats.update({
+            "clip_mode": clip_mode,
+            "sources": len(groups),
+            "source_fetches": counters["source_fetches"],
+            "seek_clips": counters["seek_clips"],
+            "seek_fallbacks": counters["seek_fallbacks"],
+            "bytes_downloaded": counters["bytes_downloaded"],
+            "bytes_seeked": counters["bytes_seeked"],
+            "bytes_transferred": bytes_transferred,
+            "bytes_saved": bytes_saved,
+            "clip_cache_lookups": len(cache_keys),
+            "clip_cache_hits": cache_hits,
+            "clip_cache_hit_ratio": cache_hit_ratio,
+        })
+    # 所有片段處理完成後，進行最終垃圾回收
+    gc.collect()
+    return [results[idx] for idx in sorted(results)]
+
+
+_FFMPEG_OUT_TIME_RE = re.compile(r"^out_time_(?:us|ms)=(\d+)$")
+
+
+def _probe_duration(video_path: str) -> float:
+    """以 ffprobe 讀取容器時長（只讀 header，不解碼）。"""
+    duration_cmd = [
+        'ffprobe',
+        '-v', 'error',
+        '-show_entries', 'format=duration',
+        '-of', 'default=noprint_wrappers=1:nokey=1',
+        video_path
+    ]
+    result = subprocess.run(duration_cmd, capture_output=True, text=True, check=True)
+    return float(result.stdout.strip())
+
+
+def _render_vlog_single_pass(
+    segments: List[Dict[str, Any]],
+    temp_dir: str,
+    output_path: str,
+    settings: Dict[str, Any],
+    progress_callback: Callable[[float], None] | None = None,
+    stats: Dict[str, Any] | None = None,
+) -> float:
+    """以單一 ffmpeg 指令產生最終 Vlog（取代 逐段編碼 → concat → 音樂 trim / loop / fade / mix）。
     
-    clipped_videos = []
-    resolution = settings.get('resolution', '1080p')
+    每個片段是一個帶 -ss / -t 的 input（與 _clip_segment 相同的來源解析：本機副本 / presigned URL seek /
+    整檔下載），filter graph 內 trim + scale 後以 concat 串接；有背景音樂時 aloop → atrim → volume → afade
+    也在同一個 graph 裡，整支影片只解碼、編碼一次，中間不落地暫存檔。
     
-    # 解析解析度
-    resolution_map = {
-        '480p': '854:480',
-        '720p': '1280:720',
-        '1080p': '1920:1080'
-    }
-    scale = resolution_map.get(resolution, '1280:720')
+    Args:
+        segments: 同 _download_and_clip_segments
+        temp_dir: 臨時目錄
+        output_path: 最終 MP4 路徑
+        settings: 設定字典（resolution, clip_mode, music 等）
+        progress_callback: 可選，參數為 0~1 的完成比例（依 ffmpeg -progress 的 out_time）
+        stats: 有給時寫入 render_mode / clip_mode / sources / source_fetches / bytes_* 等（同 _download_and_clip_segments）
+    
+    Returns:
+        float: 影片時長（秒）
     
+    Raises:
+        沒有可用片段、片段數超過 VLOG_RENDER_MAX_INPUTS 或 ffmpeg 失敗時拋出例外，由呼叫端退回逐段流程
+    """
+    scale = _resolution_scale(settings)
+    clip_mode = str(settings.get('clip_mode') or VLOG_CLIP_MODE).lower()
+    if clip_mode not in ("seek", "download"):
+        clip_mode = "download"
+    if len(segments) > VLOG_RENDER_MAX_INPUTS:
+        raise ValueError(f"片段數 {len(segments)} 超過單次渲染上限 {VLOG_RENDER_MAX_INPUTS}")
+
+    # 解析每段錄影的來源（同一段錄影只解析 / 下載一次）
+    groups: Dict[Tuple[str, str], List[int]] = {}
     for idx, segment in enumerate(segments):
-        try:
-            # 下載原始視頻
-            bucket_name = segment["bucket"]
-            object_name = segment["object_name"]
-            event_id = segment.get("event_id")
-            
-            # 先檢查物件是否存在
+        groups.setdefault((segment["bucket"], segment["object_name"]), []).append(idx)
+    resolved: Dict[Tuple[str, str], Tuple[str, str, int]] = {}
+    with ThreadPoolExecutor(max_workers=max(1, min(VLOG_DOWNLOAD_WORKERS, len(groups) or 1)),
+                            thread_name_prefix="vlog-download") as pool:
+        futures = {
+            key: pool.submit(_resolve_segment_source, source_idx, key[0], key[1], temp_dir, clip_mode)
+            for source_idx, key in enumerate(groups)
+        }
+        for key, future in futures.items():
             try:
-                client.stat_object(bucket_name, object_name)
+                resolved[key] = future.result()
             except Exception as stat_err:
-                error_msg = f"S3 物件不存在: bucket={bucket_name}, object={object_name}, event_id={event_id}"
-                logger.error(f"[Vlog] {error_msg}, 錯誤: {stat_err}")
-                if progress_callback:
-                    try:
-                        progress_callback(idx, len(segments), False)
-                    except Exception as cb_err:
-                        logger.debug(f"進度回調錯誤: {cb_err}")
-                continue
-            
-            input_path = os.path.join(temp_dir, f"input_{idx}.mp4")
-            client.fget_object(bucket_name, object_name, input_path)
-            
-            # 使用 FFmpeg 剪輯視頻
-            output_path = os.path.join(temp_dir, f"clip_{idx}.mp4")
-            start_time = segment['clip_start']
-            duration = segment['clip_duration']
-            
-            # FFmpeg 命令：移除原始音軌（-an），只保留影像
-            cmd = [
-                'ffmpeg', '-y',
-                '-ss', str(start_time),
-                '-i', input_path,
-                '-t', str(duration),
-                '-vf', f'scale={scale}',
-                '-c:v', 'libx264',
-                '-preset', 'medium',
-                '-crf', '23',
-                '-an',  # 刪除原始音軌
-                output_path
+                logger.error(f"[Vlog] S3 物件不存在: bucket={key[0]}, object={key[1]}, 錯誤: {stat_err}")
+
+    music = None
+    log_path = os.path.join(temp_dir, "render.log")
+    try:
+        usable = [seg for seg in segments if (seg["bucket"], seg["object_name"]) in resolved]
+        if not usable:
+            raise ValueError("沒有可用的視頻片段")
+        over_http = any(source == "seek" for _, source, _ in resolved.values())
+
+        # verbose 才會輸出 "Statistics: N bytes read"（seek 的實際傳輸量）；log 寫到檔案，避免 pipe 塞滿
+        cmd = ['ffmpeg', '-y', '-nostats', '-progress', 'pipe:1', '-v', 'verbose' if over_http else 'error']
+        filters = []
+        total_duration = 0.0
+        for i, segment in enumerate(usable):
+            input_path, input_source, _ = resolved[(segment["bucket"], segment["object_name"])]
+            duration = float(segment['clip_duration'])
+            total_duration += duration
+            if input_source == "seek":
+                cmd += ['-rw_timeout', str(VLOG_SEEK_TIMEOUT_US)]
+            cmd += ['-ss', f"{float(segment['clip_start']):.3f}", '-t', f"{duration:.3f}", '-i', input_path]
+            filters.append(
+                f"[{i}:v]trim=duration={duration:.3f},setpts=PTS-STARTPTS,"
+                f"scale={scale},setsar=1,format=yuv420p[v{i}]"
+            )
+        filters.append("".join(f"[v{i}]" for i in range(len(usable))) + f"concat=n={len(usable)}:v=1:a=0[vout]")
+
+        music = _fetch_music_source(settings, temp_dir)
+        if music is not None:
+            cmd += ['-ss', f"{music['start']:.3f}", '-t', f"{music['duration']:.3f}", '-i', music["path"]]
+            # 音樂比影片短就循環、比影片長就裁到影片長度，再調音量與淡入淡出
+            chain = [
+                "aloop=loop=-1:size=2e+09",
+                f"atrim=duration={total_duration:.3f}",
+                "asetpts=PTS-STARTPTS",
+                f"volume={music['volume']:.2f}",
             ]
-            
-            subprocess.run(cmd, check=True, capture_output=True)
-            clipped_videos.append(output_path)
-            
-            # 刪除輸入文件以節省空間
+            fade_duration = min(2.0, total_duration / 2.0)
+            if music["fade"] and fade_duration > 0:
+                chain += [
+                    f"afade=t=in:st=0:d={fade_duration:.3f}",
+                    f"afade=t=out:st={max(total_duration - fade_duration, 0):.3f}:d={fade_duration:.3f}",
+                ]
+            filters.append(f"[{len(usable)}:a]{','.join(chain)}[aout]")
+
+        cmd += ['-filter_complex', ";".join(filters), '-map', '[vout]']
+        if music is not None:
+            cmd += ['-map', '[aout]', '-c:a', 'aac', '-b:a', '192k']
+        cmd += [
+            '-c:v', 'libx264',
+            '-preset', 'medium',
+            '-crf', '23',
+            '-movflags', '+faststart',
+            output_path
+        ]
+
+        logger.info(f"[Vlog] 單次渲染: {len(usable)} 個片段, 音樂={'有' if music else '無'}, 預計 {total_duration:.2f}秒")
+        with open(log_path, "wb") as log_file:
+            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=log_file, text=True)
             try:
-                os.remove(input_path)
-            except Exception as e:
-                logger.warning(f"刪除臨時輸入文件失敗: {e}")
-            
-            # 每處理 5 個片段後進行一次垃圾回收
-            if (idx + 1) % 5 == 0:
-                gc.collect()
-            
-            if progress_callback:
-                try:
-                    progress_callback(idx, len(segments), True)
-                except Exception as cb_err:
-                    logger.debug(f"進度回調錯誤: {cb_err}")
-            
-        except Exception as e:
-            error_type = type(e).__name__
-            error_msg = str(e)
-            logger.error(f"[Vlog] 處理片段 {idx} (event {event_id}) 時出錯: {error_type}: {error_msg}")
-            logger.error(f"[Vlog] 片段詳情: bucket={segment.get('bucket')}, object={segment.get('object_name')}, clip_start={segment.get('clip_start')}, clip_duration={segment.get('clip_duration')}")
-            
-            # 如果是 S3 錯誤，提供更詳細的信息
-            if "NoSuchKey" in error_msg or "Object does not exist" in error_msg:
-                logger.error(f"[Vlog] S3 物件不存在，可能原因：")
-                logger.error(f"[Vlog]   1. 影片檔案已被刪除")
-                logger.error(f"[Vlog]   2. 資料庫中的 s3_key 與實際 S3 檔案不一致")
-                logger.error(f"[Vlog]   3. 檔案上傳失敗但事件記錄已建立")
-            
-            if progress_callback:
+                for line in proc.stdout:
+                    m = _FFMPEG_OUT_TIME_RE.match(line.strip())
+                    if m and progress_callback and total_duration > 0:
+                        try:
+                            progress_callback(min(1.0, int(m.group(1)) / 1_000_000 / total_duration))
+                        except Exception as cb_err:
+                            logger.debug(f"進度回調錯誤: {cb_err}")
+                returncode = proc.wait()
+            finally:
+                if proc.poll() is None:
+                    proc.kill()
+                    proc.wait()
+        with open(log_path, "r", encoding="utf-8", errors="replace") as f:
+            log_text = f.read()
+        if returncode != 0:
+            raise RuntimeError(f"ffmpeg 單次渲染失敗 (returncode={returncode}): {log_text[-2000:]}")
+
+        duration = _probe_duration(output_path)
+        max_duration = settings.get('max_duration', 180) if settings else 180
+        if duration > max_duration * 1.1:  # 允許 10% 的誤差
+            logger.warning(f"[Vlog] 渲染後的影片時長 ({duration:.2f}秒) 超過預期 ({max_duration}秒)")
+
+        if stats is not None:
+            bytes_downloaded = sum(os.path.getsize(path) for path, source, _ in resolved.values()
+                                   if source in ("fetched", "download") and os.path.exists(path))
+            bytes_seeked = sum(int(n) for n in _FFMPEG_BYTES_READ_RE.findall(log_text)) if over_http else 0
+            baseline = sum(resolved[key][2] * len(members) for key, members in groups.items() if key in resolved)
+            stats.update({
+                "render_mode": "single",
+                "clip_mode": clip_mode,
+                "sources": len(groups),
+                "source_fetches": sum(1 for _, source, _ in resolved.values() if source in ("fetched", "download")),
+                "seek_clips": sum(1 for seg in usable if resolved[(seg["bucket"], seg["object_name"])][1] == "seek"),
+                "bytes_downloaded": bytes_downloaded,
+                "bytes_seeked": bytes_seeked,
+                "bytes_transferred": bytes_downloaded + bytes_seeked,
+                "bytes_saved": max(0, baseline - bytes_downloaded - bytes_seeked),
+                # 單次渲染不經過剪輯片段快取；照樣回報，job metrics 的欄位才會一致
+                "clip_cache_lookups": 0,
+                "clip_cache_hits": 0,
+                "clip_cache_hit_ratio": 0.0,
+            })
+        logger.info(f"[Vlog] 單次渲染完成: {output_path} ({duration:.2f}秒)")
+        return duration
+    finally:
+        # 只刪除下載到任務暫存目錄的輸入文件；共享磁碟 / 節點快取的檔案留給其他任務
+        cleanup = [path for path, source, _ in resolved.values() if source == "download"]
+        if music is not None:
+            cleanup.append(music["path"])
+        for path in cleanup + [log_path]:
+            if os.path.exists(path):
                 try:
-                    progress_callback(idx, len(segments), False)
-                except Exception as cb_err:
-                    logger.debug(f"進度回調錯誤: {cb_err}")
-            continue
-    
-    # 所有片段處理完成後，進行最終垃圾回收
-    gc.collect()
-    return clipped_videos
+                    os.remove(path)
+                except Exception as e:
+                    logger.warning(f"刪除臨時文件失敗: {e}")
+        gc.collect()
 
 
 def _merge_videos(
@@ -1521,30 +1976,18 @@ def _generate_thumbnail(video_path: str, thumbnail_path: str) -> bool:
         return False
 
 
-def _apply_music_track(
-    video_path: str,
-    temp_dir: str,
-    settings: Dict[str, Any],
-) -> str:
-    """將背景音樂與影片合成。
+def _fetch_music_source(settings: Dict[str, Any], temp_dir: str) -> Dict[str, Any] | None:
+    """下載背景音樂並解析選取範圍。
     
-    從 MinIO 下載音樂檔案，使用 FFmpeg 將音樂與影片合併。
-    
-    Args:
-        video_path: 影片文件路徑
-        temp_dir: 臨時目錄
-        settings: 設定字典，包含 music 配置（s3_key 等）
-        
     Returns:
-        str: 合成後的影片路徑（如果音樂處理失敗，返回原始路徑）
+        {"path", "start", "duration", "volume", "fade"}；沒有設定音樂、下載失敗或範圍無效時回傳 None
     """
-    logger.info(f"[Vlog] 開始套用背景音樂，settings: {settings}")
     music_cfg = (settings or {}).get("music") or {}
     logger.info(f"[Vlog] 音樂設定: {music_cfg}")
     s3_key = music_cfg.get("s3_key")
     if not s3_key:
         logger.warning(f"[Vlog] 沒有音樂 s3_key，跳過音樂處理")
-        return video_path
+        return None
 
     from minio import Minio
 
@@ -1562,7 +2005,7 @@ def _apply_music_track(
             bucket, object_name = _parse_s3_path(s3_key)
         except ValueError as exc:
             logger.error(f"[Vlog] 音樂 s3_key 解析失敗: {exc}")
-            return video_path
+            return None
     else:
         # 直接使用 MINIO_BUCKET，整個 s3_key 作為 object_name
         bucket = MINIO_BUCKET
@@ -1577,15 +2020,49 @@ def _apply_music_track(
         logger.info(f"[Vlog] 音樂下載成功: {music_source_path}")
     except Exception as exc:
         logger.error(f"[Vlog] 下載背景音樂失敗: {exc}")
-        return video_path
+        return None
 
     start_time = float(music_cfg.get("start") or 0.0)
     end_time = float(music_cfg.get("end") or 0.0)
     if end_time <= start_time:
         logger.warning("[Vlog] 音樂選取範圍無效，忽略背景音樂")
-        return video_path
+        return None
+
+    volume = float(music_cfg.get("volume")) if music_cfg.get("volume") is not None else 0.6
+    return {
+        "path": music_source_path,
+        "start": max(start_time, 0.0),
+        "duration": max(end_time - start_time, 1.0),
+        "volume": max(0.0, min(1.0, volume)),
+        "fade": bool(music_cfg.get("fade", True)),
+    }
 
-    clip_duration = max(end_time - start_time, 1.0)
+
+def _apply_music_track(
+    video_path: str,
+    temp_dir: str,
+    settings: Dict[str, Any],
+) -> str:
+    """將背景音樂與影片合成。
+    
+    從 MinIO 下載音樂檔案，使用 FFmpeg 將音樂與影片合併。
+    
+    Args:
+        video_path: 影片文件路徑
+        temp_dir: 臨時目錄
+        settings: 設定字典，包含 music 配置（s3_key 等）
+        
+    Returns:
+        str: 合成後的影片路徑（如果音樂處理失敗，返回原始路徑）
+    """
+    logger.info(f"[Vlog] 開始套用背景音樂，settings: {settings}")
+    music = _fetch_music_source(settings, temp_dir)
+    if music is None:
+        return video_path
+    music_cfg = (settings or {}).get("music") or {}
+    music_source_path = music["path"]
+    start_time = music["start"]
+    clip_duration = music["duration"]
     music_clip_path = os.path.join(temp_dir, "music_clip.m4a")
     trim_cmd = [
         'ffmpeg', '-y',
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 讓測試可以 import app.*（與 celery -A app.main:app 相同的根目錄）
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,232 @@
+"""FrameBatch：欄位式幀容器、分層儲存與 checkpoint 序列化。"""
+import io
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("cv2")
+
+from app.libs.frame_batch import FrameBatch, SKIPPED_CAPTION  # noqa: E402
+
+H, W = 24, 32
+
+
+def _frame(value):
+    return np.full((H, W, 3), value, dtype=np.uint8)
+
+
+def test_columns_grow_and_keep_values():
+    batch = FrameBatch(capacity=2)
+    rows = batch.extend([0.0, 0.5, 1.0])  # 超過 capacity → 擴充
+    batch.variance[rows] = [1.0, 2.0, 3.0]
+    row = batch.append(1.5)
+
+    assert rows == slice(0, 3)
+    assert row == 3
+    assert len(batch) == 4
+    np.testing.assert_array_equal(batch.stamp, [0.0, 0.5, 1.0, 1.5])
+    np.testing.assert_array_equal(batch.variance[:3], [1.0, 2.0, 3.0])
+    assert np.isnan(batch.variance[3])
+    assert not batch.is_significant.any()
+    assert batch.captions == [None] * 4
+
+
+def test_selected_and_caption_candidates():
+    batch = FrameBatch(capacity=4, image_slots=1)
+    rows = batch.extend([0.0, 1.0, 2.0, 3.0])
+    batch.is_not_blurry[rows] = [True, True, False, True]
+    batch.is_significant[rows] = [True, True, True, False]
+    batch.set_image(1, _frame(1))
+
+    np.testing.assert_array_equal(batch.selected(), [0, 1])
+    np.testing.assert_array_equal(batch.caption_candidates(), [1])
+
+    batch.captions[0] = "a person sits down"
+    batch.captions[2] = SKIPPED_CAPTION
+    assert batch.captioned_count() == 1
+
+
+def test_image_slots_are_reused():
+    batch = FrameBatch(capacity=4, image_slots=1)
+    batch.extend([0.0, 1.0, 2.0])
+    batch.set_image(0, _frame(1))
+    batch.set_image(1, _frame(2))  # 緩衝區從 1 個 slot 擴充到 2 個
+    allocated = batch.tier_bytes()["candidate"]
+
+    batch.drop_image(0)
+    batch.set_image(2, _frame(3))  # 重用 row 0 還回來的 slot
+
+    assert allocated == 2 * H * W * 3
+    assert batch.tier_bytes()["candidate"] == allocated
+    assert batch.image(0) is None
+    np.testing.assert_array_equal(batch.image(1), _frame(2))
+    np.testing.assert_array_equal(batch.image(2), _frame(3))
+    with pytest.raises(ValueError):
+        batch.set_image(0, np.zeros((H * 2, W, 3), dtype=np.uint8))
+
+
+def test_dicts_round_trip():
+    frames = [
+        {"stamp": 0.0, "variance": 12.5, "is_not_blurry": True, "ssim_value": None, "mse_value": None,
+         "is_significant": True, "caption": "a person sits down", "frame": _frame(7)},
+        {"stamp": 1.0, "variance": 3.0, "is_not_blurry": False, "ssim_value": 0.5, "mse_value": 7.0,
+         "is_significant": False, "caption": None},
+    ]
+
+    batch = FrameBatch.from_dicts(frames)
+    out = batch.to_dicts()
+    out_with_images = batch.to_dicts(include_images=True)
+
+    for original, item in zip(frames, out):
+        for key, value in original.items():
+            if key != "frame":
+                assert item[key] == value, key
+        assert "frame" not in item
+    np.testing.assert_array_equal(out_with_images[0]["frame"], _frame(7))
+    assert out_with_images[1]["frame"] is None
+
+
+def test_unknown_codec_is_rejected():
+    with pytest.raises(ValueError):
+        FrameBatch(codec="png")
+
+
+@pytest.mark.parametrize("codec", ["jpeg", "webp"])
+def test_compressed_candidate_tier(codec):
+    batch = FrameBatch(capacity=2, codec=codec, quality=90)
+    batch.extend([0.0, 1.0])
+    batch.set_image(0, _frame(128))
+
+    decoded = batch.image(0)
+    stored = batch.tier_bytes()["candidate"]
+
+    assert decoded.shape == (H, W, 3)
+    assert np.abs(decoded.astype(np.int16) - 128).max() <= 3
+    assert 0 < stored < _frame(128).nbytes
+
+    batch.drop_image(0)
+    assert batch.image(0) is None
+    assert batch.tier_bytes()["candidate"] == 0
+    assert batch.peak_tier_bytes["candidate"] == stored
+
+
+def test_analysis_tier():
+    cv2 = pytest.importorskip("cv2")
+    rng = np.random.default_rng(0)
+    gray = rng.integers(0, 256, size=(3, H, W), dtype=np.uint8)
+    batch = FrameBatch(capacity=1, analysis_width=16)
+    rows = batch.extend([0.0, 1.0, 2.0])
+
+    batch.set_analysis(rows, gray)
+    batch.append(3.0)  # 擴充時保留既有的小圖
+
+    stack = batch.analysis_stack()
+    assert stack.shape == (4, 12, 16)
+    np.testing.assert_array_equal(batch.analysis(0), cv2.resize(gray[0], (16, 12), interpolation=cv2.INTER_AREA))
+    assert batch.tier_bytes()["analysis"] >= 4 * 12 * 16
+    with pytest.raises(ValueError):
+        batch.set_analysis(slice(3, 4), np.zeros((1, H * 2, W), dtype=np.uint8))
+
+    batch.set_image(0, _frame(1))
+    batch.release_images()  # candidate 釋放，analysis 保留
+    assert batch.tier_bytes()["candidate"] == 0
+    assert batch.analysis_stack() is not None
+
+
+def test_analysis_tier_disabled():
+    batch = FrameBatch(analysis_width=0)
+    rows = batch.extend([0.0])
+    batch.set_analysis(rows, np.zeros((1, H, W), dtype=np.uint8))
+    assert batch.analysis_stack() is None
+    assert batch.tier_bytes()["analysis"] == 0
+
+
+# ---- to_bytes / from_bytes（job checkpoint）----
+COLUMNS = ["stamp", "variance", "ssim_value", "mse_value", "is_not_blurry", "is_significant", "has_activity"]
+
+
+def _make_batch(codec):
+    rng = np.random.default_rng(0)
+    batch = FrameBatch(capacity=2, image_slots=1, codec=codec, quality=90, analysis_width=16)
+    rows = batch.extend([0.0, 0.5, 1.0, 1.5])
+    batch.variance[rows] = [10.0, 120.5, 80.25, 300.0]
+    batch.ssim_value[rows] = [np.nan, 0.5, 0.75, 0.25]
+    batch.mse_value[rows] = [np.nan, 12.0, 3.5, 40.0]
+    batch.is_not_blurry[rows] = [False, True, True, True]
+    batch.is_significant[rows] = [True, True, False, True]
+    batch.has_activity[rows] = [True, True, True, False]
+    batch.captions[1] = "a person sits down"
+    batch.set_analysis(rows, rng.integers(0, 256, size=(4, H, W), dtype=np.uint8))
+    for row in (1, 3):
+        batch.set_image(row, rng.integers(0, 256, size=(H, W, 3), dtype=np.uint8))
+    return batch
+
+
+@pytest.mark.parametrize("codec", ["raw", "jpeg", "webp"])
+def test_checkpoint_round_trip(codec):
+    batch = _make_batch(codec)
+    extra = {"stage": "caption", "video_info": {"fps": 2.0}}
+
+    restored, restored_extra = FrameBatch.from_bytes(batch.to_bytes(extra=extra))
+
+    assert restored_extra == extra
+    assert restored.codec == codec
+    assert restored.quality == batch.quality
+    assert restored.analysis_width == batch.analysis_width
+    assert len(restored) == len(batch)
+    for name in COLUMNS:
+        np.testing.assert_array_equal(getattr(restored, name), getattr(batch, name))
+    assert restored.captions == batch.captions
+
+    # analysis tier
+    assert restored.analysis_stack().shape == (4, 12, 16)
+    np.testing.assert_array_equal(restored.analysis_stack(), batch.analysis_stack())
+
+    # candidate tier：壓縮 codec 保存原本的 bytes，解碼結果應完全相同
+    np.testing.assert_array_equal(restored.has_image(), [False, True, False, True])
+    for row in (1, 3):
+        np.testing.assert_array_equal(restored.image(row), batch.image(row))
+    assert restored.tier_bytes()["candidate"] > 0
+    np.testing.assert_array_equal(restored.selected(), batch.selected())
+
+
+def test_checkpoint_round_trip_without_images_or_analysis():
+    batch = FrameBatch(codec="jpeg")
+    batch.extend([0.0, 1.0])
+
+    restored, extra = FrameBatch.from_bytes(batch.to_bytes())
+
+    assert extra == {}
+    assert len(restored) == 2
+    assert restored.analysis_stack() is None
+    assert not restored.has_image().any()
+    assert restored.tier_bytes() == {"analysis": 0, "candidate": 0}
+
+
+# ---- has_activity（activity pre-detector）----
+def test_inactive_frames_are_not_selected():
+    batch = FrameBatch(capacity=3, image_slots=1)
+    rows = batch.extend([0.0, 1.0, 2.0])
+    batch.is_not_blurry[rows] = True
+    batch.is_significant[rows] = True
+    batch.set_image(2, _frame(1))
+
+    assert batch.has_activity.all()  # 預設 True
+    batch.has_activity[1] = False
+
+    np.testing.assert_array_equal(batch.selected(), [0, 2])
+    np.testing.assert_array_equal(batch.caption_candidates(), [2])
+    assert [item["has_activity"] for item in batch.to_dicts()] == [True, False, True]
+
+
+def test_checkpoint_without_has_activity_keeps_default():
+    """舊版 checkpoint 沒有 has_activity 欄位時維持預設值 True。"""
+    data = _make_batch("jpeg").to_bytes()
+    with np.load(io.BytesIO(data), allow_pickle=False) as z:
+        arrays = {name: z[name] for name in z.files if name != "has_activity"}
+    buf = io.BytesIO()
+    np.savez(buf, **arrays)
+
+    restored, _ = FrameBatch.from_bytes(buf.getvalue())
+
+    assert restored.has_activity.all()
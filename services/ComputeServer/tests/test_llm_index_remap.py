@@ -0,0 +1,110 @@
+"""LLM prompt 合併 caption 後，組 index → 原始幀 index 的還原。"""
+import copy
+import difflib
+
+import pytest
+
+vp = pytest.importorskip("app.tasks.videosprocessing")
+
+CAPTIONS = [
+    "An elderly man is sitting on the sofa.",
+    "An elderly man is sitting on a sofa",        # 與第一句相似度 ≥ 0.9 → 同一組
+    "An elderly man is sitting on the sofa.",
+    "An elderly man is walking into the kitchen",
+    "The kitchen is empty",
+    "The kitchen is empty",
+]
+
+
+def _frames_summary():
+    return [{"index": i, "stamp": float(i), "caption": c} for i, c in enumerate(CAPTIONS)]
+
+
+def _norm(caption):
+    return vp._CAPTION_NORM_RE.sub(" ", caption.lower()).strip()
+
+
+def test_similar_captions_are_merged():
+    assert difflib.SequenceMatcher(None, _norm(CAPTIONS[1]), _norm(CAPTIONS[0])).ratio() >= 0.9
+
+    groups, group_ranges = vp._encode_frames_for_prompt(_frames_summary(), merge_ratio=0.9)
+
+    assert group_ranges == [(0, 2), (3, 3), (4, 5)]
+    assert [g["index"] for g in groups] == [0, 1, 2]
+    assert groups[0]["stamp"] == 0.0 and groups[0]["until"] == 2.0
+    assert "until" not in groups[1]
+
+
+def test_merge_disabled_keeps_one_group_per_frame():
+    _, group_ranges = vp._encode_frames_for_prompt(_frames_summary(), merge_ratio=1.1)
+    assert group_ranges == [(i, i) for i in range(len(CAPTIONS))]
+
+
+def test_remap_expands_groups_to_frame_ranges():
+    frames_summary = _frames_summary()
+    _, group_ranges = vp._encode_frames_for_prompt(frames_summary, merge_ratio=0.9)
+    events = [
+        {"start_index": 0, "end_index": 1, "summary": "坐在沙發上後走進廚房"},
+        {"start_index": 2, "end_index": 2, "summary": "廚房沒有人"},
+    ]
+    result = {"final_answer": {"events": events}, "rounds": [{"events": copy.deepcopy(events)}]}
+
+    remapped = vp._remap_llm_indices(result, group_ranges, len(frames_summary))
+
+    for evs in (remapped["final_answer"]["events"], remapped["rounds"][0]["events"]):
+        assert [(e["start_index"], e["end_index"]) for e in evs] == [(0, 3), (4, 5)]
+
+
+def test_out_of_range_group_is_clamped_to_frame_count():
+    frames_summary = _frames_summary()
+    frame_count = len(frames_summary)
+    _, group_ranges = vp._encode_frames_for_prompt(frames_summary, merge_ratio=0.9)
+    result = {"final_answer": {"events": [
+        {"start_index": 1, "end_index": 3, "summary": "超出範圍"},   # 只有 3 組，3 超出
+        {"start_index": -1, "end_index": 0, "summary": "負數"},
+    ]}}
+
+    remapped = vp._remap_llm_indices(result, group_ranges, frame_count)
+    first, second = remapped["final_answer"]["events"]
+    assert first["start_index"] == 3
+    assert first["end_index"] >= frame_count  # 保持超出原始範圍，交給下游夾限並計數
+    assert second["start_index"] == -1
+
+    built, clamp_count = vp._build_events_from_llm_by_index(remapped, frames_summary)
+    assert clamp_count == 2
+    assert built[0]["start_time"] == 3.0
+    assert built[0]["end_time"] == float(frame_count - 1)
+    assert built[1]["start_time"] == 0.0
+
+
+def test_non_integer_indices_are_left_untouched():
+    result = {"final_answer": {"events": [{"start_index": "x", "end_index": None}]}}
+    remapped = vp._remap_llm_indices(result, [(0, 1)], 2)
+    assert remapped["final_answer"]["events"][0] == {"start_index": "x", "end_index": None}
+
+
+def test_cached_grouped_result_remaps_to_same_frames(tmp_path, monkeypatch):
+    """快取存的是組 index：put → get → remap 要得到跟第一次一樣的原始幀 index。"""
+    from app.libs import llm_cache
+
+    monkeypatch.setattr(llm_cache, "LLM_CACHE_BACKEND", "disk")
+    monkeypatch.setattr(llm_cache, "LLM_CACHE_DIR", str(tmp_path))
+    frames_summary = _frames_summary()
+    _, group_ranges = vp._encode_frames_for_prompt(frames_summary, merge_ratio=0.9)
+    grouped = {"final_answer": {"events": [
+        {"start_index": 0, "end_index": 1, "summary": "坐在沙發上後走進廚房"},
+        {"start_index": 2, "end_index": 2, "summary": "廚房沒有人"},
+    ]}}
+
+    first = vp._remap_llm_indices(grouped, group_ranges, len(frames_summary))
+    llm_cache.put_cached_response("k", grouped, {"total_tokens": 10})
+    cached = llm_cache.get_cached_response("k")
+    second = vp._remap_llm_indices(cached["result"], group_ranges, len(frames_summary))
+
+    expected = [(0, 3), (4, 5)]
+    assert cached["result"] == {"final_answer": {"events": [
+        {"start_index": 0, "end_index": 1, "summary": "坐在沙發上後走進廚房"},
+        {"start_index": 2, "end_index": 2, "summary": "廚房沒有人"},
+    ]}}
+    for remapped in (first, second):
+        assert [(e["start_index"], e["end_index"]) for e in remapped["final_answer"]["events"]] == expected